@@ -2,50 +2,123 @@ import os
 import pickle
 import time
 import warnings
-import random
+import threading
+from collections import deque, defaultdict
+from contextlib import contextmanager
 import numpy as np
 import faiss
 import cv2
-import mediapipe as mp
-from insightface.app import FaceAnalysis
+
+import index_tiers
+from enroll_log import LoggedFaceDB, Compactor
+from liveness import FaceMeshDetector, LivenessChallenge
+from face_engine import FaceEngine
 
 warnings.filterwarnings("ignore")
 
-# --- HELPER CLASS ---
-class FaceMeshDetector:
+# --- LIVENESS PIPELINE ---
+class StageTimer:
+    """Accumulates wall time per pipeline stage."""
     def __init__(self):
-        self.mp_face_mesh = mp.solutions.face_mesh
-        self.face_mesh = self.mp_face_mesh.FaceMesh(
-            min_detection_confidence=0.5, min_tracking_confidence=0.5)
-
-    def get_metrics(self, image):
-        """Returns (ear, mar, yaw) efficiently."""
-        results = self.face_mesh.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        if not results.multi_face_landmarks: return None, None, None
-        
-        lm = results.multi_face_landmarks[0].landmark
-        
-        # EAR (Left Eye)
-        v_dist = np.sqrt((lm[159].x - lm[145].x)**2 + (lm[159].y - lm[145].y)**2)
-        h_dist = np.sqrt((lm[133].x - lm[33].x)**2 + (lm[133].y - lm[33].y)**2)
-        ear = v_dist / h_dist if h_dist > 0 else 0
-
-        # MAR (Smile)
-        mouth_w = np.sqrt((lm[61].x - lm[291].x)**2 + (lm[61].y - lm[291].y)**2)
-        face_w = np.sqrt((lm[234].x - lm[454].x)**2 + (lm[234].y - lm[454].y)**2)
-        mar = mouth_w / face_w if face_w > 0 else 0
-
-        # Yaw (Head Turn)
-        nose_x = lm[1].x
-        cheek_l_x = lm[33].x
-        cheek_r_x = lm[263].x
-        face_width = cheek_r_x - cheek_l_x
-        if face_width == 0: return ear, mar, 0
-        
-        ratio = (nose_x - cheek_l_x) / face_width
-        yaw = (ratio - 0.5) * 180 
-        
-        return ear, mar, yaw
+        self.total_ms = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    @contextmanager
+    def __call__(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.total_ms[stage] += (time.perf_counter() - start) * 1000
+            self.calls[stage] += 1
+
+    def add(self, stage, ms):
+        self.total_ms[stage] += ms
+        self.calls[stage] += 1
+
+    def summary(self):
+        return {s: (self.calls[s], self.total_ms[s] / self.calls[s]) for s in self.total_ms}
+
+class FrameGrabber:
+    """Captures + mirrors frames on its own thread into a small ring buffer.
+    The consumer always gets the newest frame; older ones are dropped."""
+    def __init__(self, src=0, buffer_size=2, timer=None):
+        self.cap = cv2.VideoCapture(src)
+        self.frames = deque(maxlen=buffer_size)
+        self.cond = threading.Condition()
+        self.timer = timer
+        self.running = False
+        self.captured = 0
+        self.dropped = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while self.running:
+            start = time.perf_counter()
+            ret, frame = self.cap.read()
+            if not ret: break
+            frame = cv2.flip(frame, 1)
+            if self.timer: self.timer.add("capture", (time.perf_counter() - start) * 1000)
+
+            with self.cond:
+                if len(self.frames) == self.frames.maxlen: self.dropped += 1
+                self.frames.append(frame)
+                self.captured += 1
+                self.cond.notify()
+
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+    def read(self, timeout=1.0):
+        with self.cond:
+            self.cond.wait_for(lambda: self.frames or not self.running, timeout)
+            if not self.frames: return None
+            frame = self.frames.pop()
+            self.dropped += len(self.frames)
+            self.frames.clear()
+            return frame
+
+    def stop(self):
+        self.running = False
+        self.thread.join(timeout=1.0)
+        self.cap.release()
+
+class LandmarkTracker:
+    """Runs FaceMesh every `detect_every` frames and tracks the key
+    landmarks with Lucas-Kanade optical flow on the frames in between."""
+    def __init__(self, detector, detect_every=2):
+        self.detector = detector
+        self.detect_every = detect_every
+        self.points = None      # pixel coords of KEY_LANDMARKS
+        self.prev_gray = None
+        self.frame_idx = 0
+
+    def update(self, frame, gray, timer):
+        h, w = gray.shape
+        scale = np.array([w, h], dtype=np.float32)
+
+        if self.points is None or self.frame_idx % self.detect_every == 0:
+            with timer("landmarks"):
+                points = self.detector.get_landmarks(frame)
+            self.points = points * scale if points is not None else None
+        else:
+            with timer("tracking"):
+                moved, status, _ = cv2.calcOpticalFlowPyrLK(
+                    self.prev_gray, gray, self.points.reshape(-1, 1, 2), None,
+                    winSize=(21, 21), maxLevel=2)
+            # Lost a point -> force a full landmark pass next frame
+            self.points = moved.reshape(-1, 2) if status.all() else None
+
+        self.prev_gray = gray
+        self.frame_idx += 1
+        if self.points is None: return None, None, None
+        return FaceMeshDetector.metrics_from_points(self.points / scale)
 
 # --- MAIN SYSTEM ---
 class FaceAuthSystem:
@@ -79,17 +152,24 @@ class FaceAuthSystem:
         print("="*30 + "\n")
 
         print("Loading ArcFace model (Lightweight Mode)...")
-        # Using buffalo_s for optimization
-        self.app = FaceAnalysis(name='buffalo_s', providers=['CPUExecutionProvider'])
-        self.app.prepare(ctx_id=0, det_size=(640, 640))
+        # Using buffalo_s for optimization, detection + recognition heads only
+        self.app = FaceEngine(name='buffalo_s', det_size=(640, 640))
         self.dimension = 512
         
-        if os.path.exists(db_path):
-            self.index = faiss.read_index(db_path)
-            with open(map_path, 'rb') as f: self.user_map = pickle.load(f)
-        else:
-            self.index = faiss.IndexFlatIP(self.dimension)
-            self.user_map = {} 
+        # Snapshot + append-only enrollment log, compacted in the background
+        self.db = LoggedFaceDB(
+            db_path, map_path,
+            new_index=lambda: index_tiers.new_index(self.dimension),
+            apply_meta=self._apply_enrollment,
+            retier=index_tiers.maybe_migrate
+        )
+        self.user_map = self.db.user_map
+        self.compactor = Compactor(self.db, interval=60)
+        self.compactor.start()
+
+    @staticmethod
+    def _apply_enrollment(user_map, start_id, count, user_name):
+        user_map[start_id] = user_name
 
     def save_security_state(self):
         state = {
@@ -100,13 +180,10 @@ class FaceAuthSystem:
             pickle.dump(state, f)
 
     def get_embedding(self, img_array):
-        faces = self.app.get(img_array)
-        if not faces: return None, 0.0
-        face = sorted(faces, key=lambda x: (x.bbox[2]-x.bbox[0]) * (x.bbox[3]-x.bbox[1]))[-1]
-        embedding = face.embedding
-        vector = np.array([embedding], dtype='float32')
-        faiss.normalize_L2(vector)
-        return vector[0], face.det_score
+        # Largest face only; the recognition model sees just its crop
+        face = self.app.detect_face(img_array)
+        if face is None: return None, 0.0
+        return self.app.embed([face.crop])[0], face.det_score
 
     def enroll_user(self, user_name, mode='camera'):
         if mode == 'camera':
@@ -136,93 +213,70 @@ class FaceAuthSystem:
         avg_emb = np.mean(embeddings, axis=0)
         vector = np.array([avg_emb], dtype='float32')
         faiss.normalize_L2(vector)
-        self.index.add(vector)
-        self.user_map[self.index.ntotal - 1] = user_name 
-        faiss.write_index(self.index, self.db_path)
-        with open(self.map_path, 'wb') as f: pickle.dump(self.user_map, f)
+        self.db.add(vector, user_name)
+        self.db.log.sync()
         print(f"SUCCESS: Enrolled {user_name}")
 
     # --- RANDOMIZED LIVENESS CHECK ---
-    def verify_liveness_video(self):
-        cap = cv2.VideoCapture(0)
-        
-        challenges = ["BLINK", "SMILE", "TURN"]
-        random.shuffle(challenges)
+    def verify_liveness_video(self, detect_every=2):
+        timer = StageTimer()
+        grabber = FrameGrabber(0, timer=timer).start()
+        tracker = LandmarkTracker(self.liveness_detector, detect_every=detect_every)
+        challenge = LivenessChallenge(timeout=60)
         
         print("\n--- ACTIVE PROOF OF LIFE ---")
-        print(f"Randomized Sequence: {' -> '.join(challenges)} -> CENTER")
+        print(f"Randomized Sequence: {' -> '.join(challenge.challenges)} -> CENTER")
         
         start_time = time.time()
-        step_idx = 0
-        blink_closed = False
-        
-        best_frame = None
-        best_quality_score = 0.0
-        
-        BLINK_THRESH = 0.30       
-        SMILE_THRESH = 0.45       
+        processed = 0
+
+        def finish(result):
+            grabber.stop(); cv2.destroyAllWindows()
+            self._report_liveness_timings(timer, grabber, processed, time.time() - start_time)
+            return result
         
         while True:
-            ret, frame = cap.read()
-            if not ret: break
-            frame = cv2.flip(frame, 1)
+            frame = grabber.read()
+            if frame is None: break
+            processed += 1
             
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            blur_score = cv2.Laplacian(gray, cv2.CV_64F).var()
+            with timer("preprocess"):
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
             
-            ear, smile_ratio, yaw = self.liveness_detector.get_metrics(frame)
-            if ear is None: continue
+            metrics = tracker.update(frame, gray, timer)
+            if metrics[0] is None: continue
 
-            if abs(yaw) < 10 and step_idx < 3 and blur_score > best_quality_score:
-                best_quality_score = blur_score
-                best_frame = frame.copy()
+            with timer("challenge"):
+                verified = challenge.update(metrics, frame, gray)
+            if verified and verified != "CENTER":
+                print(f">> {verified} Verified!")
 
-            if time.time() - start_time > 60:
-                cap.release(); cv2.destroyAllWindows()
-                return False, None
+            if challenge.state == "failed":
+                return finish((False, None))
+            if challenge.state == "passed":
+                cv2.putText(frame, "VERIFIED", (50,100), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,255,0), 2)
+                cv2.imshow("Check", frame); cv2.waitKey(500)
+                return finish((True, challenge.result_frame()))
 
-            status = "Align Face"
-            
-            if step_idx < 3:
-                current_challenge = challenges[step_idx]
-                status = f"Step {step_idx + 1}: {current_challenge} NOW!"
-                
-                if current_challenge == "BLINK":
-                    if not blink_closed:
-                        if ear < BLINK_THRESH: blink_closed = True
-                    else:
-                        if ear > BLINK_THRESH + 0.05:
-                            print(f">> {current_challenge} Verified!")
-                            step_idx += 1; blink_closed = False 
-
-                elif current_challenge == "SMILE":
-                    bar_len = int((smile_ratio - 0.35) * 400)
+            with timer("display"):
+                if challenge.current == "SMILE":
+                    bar_len = int((metrics[1] - 0.35) * 400)
                     cv2.rectangle(frame, (20, 400), (20 + max(0, min(bar_len, 200)), 420), (0, 255, 255), -1)
-                    if smile_ratio > SMILE_THRESH:
-                        print(f">> {current_challenge} Verified!")
-                        step_idx += 1; time.sleep(0.5)
-
-                elif current_challenge == "TURN":
-                    if abs(yaw) > 12:
-                        print(f">> {current_challenge} Verified!")
-                        step_idx += 1
-
-            else:
-                status = "Final Step: Look at Camera"
-                if abs(yaw) < 8:
-                    cv2.putText(frame, "VERIFIED", (50,100), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,255,0), 2)
-                    cv2.imshow("Check", frame); cv2.waitKey(500)
-                    cap.release(); cv2.destroyAllWindows()
-                    return True, (best_frame if best_frame is not None else frame)
-
-            color = (0, 255, 0) if step_idx < 3 else (0, 255, 255)
-            cv2.putText(frame, status, (30, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
-            cv2.imshow("Check", frame)
+                color = (0, 255, 0) if challenge.current != "CENTER" else (0, 255, 255)
+                cv2.putText(frame, challenge.instruction(), (30, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
+                cv2.imshow("Check", frame)
+                key = cv2.waitKey(1)
             
-            if cv2.waitKey(1) == 27: break
+            if key == 27: break
         
-        cap.release(); cv2.destroyAllWindows()
-        return False, None
+        return finish((False, None))
+
+    def _report_liveness_timings(self, timer, grabber, processed, elapsed):
+        print("\n[LIVENESS TIMINGS]")
+        for stage, (calls, avg_ms) in timer.summary().items():
+            print(f"   {stage:<10} {avg_ms:7.2f} ms avg  ({calls} calls)")
+        fps = processed / elapsed if elapsed > 0 else 0
+        print(f"   captured {grabber.captured} | processed {processed} ({fps:.1f} fps) | dropped {grabber.dropped}")
 
     # --- AUTHENTICATE ---
     def authenticate(self):
@@ -259,7 +313,7 @@ class FaceAuthSystem:
 
             if emb is None: raise ValueError("No Face")
 
-            dists, ids = self.index.search(np.array([emb]), k=1)
+            dists, ids = self.db.index.search(np.array([emb]), k=1)
             sim_score = dists[0][0]
             session_conf = (sim_score * 0.7) + (quality * 0.3)
             
@@ -0,0 +1,503 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import faiss
+import numpy as np
+
+import index_tiers
+
+
+# =========================
+# CONFIG
+# =========================
+VECTOR_DIM = 512
+PACK = "buffalo_l"
+SEED = 0
+
+# get_embedding: frame sizes (w, h) x detector fallback sizes
+IMAGE_SIZES = [(640, 480), (1280, 720), (1920, 1080), (3840, 2160)]
+DET_SIZES = [(320, 320), (512, 512), (640, 640)]
+EMBED_REPEATS = 20
+
+# index.search: database sizes x tiers (x compressed codes)
+DB_SIZES = [1_000, 10_000, 100_000]
+INDEX_KINDS = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+SEARCH_QUERIES = 200
+SEARCH_K = 10
+VECTORS_PER_USER = 5      # random embeddings come in per-user clusters
+USER_SPREAD = 0.3         # noise around each user's centre, before re-normalising
+
+# /authenticate: concurrent clients, requests per level, enrolled vectors
+CONCURRENCY = [1, 4, 16, 64]
+AUTH_REQUESTS = 200
+AUTH_IMAGE_SIZE = (1280, 720)
+AUTH_DB_SIZE = 10_000
+
+# Enrollment as the store grows
+ENROLL_SIZES = [1_000, 10_000, 50_000, 100_000]
+ENROLL_REPEATS = 20
+ENROLL_BATCH = 100
+
+# Smaller sweeps for a smoke run (--quick)
+QUICK = {
+    "image_sizes": [(640, 480), (1920, 1080)],
+    "det_sizes": [(512, 512)],
+    "embed_repeats": 5,
+    "db_sizes": [1_000, 10_000],
+    "concurrency": [1, 8],
+    "auth_requests": 40,
+    "auth_db_size": 1_000,
+    "enroll_sizes": [1_000, 10_000],
+    "enroll_repeats": 5
+}
+
+SECTIONS = ("embedding", "search", "authenticate", "enrollment")
+
+# --compare: latency up (or throughput / recall down) by more than this is flagged
+REGRESSION_PCT = 10
+
+
+# =========================
+# SYNTHETIC INPUTS
+# =========================
+def synthetic_face(width, height, seed=SEED):
+    """A drawn frontal face (skin ellipse, brows, eyes, nose, mouth) on a
+    textured background, about 40% of the frame height. Detection on it is
+    reported per run (`face_found`), not assumed."""
+    rng = np.random.default_rng(seed)
+    img = rng.integers(60, 200, size=(height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+    img = cv2.GaussianBlur(cv2.resize(img, (width, height), interpolation=cv2.INTER_LINEAR), (0, 0), 3)
+
+    s = 0.2 * height
+    cx, cy = width // 2, height // 2
+    pt = lambda x, y: (int(cx + x * s), int(cy + y * s))
+    ln = lambda f: max(1, int(f * s))
+
+    cv2.ellipse(img, pt(0, 0), (ln(0.78), ln(1.0)), 0, 0, 360, (150, 180, 225), -1, cv2.LINE_AA)
+    cv2.ellipse(img, pt(0, -0.55), (ln(0.82), ln(0.55)), 0, 180, 360, (40, 50, 70), -1, cv2.LINE_AA)
+    for side in (-1, 1):
+        cv2.ellipse(img, pt(0.32 * side, -0.32), (ln(0.18), ln(0.05)), 0, 180, 360, (50, 60, 80), ln(0.04), cv2.LINE_AA)
+        cv2.ellipse(img, pt(0.32 * side, -0.15), (ln(0.15), ln(0.08)), 0, 0, 360, (245, 245, 245), -1, cv2.LINE_AA)
+        cv2.circle(img, pt(0.32 * side, -0.15), ln(0.06), (60, 40, 30), -1, cv2.LINE_AA)
+    cv2.line(img, pt(0, -0.1), pt(-0.06, 0.22), (110, 135, 180), ln(0.04), cv2.LINE_AA)
+    cv2.ellipse(img, pt(0, 0.45), (ln(0.25), ln(0.09)), 0, 0, 180, (90, 90, 170), ln(0.05), cv2.LINE_AA)
+    return img
+
+def load_faces(source=None):
+    """Base images: photos from an enroll/<person>/ folder (or zip) when
+    given, otherwise one synthetic face."""
+    if source is None:
+        return [synthetic_face(1280, 960)]
+    from bulk_enroll import find_images
+    faces = [cv2.imdecode(np.frombuffer(load(), np.uint8), cv2.IMREAD_COLOR)
+             for _, _, load in find_images(source)]
+    return [img for img in faces if img is not None]
+
+def fit(img, width, height):
+    # Scale to cover (width, height) and centre-crop, like a camera frame
+    h, w = img.shape[:2]
+    scale = max(width / w, height / h)
+    img = cv2.resize(img, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+    y, x = (img.shape[0] - height) // 2, (img.shape[1] - width) // 2
+    return img[y:y + height, x:x + width]
+
+def encode(img):
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+def unique_uploads(img, n, seed=SEED):
+    """`n` JPEGs of `img` that differ in one corner pixel, so the API's
+    upload-hash cache never answers for inference."""
+    rng = np.random.default_rng(seed)
+    blobs = []
+    for _ in range(n):
+        copy = img.copy()
+        copy[:4, :4] = rng.integers(0, 256, size=3, dtype=np.uint8)
+        blobs.append(encode(copy))
+    return blobs
+
+def random_embeddings(n, dim=VECTOR_DIM, per_user=VECTORS_PER_USER, seed=SEED):
+    """L2-normalised vectors in clusters of `per_user`, with user labels."""
+    rng = np.random.default_rng(seed)
+    users = -(-n // per_user)
+    centres = rng.standard_normal((users, dim), dtype=np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    owner = np.arange(n) // per_user
+    vectors = centres[owner] + rng.normal(0, USER_SPREAD / np.sqrt(dim), size=(n, dim)).astype("float32")
+    faiss.normalize_L2(vectors)
+    return vectors, [f"user_{u}" for u in owner]
+
+
+# =========================
+# MEASUREMENT HELPERS
+# =========================
+def latency_stats(ms):
+    ms = np.asarray(ms, dtype="float64")
+    if len(ms) == 0:
+        return {"n": 0}
+    return {
+        "n": int(len(ms)),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99))
+    }
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, 1000 * (time.perf_counter() - started)
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    try:
+        import onnxruntime
+        ort_version = onnxruntime.__version__
+    except ImportError:
+        ort_version = None
+    return {
+        "commit": commit or None,
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "faiss": faiss.__version__,
+        "opencv": cv2.__version__,
+        "onnxruntime": ort_version
+    }
+
+
+# =========================
+# 1. get_embedding LATENCY
+# =========================
+def bench_embedding(faces, image_sizes=IMAGE_SIZES, det_sizes=DET_SIZES, repeats=EMBED_REPEATS):
+    """Upload bytes -> embedding, as the API does it: decode + detect
+    (detect_encoded), quality on the face ROI, recognition of the crop.
+    `det_size` is the detector's fallback input; the first pass is sized
+    from the image (preprocess.det_input_size)."""
+    from face_engine import FaceEngine
+    from quality import image_quality
+
+    results = {}
+    for det_size in det_sizes:
+        engine = FaceEngine(name=PACK, det_size=det_size)
+        engine.warm_up()
+        for width, height in image_sizes:
+            blobs = [encode(fit(img, width, height)) for img in faces]
+            detect_ms, quality_ms, embed_ms, total_ms, found = [], [], [], [], 0
+            for _ in range(repeats):
+                for data in blobs:
+                    (img, face), t_detect = timed(engine.detect_encoded, data)
+                    t_quality = t_embed = 0.0
+                    if face is not None:
+                        found += 1
+                        _, t_quality = timed(image_quality, img, face.bbox)
+                        _, t_embed = timed(engine.embed, [face.crop])
+                        quality_ms.append(t_quality)
+                        embed_ms.append(t_embed)
+                    detect_ms.append(t_detect)
+                    total_ms.append(t_detect + t_quality + t_embed)
+
+            name = f"{width}x{height} det={det_size[0]}x{det_size[1]}"
+            results[name] = {
+                "image": [width, height],
+                "det_size": list(det_size),
+                "precision": engine.precision,
+                "face_found": found / len(total_ms),
+                "decode_detect": latency_stats(detect_ms),
+                "quality": latency_stats(quality_ms),
+                "embed": latency_stats(embed_ms),
+                "total": latency_stats(total_ms)
+            }
+            print(f"[INFO] embedding {name}: {results[name]['total'].get('p50_ms', 0):.1f} ms p50, "
+                  f"face found {results[name]['face_found']:.0%}")
+    return results
+
+
+# =========================
+# 2. index.search LATENCY + RECALL
+# =========================
+def bench_search(db_sizes=DB_SIZES, kinds=INDEX_KINDS, codes=(None,), k=SEARCH_K, n_queries=SEARCH_QUERIES):
+    """index_tiers.recall_report on random per-user clusters of each size."""
+    results = {}
+    for n in db_sizes:
+        vectors, _ = random_embeddings(n)
+        report = index_tiers.recall_report(vectors, k=k, n_queries=n_queries, kinds=kinds,
+                                           codes=codes, seed=SEED)
+        for row in report["results"]:
+            knobs = " ".join(f"{key}={row[key]}" for key in ("nprobe", "efSearch") if key in row)
+            name = f"n={n} {row['index']} codes={row['codes']} {knobs}".strip()
+            results[name] = {"db_size": n, **row}
+        print(f"[INFO] search n={n}: {len(kinds)} tiers measured")
+    return results
+
+
+# =========================
+# 3. /authenticate THROUGHPUT
+# =========================
+async def _load(client, blobs, concurrency):
+    # `concurrency` clients, each sending its next request as soon as the
+    # previous one is answered, until every upload has been sent
+    pending = iter(blobs)
+    latencies, statuses = [], {}
+
+    async def worker():
+        for data in pending:
+            started = time.perf_counter()
+            reply = await client.post("/authenticate", files={"image": ("face.jpg", data, "image/jpeg")})
+            elapsed = 1000 * (time.perf_counter() - started)
+            statuses[reply.status_code] = statuses.get(reply.status_code, 0) + 1
+            if reply.status_code == 200:
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return time.perf_counter() - started, latencies, statuses
+
+def start_local_api(store_dir, db_size):
+    """Load face_auth_api in this process on a throw-away store holding
+    `db_size` random vectors; returns the ASGI app."""
+    import face_auth_api as api
+
+    # Own store and shards, no legacy import, memory-only embedding cache:
+    # nothing here touches production files or FACE_AUTH_CACHE_DB
+    api.load_runtime(store_path=os.path.join(store_dir, "bench_face_db"),
+                     shard_root=os.path.join(store_dir, "shards"),
+                     import_legacy=False, cache_db=None)
+    if not api.ready.is_set():
+        raise RuntimeError(f"API did not start: {api.lifecycle['error']}")
+
+    vectors, users = random_embeddings(db_size)
+    api.store.append(vectors, users)
+    api.store.search(vectors[:1], api.TOP_K)  # map the rows, start any index build
+    return api
+
+def bench_authenticate(faces, concurrency=CONCURRENCY, n_requests=AUTH_REQUESTS,
+                       image_size=AUTH_IMAGE_SIZE, db_size=AUTH_DB_SIZE, url=None):
+    """Closed-loop load on POST /authenticate. In-process through httpx's
+    ASGI transport by default, or against a running server with `url`."""
+    import httpx
+
+    width, height = image_size
+    blobs = unique_uploads(fit(faces[0], width, height), n_requests * len(concurrency))
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        api = None
+        if url:
+            client = httpx.AsyncClient(base_url=url, timeout=120)
+        else:
+            api = start_local_api(store_dir, db_size)
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app),
+                                       base_url="http://benchmark", timeout=120)
+
+        async def run_all():
+            async with client:
+                runs = []
+                for i, level in enumerate(concurrency):
+                    runs.append(await _load(client, blobs[i * n_requests:(i + 1) * n_requests], level))
+                return runs
+
+        try:
+            runs = asyncio.run(run_all())
+        finally:
+            if api is not None:
+                api.shutdown_pool()
+
+    results = {}
+    for level, (elapsed, latencies, statuses) in zip(concurrency, runs):
+        name = f"concurrency={level}"
+        results[name] = {
+            "concurrency": level,
+            "requests": n_requests,
+            "target": url or "in-process",
+            "image": [width, height],
+            "db_size": None if url else db_size,
+            "statuses": {str(code): count for code, count in sorted(statuses.items())},
+            "requests_per_s": len(latencies) / elapsed,
+            "latency": latency_stats(latencies)
+        }
+        print(f"[INFO] authenticate {name}: {results[name]['requests_per_s']:.1f} req/s, "
+              f"statuses {results[name]['statuses']}")
+    return results
+
+
+# =========================
+# 4. ENROLLMENT COST VS DB SIZE
+# =========================
+def bench_enrollment(sizes=ENROLL_SIZES, repeats=ENROLL_REPEATS, batch=ENROLL_BATCH):
+    """SharedFaceIndex.append (write + fsync) of one vector and of a batch,
+    the first search after it, and how long the background index build
+    takes once the store has grown to each size."""
+    from shared_index import SharedFaceIndex
+
+    sizes = sorted(sizes)
+    vectors, users = random_embeddings(sizes[-1])
+    extra, extra_users = random_embeddings(len(sizes) * repeats * (1 + batch), seed=SEED + 1)
+    probes = extra[::7]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as store_dir:
+        store = SharedFaceIndex(os.path.join(store_dir, "bench_face_db"), VECTOR_DIM)
+        used = 0
+        try:
+            for n in sizes:
+                # Grow to n (the rows enrolled by earlier steps count too)
+                grow = max(0, n - store.count)
+                if grow:
+                    start = store.count - used
+                    store.append(vectors[start:start + grow], users[start:start + grow])
+
+                started = time.perf_counter()
+                store.search(probes[:1], 1)
+                while store.tiered.describe()["building"]:
+                    time.sleep(0.05)
+                build_s = time.perf_counter() - started
+
+                one_ms, batch_ms, search_ms = [], [], []
+                for r in range(repeats):
+                    _, t = timed(store.append, extra[used:used + 1], extra_users[used:used + 1])
+                    one_ms.append(t)
+                    used += 1
+                    _, t = timed(store.search, probes[r % len(probes)], 5)
+                    search_ms.append(t)
+                    _, t = timed(store.append, extra[used:used + batch], extra_users[used:used + batch])
+                    batch_ms.append(t / batch)
+                    used += batch
+
+                name = f"n={n}"
+                results[name] = {
+                    "db_size": n,
+                    "index": store.tiered.describe(),
+                    "index_build_s": build_s,
+                    "append_one": latency_stats(one_ms),
+                    f"append_batch{batch}_per_vector": latency_stats(batch_ms),
+                    "search_after_append": latency_stats(search_ms)
+                }
+                print(f"[INFO] enrollment {name}: one {results[name]['append_one']['p50_ms']:.2f} ms p50, "
+                      f"index build {build_s:.1f}s")
+        finally:
+            store.close()
+    return results
+
+
+# =========================
+# COMPARE TWO RUNS
+# =========================
+HIGHER_IS_BETTER = ("requests_per_s", "recall", "face_found")
+
+def flatten(tree, prefix=""):
+    flat = {}
+    for key, value in tree.items():
+        path = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+def compare(base, current, threshold=REGRESSION_PCT):
+    """Metric paths present in both reports that moved the wrong way by
+    more than `threshold` percent."""
+    old, new = flatten(base["results"]), flatten(current["results"])
+    regressions = []
+    for path in sorted(old.keys() & new.keys()):
+        leaf = path.rsplit("/", 1)[-1]
+        timing = "ms" in leaf.split("_") or leaf.endswith("_s")
+        if not (timing or leaf.startswith(HIGHER_IS_BETTER)):
+            continue
+        if old[path] == 0:
+            continue
+        change = 100 * (new[path] - old[path]) / abs(old[path])
+        worse = -change if leaf.startswith(HIGHER_IS_BETTER) else change
+        if worse > threshold:
+            regressions.append({"metric": path, "base": old[path], "current": new[path], "change_pct": change})
+    return regressions
+
+
+# =========================
+# RUN
+# =========================
+def run(sections=SECTIONS, quick=False, faces_dir=None, codes=False, url=None):
+    cfg = {
+        "image_sizes": IMAGE_SIZES, "det_sizes": DET_SIZES, "embed_repeats": EMBED_REPEATS,
+        "db_sizes": DB_SIZES, "concurrency": CONCURRENCY, "auth_requests": AUTH_REQUESTS,
+        "auth_db_size": AUTH_DB_SIZE, "enroll_sizes": ENROLL_SIZES, "enroll_repeats": ENROLL_REPEATS
+    }
+    if quick:
+        cfg.update(QUICK)
+
+    faces = load_faces(faces_dir) if {"embedding", "authenticate"} & set(sections) else []
+    if faces_dir and not faces:
+        raise SystemExit(f"❌ No readable images in {faces_dir}")
+
+    report = {
+        "environment": environment(),
+        "config": {**cfg, "sections": list(sections), "faces": faces_dir or "synthetic",
+                   "codes": codes, "url": url, "seed": SEED},
+        "results": {}
+    }
+    for section in sections:
+        started = time.time()
+        if section == "embedding":
+            result = bench_embedding(faces, cfg["image_sizes"], cfg["det_sizes"], cfg["embed_repeats"])
+        elif section == "search":
+            result = bench_search(cfg["db_sizes"], codes=index_tiers.CODE_TYPES if codes else (None,))
+        elif section == "authenticate":
+            result = bench_authenticate(faces, cfg["concurrency"], cfg["auth_requests"],
+                                        db_size=cfg["auth_db_size"], url=url)
+        else:
+            result = bench_enrollment(cfg["enroll_sizes"], cfg["enroll_repeats"])
+        report["results"][section] = result
+        print(f"[INFO] {section} done in {time.time() - started:.1f}s")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks: embedding latency, index search, /authenticate throughput, enrollment cost")
+    parser.add_argument("--only", nargs="+", choices=SECTIONS, default=list(SECTIONS), help="Sections to run")
+    parser.add_argument("--quick", action="store_true", help="Smaller sweeps for a smoke run")
+    parser.add_argument("--faces", help="enroll/<person>/ folder (or zip) of real photos instead of the synthetic face")
+    parser.add_argument("--codes", action="store_true", help="Also search fp16 / PQ codes with re-ranking")
+    parser.add_argument("--url", help="Load a running API (e.g. http://127.0.0.1:8000) instead of an in-process one")
+    parser.add_argument("--out", help="JSON report path (default: benchmarks/<commit>_<time>.json)")
+    parser.add_argument("--compare", help="Earlier JSON report to check this run against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_PCT,
+                        help="Percent change flagged as a regression by --compare")
+    args = parser.parse_args()
+
+    report = run(args.only, args.quick, args.faces, args.codes, args.url)
+
+    out = args.out
+    if not out:
+        stamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        out = os.path.join("benchmarks", f"{report['environment']['commit'] or 'nogit'}_{stamp}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)
+        report["compare"] = {"base": args.compare, "base_commit": base["environment"]["commit"],
+                             "threshold_pct": args.threshold,
+                             "regressions": compare(base, report, args.threshold)}
+        for item in report["compare"]["regressions"]:
+            print(f"⚠ {item['metric']}: {item['base']:.4g} -> {item['current']:.4g} ({item['change_pct']:+.1f}%)")
+        if not report["compare"]["regressions"]:
+            print(f"✔ No regressions over {args.threshold:g}% against {args.compare}")
+
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Report written to", out)
+    sys.exit(1 if report.get("compare", {}).get("regressions") else 0)
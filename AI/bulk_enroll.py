@@ -0,0 +1,160 @@
+import argparse
+import csv
+import json
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# =========================
+# CONFIG
+# =========================
+VECTOR_DIM = 512
+DET_SIZE = (640, 640)
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+CHUNK_SIZE = 16      # images per task sent to a worker
+
+# =========================
+# WORKER PROCESS
+# =========================
+_app = None
+
+def _init_worker():
+    # Each worker loads its own copy of the models once
+    global _app
+    from face_engine import FaceEngine
+    _app = FaceEngine(name="buffalo_l", det_size=DET_SIZE)
+
+def _embed(data):
+    # Reduced-size JPEG decode; full size only when the face is too small
+    _, face = _app.detect_encoded(data)
+    if face is None:
+        raise ValueError("No face detected")
+    return _app.embed([face.crop])[0]
+
+def _embed_chunk(chunk):
+    results = []
+    for key, load in chunk:
+        try:
+            results.append((key, _embed(load()), None))
+        except Exception as e:
+            results.append((key, None, str(e)))
+    return results
+
+# =========================
+# INPUT DISCOVERY
+# =========================
+class _FileSource:
+    # Picklable "read this image later" handle, so workers do the I/O
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+class _ZipSource:
+    def __init__(self, archive, name):
+        self.archive = archive
+        self.name = name
+
+    def __call__(self):
+        with zipfile.ZipFile(self.archive) as zf:
+            return zf.read(self.name)
+
+def find_images(source):
+    """Yield (user_id, file, loader) from enroll/<person>/* folders or a
+    zip laid out the same way."""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as zf:
+            for name in zf.namelist():
+                parts = name.strip("/").split("/")
+                if len(parts) >= 2 and name.lower().endswith(IMAGE_EXTS):
+                    yield parts[-2], name, _ZipSource(source, name)
+        return
+
+    for person in sorted(os.listdir(source)):
+        folder = os.path.join(source, person)
+        if not os.path.isdir(folder):
+            continue
+        for f in sorted(os.listdir(folder)):
+            if f.lower().endswith(IMAGE_EXTS):
+                path = os.path.join(folder, f)
+                yield person, path, _FileSource(path)
+
+# =========================
+# BULK IMPORT
+# =========================
+def bulk_enroll(source, store_path, workers=None, project=None, shard_root="shards"):
+    from shared_index import SharedFaceIndex
+
+    if project:
+        store_path = os.path.join(shard_root, project, "face")
+        os.makedirs(os.path.dirname(store_path), exist_ok=True)
+
+    items = list(find_images(source))
+    if not items:
+        print(f"❌ No images found in {source}")
+        return []
+
+    print(f"[INFO] Embedding {len(items)} images with {workers or os.cpu_count()} workers...")
+    started = time.time()
+
+    tasks = [(i, loader) for i, (_, _, loader) in enumerate(items)]
+    chunks = [tasks[i:i + CHUNK_SIZE] for i in range(0, len(tasks), CHUNK_SIZE)]
+
+    embeddings = {}
+    report = [{"user_id": uid, "file": name} for uid, name, _ in items]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for results in pool.map(_embed_chunk, chunks):
+            for i, emb, error in results:
+                if emb is None:
+                    report[i].update(status="error", error=error)
+                    print(f"❌ Skipped {items[i][1]} | {error}")
+                else:
+                    embeddings[i] = emb
+
+    order = sorted(embeddings)
+    if order:
+        # Every vector in one append, persisted once
+        store = SharedFaceIndex(store_path, VECTOR_DIM)
+        start_id = store.append(np.vstack([embeddings[i] for i in order]),
+                                [items[i][0] for i in order])
+        store.close()
+        for offset, i in enumerate(order):
+            report[i].update(status="enrolled", vector_id=start_id + offset)
+
+    elapsed = time.time() - started
+    print(f"Enrolled {len(order)}/{len(items)} images "
+          f"({len({items[i][0] for i in order})} people) in {elapsed:.1f}s "
+          f"| {len(items) / max(elapsed, 1e-9):.1f} img/s")
+    return report
+
+def write_report(report, path):
+    if path.endswith(".csv"):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["user_id", "file", "status", "vector_id", "error"])
+            writer.writeheader()
+            writer.writerows(report)
+    else:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+# =========================
+# MAIN
+# =========================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-enroll enroll/<person>/ folders (or a zip) into the API face store")
+    parser.add_argument("source", help="Folder of <person>/ sub-folders, or a zip with the same layout")
+    parser.add_argument("--store", default="prod_face_db", help="Shared store base path used by face_auth_api.py")
+    parser.add_argument("--project", help="Write into shards/<project>/ instead of the global store")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: all cores)")
+    parser.add_argument("--report", default="enroll_report.json", help="Per-image report (.json or .csv)")
+    args = parser.parse_args()
+
+    report = bulk_enroll(args.source, args.store, workers=args.workers, project=args.project)
+    if report:
+        write_report(report, args.report)
+        print(f"Report: {args.report}")
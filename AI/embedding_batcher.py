@@ -0,0 +1,129 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+# =========================
+# MICRO-BATCHED RECOGNITION
+# =========================
+class EmbeddingBatcher:
+    """Collects aligned 112x112 crops from concurrent requests and runs the
+    recognition model once per batch.
+
+    A batch closes when it reaches `max_batch` crops or when the first crop
+    in it has waited `max_wait_ms`, whichever comes first.
+
+    `infer(crops)` runs one batch and returns the raw features; by default
+    `rec_model.get_feat` in the batcher thread. The API passes one that runs
+    it on the inference pool, so batches share its workers.
+    """
+
+    def __init__(self, rec_model, max_batch=16, max_wait_ms=5, infer=None):
+        self.rec_model = rec_model
+        self.infer = infer or rec_model.get_feat
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+
+        # Metrics
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes = {}
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.infer_ms_total = 0.0
+
+        self._thread = threading.Thread(target=self._loop, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, crop):
+        fut = Future()
+        self.queue.put((crop, fut, time.monotonic()))
+        return fut
+
+    async def embed(self, crop):
+        return await asyncio.wrap_future(self.submit(crop))
+
+    def close(self):
+        self.queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _collect(self):
+        first = self.queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self.queue.put(None)  # finish this batch, then stop
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            # Requests cancelled while waiting are dropped from the batch
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.monotonic()
+            try:
+                feats = self.infer([crop for crop, _, _ in batch])
+                feats = feats / np.linalg.norm(feats, axis=1, keepdims=True)
+                feats = feats.astype("float32")
+            except Exception as e:
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+                continue
+            finished = time.monotonic()
+
+            for (_, fut, _), feat in zip(batch, feats):
+                fut.set_result(feat)
+
+            self._record(batch, started, finished)
+
+    def _record(self, batch, started, finished):
+        waits = [(started - queued_at) * 1000 for _, _, queued_at in batch]
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch)
+            self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+            self.wait_ms_total += sum(waits)
+            self.wait_ms_max = max(self.wait_ms_max, max(waits))
+            self.infer_ms_total += (finished - started) * 1000
+
+    def stats(self):
+        with self._lock:
+            batches = max(self.batches, 1)
+            items = max(self.items, 1)
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+                "queue_depth": self.queue.qsize(),
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": round(self.items / batches, 2),
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+                "avg_wait_ms": round(self.wait_ms_total / items, 3),
+                "max_wait_ms_seen": round(self.wait_ms_max, 3),
+                "avg_infer_ms_per_batch": round(self.infer_ms_total / batches, 3)
+            }
@@ -0,0 +1,146 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+# =========================
+# UPLOAD -> EMBEDDING CACHE
+# =========================
+class EmbeddingCache:
+    """LRU + TTL cache from a hash of the raw upload bytes to
+    (embedding, det_score, quality).
+
+    Retries of the same image skip decode, detection and ArcFace. With
+    `disk_path` set, entries also go to a small SQLite file that every
+    worker process shares.
+
+    `namespace` (e.g. model pack and precision) is hashed into every key,
+    so entries written by a different recognition model are never served.
+    """
+
+    def __init__(self, max_items=2048, ttl=600, disk_path=None, namespace=""):
+        self.namespace = namespace
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = None
+        if disk_path:
+            self.open_disk(disk_path)
+
+    def open_disk(self, disk_path):
+        """Attach the shared SQLite tier (after construction, e.g. once the
+        runtime knows which file to use)."""
+        self._db = sqlite3.connect(disk_path, check_same_thread=False, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, created REAL, emb BLOB, det_score REAL, quality REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_created ON embeddings (created)")
+        self._db.commit()
+        self._db_lock = threading.Lock()
+        self._disk_puts = 0
+
+    def key(self, data):
+        h = hashlib.blake2b(self.namespace.encode(), digest_size=20)
+        h.update(b"\0")
+        h.update(data)
+        return h.hexdigest()
+
+    def lookup(self, data):
+        """Return (key, value_or_None) for the raw upload bytes."""
+        key = self.key(data)
+        return key, self.get(key)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.ttl:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._items[key]
+
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._remember(key, value, now)
+        return value
+
+    def put(self, key, value):
+        now = time.time()
+        self._remember(key, value, now)
+        self._disk_put(key, value, now)
+
+    def _remember(self, key, value, created):
+        with self._lock:
+            self._items[key] = (created, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    # ---------- shared disk tier ----------
+    def _disk_get(self, key, now):
+        if self._db is None:
+            return None
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT emb, det_score, quality FROM embeddings WHERE key = ? AND created >= ?",
+                (key, now - self.ttl)
+            ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype="float32").copy(), row[1], row[2]
+
+    def _disk_put(self, key, value, now):
+        if self._db is None:
+            return
+        emb, det_score, quality = value
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)",
+                (key, now, np.asarray(emb, dtype="float32").tobytes(), float(det_score), float(quality))
+            )
+            self._disk_puts += 1
+            if self._disk_puts % 128 == 0:
+                self._db.execute("DELETE FROM embeddings WHERE created < ?", (now - self.ttl,))
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._items),
+                "max_items": self.max_items,
+                "ttl_s": self.ttl,
+                "disk_tier": self._db is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0
+            }
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
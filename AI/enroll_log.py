@@ -0,0 +1,240 @@
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+import faiss
+import numpy as np
+
+from reverse_index import ReverseIndex
+
+
+# =========================
+# RECORD FORMAT
+# =========================
+# magic | crc32(payload) | start_id | n vectors | dim | meta length | payload
+# payload = n*dim float32 + pickled metadata
+MAGIC = b"ENRL"
+RECORD_FMT = "<4sIqIII"
+RECORD_HEADER = struct.calcsize(RECORD_FMT)
+
+
+# =========================
+# ATOMIC SNAPSHOT HELPERS
+# =========================
+def _fsync_dir(path):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write_index(index, path):
+    tmp = path + ".tmp"
+    faiss.write_index(index, tmp)
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+def atomic_pickle(obj, path):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+
+# =========================
+# WRITE-AHEAD ENROLLMENT LOG
+# =========================
+class EnrollmentLog:
+    """Append-only log of enrolled vectors + metadata.
+
+    fsync is batched: the log is synced every `sync_every` records, or by
+    `sync()` / the compactor thread, instead of once per enrollment.
+    """
+
+    def __init__(self, path, sync_every=8):
+        self.path = path
+        self.sync_every = sync_every
+        self.records = 0
+        self._unsynced = 0
+        self._lock = threading.Lock()
+        self._f = open(path, "ab")
+
+    def append(self, start_id, vectors, meta):
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        payload = vectors.tobytes() + pickle.dumps(meta)
+        meta_len = len(payload) - vectors.nbytes
+        header = struct.pack(RECORD_FMT, MAGIC, zlib.crc32(payload),
+                             start_id, vectors.shape[0], vectors.shape[1], meta_len)
+
+        with self._lock:
+            self._f.write(header + payload)
+            self._f.flush()
+            self.records += 1
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                self._sync_locked()
+
+    def sync(self):
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_locked(self):
+        if self._unsynced:
+            os.fsync(self._f.fileno())
+            self._unsynced = 0
+
+    def replay(self):
+        """Yield (start_id, vectors, meta); a torn tail record is cut off."""
+        good_size = 0
+        with open(self.path, "rb") as f:
+            while True:
+                header = f.read(RECORD_HEADER)
+                if len(header) < RECORD_HEADER:
+                    break
+                magic, crc, start_id, n, dim, meta_len = struct.unpack(RECORD_FMT, header)
+                payload = f.read(n * dim * 4 + meta_len)
+                if magic != MAGIC or len(payload) < n * dim * 4 + meta_len or zlib.crc32(payload) != crc:
+                    break
+
+                vectors = np.frombuffer(payload[:n * dim * 4], dtype="float32").reshape(n, dim)
+                meta = pickle.loads(payload[n * dim * 4:])
+                good_size = f.tell()
+                self.records += 1
+                yield start_id, vectors, meta
+
+        with self._lock:
+            if os.path.getsize(self.path) > good_size:
+                self._f.truncate(good_size)
+
+    def reset(self):
+        """Empty the log once its records are covered by a snapshot."""
+        with self._lock:
+            self._f.truncate(0)
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self.records = 0
+            self._unsynced = 0
+
+    def close(self):
+        self.sync()
+        self._f.close()
+
+
+# =========================
+# SNAPSHOT + LOG DATABASE
+# =========================
+class LoggedFaceDB:
+    """FAISS index + user_map persisted as snapshot files plus a log tail.
+
+    `apply_meta(user_map, start_id, n, meta)` updates user_map for one
+    enrollment and must be idempotent: after a crash between snapshot
+    writes, replay may apply a record the map already contains.
+
+    `retier(index)`, if given, runs before each snapshot and may return a
+    different index (e.g. a larger ANN tier); read `db.index` rather than
+    keeping a reference to it.
+
+    `label(meta, n)`, if given, returns (user, angles_or_None) for a
+    record and keeps `db.reverse` (vector_id -> user/angle) up to date;
+    it is saved next to the index as <db_path>.rev.npz. With
+    `replace=True` an enrollment supersedes the user's earlier rows (as an
+    apply_meta that overwrites user_map does), so they are unlabelled too
+    and the table matches one rebuilt from user_map.
+    """
+
+    def __init__(self, db_path, map_path, new_index, apply_meta, retier=None, label=None,
+                 replace=False, log_path=None, compact_every=256, sync_every=8):
+        self.db_path = db_path
+        self.map_path = map_path
+        self.rev_path = db_path + ".rev.npz"
+        self.apply_meta = apply_meta
+        self.retier = retier
+        self.label = label
+        self.replace = replace
+        self.compact_every = compact_every
+        self.lock = threading.RLock()
+
+        if os.path.exists(db_path) and os.path.exists(map_path):
+            self.index = faiss.read_index(db_path)
+            with open(map_path, "rb") as f:
+                self.user_map = pickle.load(f)
+        else:
+            self.index = new_index()
+            self.user_map = {}
+
+        self.reverse = None
+        if label is not None:
+            if os.path.exists(self.rev_path):
+                self.reverse = ReverseIndex.load(self.rev_path)
+            if self.reverse is None or self.reverse.size != self.index.ntotal:
+                self.reverse = ReverseIndex.from_user_map(self.user_map)
+
+        self.log = EnrollmentLog(log_path or db_path + ".log", sync_every=sync_every)
+        for start_id, vectors, meta in self.log.replay():
+            # Records (partly) covered by the snapshot only re-apply metadata
+            skip = max(0, self.index.ntotal - start_id)
+            if skip < len(vectors):
+                self.index.add(np.ascontiguousarray(vectors[skip:]))
+            self._apply(start_id, len(vectors), meta)
+
+    def _apply(self, start_id, n, meta):
+        self.apply_meta(self.user_map, start_id, n, meta)
+        if self.reverse is not None:
+            user, angles = self.label(meta, n)
+            if self.replace:
+                self.reverse.clear(user)
+            self.reverse.set(start_id, user, angles=angles, count=n)
+
+    def add(self, vectors, meta):
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        with self.lock:
+            start_id = self.index.ntotal
+            self.log.append(start_id, vectors, meta)
+            self.index.add(vectors)
+            self._apply(start_id, len(vectors), meta)
+
+            if self.log.records >= self.compact_every:
+                self.snapshot()
+        return start_id
+
+    def snapshot(self):
+        with self.lock:
+            if self.retier is not None:
+                self.index = self.retier(self.index)
+            atomic_write_index(self.index, self.db_path)
+            atomic_pickle(self.user_map, self.map_path)
+            if self.reverse is not None:
+                self.reverse.save(self.rev_path)
+            self.log.reset()
+
+    def close(self):
+        with self.lock:
+            self.log.close()
+
+
+class Compactor(threading.Thread):
+    """Background thread that syncs the log and snapshots it periodically."""
+
+    def __init__(self, db, interval=60.0):
+        super().__init__(name="enroll-compactor", daemon=True)
+        self.db = db
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.db.log.sync()
+            if self.db.log.records:
+                self.db.snapshot()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=self.interval)
+        self.db.log.sync()
@@ -1,53 +1,131 @@
+import argparse
 import cv2
+import hashlib
+import json
 import os
+import time
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
 
 # ---------------- CONFIG ----------------
 FINAL_SIZE = 224        # High-res face size
 BORDER_PAD = 8          # Soft border size (pixels)
-
-# ---------------- FIND ALL RUN FOLDERS ----------------
-run_folders = sorted(glob("output/run_*"))
-
-if not run_folders:
-    print("No run folders found. Run main.py first.")
-    exit()
-
-# ---------------- FACE DETECTOR ----------------
-face_cascade = cv2.CascadeClassifier(
-    cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-)
-
-# ---------------- PROCESS EACH IMAGE ----------------
-for run in run_folders:
-
-    input_img = os.path.join(run, "bg_removed_white.png")
-    if not os.path.exists(input_img):
-        print(f"⚠ Skipping {run} (bg_removed_white.png not found)")
-        continue
-
-    img = cv2.imread(input_img)
-    if img is None:
-        print(f"⚠ Could not read image in {run}")
-        continue
-
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-    faces = face_cascade.detectMultiScale(
-        gray,
-        scaleFactor=1.05,
-        minNeighbors=3,
-        minSize=(80, 80)   # ignore tiny / low-quality faces
+MIN_FACE_PX = 80        # ignore tiny / low-quality faces
+DET_SIZE = (640, 640)
+
+OUTPUT_ROOT = "output"
+MANIFEST_NAME = "face_align_manifest.json"
+INPUT_EXTS = (".png", ".webp")
+
+# Bump when the processing below changes, so every run is redone once
+PIPELINE_VERSION = 5
+
+# ---------------- FIND INPUTS ----------------
+def find_inputs(root=OUTPUT_ROOT):
+    """(input, out_aligned, out_structured) for every main.py result:
+    run_*/bg_removed_white.png from the file dialog, and
+    run_*/bg_removed_white/<path> from batch runs."""
+    jobs = []
+    for run in sorted(glob(os.path.join(root, "run_*"))):
+        single = os.path.join(run, "bg_removed_white.png")
+        if os.path.exists(single):
+            jobs.append((single,
+                         os.path.join(run, "face_aligned_224.png"),
+                         os.path.join(run, "face_structured.png")))
+
+        batch = os.path.join(run, "bg_removed_white")
+        for folder, _, files in sorted(os.walk(batch)):
+            for f in sorted(files):
+                if not f.lower().endswith(INPUT_EXTS):
+                    continue
+                rel = os.path.splitext(os.path.relpath(os.path.join(folder, f), batch))[0] + ".png"
+                jobs.append((os.path.join(folder, f),
+                             os.path.join(run, "face_aligned_224", rel),
+                             os.path.join(run, "face_structured", rel)))
+    return jobs
+
+# ---------------- MANIFEST OF PROCESSED INPUTS ----------------
+def sha256_of(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def config_key():
+    return f"v{PIPELINE_VERSION}|{FINAL_SIZE}|{BORDER_PAD}"
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        manifest = json.load(f)
+    return manifest.get("inputs", {}) if manifest.get("config") == config_key() else {}
+
+def save_manifest(path, entries):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"config": config_key(), "inputs": entries}, f, indent=2)
+    os.replace(tmp, path)
+
+def is_unchanged(entry, job):
+    """(unchanged, sha256): unchanged when the input has the recorded hash
+    and its outputs exist. A size + mtime match skips hashing; otherwise
+    the content decides."""
+    path, out_aligned, out_structured = job
+    if entry is None:
+        return False, None
+    if entry["status"] == "processed" and not (os.path.exists(out_aligned) and os.path.exists(out_structured)):
+        return False, None
+
+    st = os.stat(path)
+    if entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+        return True, entry["sha256"]
+    digest = sha256_of(path)
+    return digest == entry["sha256"], digest
+
+# ---------------- FACE DETECTOR (ONE PER WORKER) ----------------
+# The same insightface detector the enrollment scripts use, so a face is
+# found (and its box placed) the same way at every step
+engine = None
+
+def _init_worker():
+    global engine
+    from face_engine import FaceEngine
+    engine = FaceEngine(name="buffalo_l", det_size=DET_SIZE)
+
+# ---------------- BORDER HANDLING (VERY IMPORTANT) ----------------
+# Replicated padding by BORDER_PAD and a resize back to FINAL_SIZE, done as
+# one resample: output pixel u reads padded pixel (u + 0.5) * s - 0.5, i.e.
+# source pixel (u + 0.5) * s - 0.5 - BORDER_PAD, with replicated edges.
+# Bilinear is within a few grey levels of the old Lanczos pad + resize
+# once the 3x3 blur below has run, at about a quarter of the cost
+_BORDER_SCALE = (FINAL_SIZE + 2 * BORDER_PAD) / FINAL_SIZE
+_BORDER_SHIFT = 0.5 * _BORDER_SCALE - 0.5 - BORDER_PAD
+BORDER_WARP = np.float32([[_BORDER_SCALE, 0, _BORDER_SHIFT],
+                          [0, _BORDER_SCALE, _BORDER_SHIFT]])
+
+def soften_border(face):
+    padded = cv2.warpAffine(
+        face, BORDER_WARP, (FINAL_SIZE, FINAL_SIZE),
+        flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+        borderMode=cv2.BORDER_REPLICATE
     )
+    # Very light smoothing on borders
+    return cv2.GaussianBlur(padded, (3, 3), 0)
 
-    if len(faces) == 0:
-        print(f"No face detected in {run}")
-        continue
+# ---------------- PROCESS ONE IMAGE ----------------
+def align_face(img):
+    """(face_aligned_224, face_structured) for the largest face, or None."""
+    face = engine.detect_face(img)  # largest face (best for recognition)
+    if face is None:
+        return None
 
-    # Take the largest face (best for recognition)
-    faces = sorted(faces, key=lambda f: f[2] * f[3], reverse=True)
-    x, y, w, h = faces[0]
+    x, y = int(face.bbox[0]), int(face.bbox[1])
+    w, h = int(face.bbox[2]) - x, int(face.bbox[3]) - y
+    if min(w, h) < MIN_FACE_PX:
+        return None
 
     # ---------------- GENEROUS FACE CROP ----------------
     margin = int(0.40 * w)
@@ -68,8 +146,7 @@ for run in run_folders:
     # ---------------- EDGE-GUIDED STRUCTURE ENHANCEMENT ----------------
     edges = cv2.Canny(face_resized, 80, 160)
 
-    edge_mask = cv2.GaussianBlur(edges, (7, 7), 0)
-    edge_mask = edge_mask / 255.0
+    edge_mask = cv2.GaussianBlur(edges, (7, 7), 0).astype(np.float32) / 255.0
     edge_mask = np.expand_dims(edge_mask, axis=2)
 
     blur = cv2.GaussianBlur(face_resized, (0, 0), 1.0)
@@ -80,33 +157,89 @@ for run in run_folders:
         sharpened * edge_mask
     ).astype(np.uint8)
 
-    # ---------------- BORDER HANDLING (VERY IMPORTANT) ----------------
-    # Replicated padding (no artificial edges)
-    face_padded = cv2.copyMakeBorder(
-        face_structured,
-        BORDER_PAD, BORDER_PAD, BORDER_PAD, BORDER_PAD,
-        cv2.BORDER_REPLICATE
-    )
-
-    # Resize back to FINAL_SIZE
-    face_padded = cv2.resize(
-        face_padded,
-        (FINAL_SIZE, FINAL_SIZE),
-        interpolation=cv2.INTER_LANCZOS4
-    )
+    return face_resized, soften_border(face_structured)
 
-    # Very light smoothing on borders
-    face_final = cv2.GaussianBlur(face_padded, (3, 3), 0)
+def process(job):
+    path, out_aligned, out_structured = job
+    img = cv2.imread(path)
+    if img is None:
+        return "unreadable"
 
-    # ---------------- SAVE OUTPUTS ----------------
-    out_aligned = os.path.join(run, "face_aligned_224.png")
-    out_structured = os.path.join(run, "face_structured.png")
+    result = align_face(img)
+    if result is None:
+        return "no_face"
 
+    face_resized, face_final = result
+    os.makedirs(os.path.dirname(out_aligned), exist_ok=True)
+    os.makedirs(os.path.dirname(out_structured), exist_ok=True)
     cv2.imwrite(out_aligned, face_resized)
     cv2.imwrite(out_structured, face_final)
-
-    print(f"Processed: {run}")
-    print("   ├─ face_aligned_224.png")
-    print("   └─ face_structured.png")
-
-print("Face alignment + structure + border handling completed")
+    return "processed"
+
+# ---------------- INCREMENTAL RUN ----------------
+def run(root=OUTPUT_ROOT, workers=None, force=False):
+    jobs = find_inputs(root)
+    if not jobs:
+        print("No run folders found. Run main.py first.")
+        return None
+
+    manifest_path = os.path.join(root, MANIFEST_NAME)
+    entries = {} if force else load_manifest(manifest_path)
+    current = {os.path.relpath(job[0], root) for job in jobs}
+    entries = {key: entry for key, entry in entries.items() if key in current}
+
+    # Only inputs that are new or changed since the last run are processed
+    todo, hashes = [], {}
+    for job in jobs:
+        key = os.path.relpath(job[0], root)
+        unchanged, digest = is_unchanged(entries.get(key), job)
+        if unchanged:
+            # Touched but identical: remember the new mtime, skip the hash next time
+            st = os.stat(job[0])
+            entries[key].update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+        else:
+            todo.append(job)
+            hashes[key] = digest or sha256_of(job[0])
+    skipped = len(jobs) - len(todo)
+    print(f"[INFO] {len(jobs)} images, {skipped} unchanged, {len(todo)} to process")
+
+    counts = {"processed": 0, "no_face": 0, "unreadable": 0}
+    started = time.time()
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            try:
+                for job, status in zip(todo, pool.map(process, todo, chunksize=4)):
+                    key = os.path.relpath(job[0], root)
+                    st = os.stat(job[0])
+                    entries[key] = {"sha256": hashes[key], "size": st.st_size,
+                                    "mtime_ns": st.st_mtime_ns, "status": status}
+                    counts[status] += 1
+
+                    if status == "processed":
+                        print(f"Processed: {key}")
+                        print(f"   ├─ {os.path.relpath(job[1], root)}")
+                        print(f"   └─ {os.path.relpath(job[2], root)}")
+                    elif status == "no_face":
+                        print(f"No face detected in {key}")
+                    else:
+                        print(f"⚠ Could not read {key}")
+            finally:
+                # Whatever finished is recorded, even if the run is interrupted
+                save_manifest(manifest_path, entries)
+    elif skipped:
+        save_manifest(manifest_path, entries)
+
+    elapsed = time.time() - started
+    print(f"Face alignment + structure + border handling completed: {counts['processed']} processed, "
+          f"{counts['no_face']} without a face, {skipped} unchanged in {elapsed:.1f}s")
+    return {"skipped": skipped, **counts, "elapsed_s": elapsed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crop, align and enhance the face in every main.py output")
+    parser.add_argument("--root", default=OUTPUT_ROOT, help="Folder holding the run_* outputs of main.py")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: all cores)")
+    parser.add_argument("--force", action="store_true", help="Reprocess every run, ignoring the manifest")
+    args = parser.parse_args()
+
+    run(args.root, args.workers, args.force)
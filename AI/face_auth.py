@@ -1,10 +1,11 @@
-import os
+import atexit
 import cv2
-import faiss
-import pickle
 import numpy as np
-from insightface.app import FaceAnalysis
-from skimage import filters
+
+import index_tiers
+from enroll_log import LoggedFaceDB, Compactor
+from quality import image_quality
+from face_engine import FaceEngine
 
 # =============================
 # CONFIG
@@ -18,42 +19,62 @@ SIM_THRESHOLD = 0.6
 # LOAD ARCFACE MODEL
 # =============================
 print("[INFO] Loading ArcFace model...")
-app = FaceAnalysis(
-    name="buffalo_l",
-    providers=["CPUExecutionProvider"]
-)
-app.prepare(ctx_id=0, det_size=(640, 640))
+app = FaceEngine(name="buffalo_l", det_size=(640, 640))  # detection + recognition only
 
 
 # =============================
 # LOAD / CREATE FAISS DB
 # =============================
-if os.path.exists(DB_PATH):
-    print("[INFO] Loading existing face database...")
-    index = faiss.read_index(DB_PATH)
-    with open(MAP_PATH, "rb") as f:
-        user_map = pickle.load(f)
-else:
-    print("[INFO] Creating new face database...")
-    index = faiss.IndexFlatIP(VECTOR_DIM)
-    user_map = {}
+def apply_enrollment(user_map, start_id, count, user_id):
+    user_map[user_id] = list(range(start_id, start_id + count))
+
+# Snapshot (DB_PATH + MAP_PATH) plus an append-only log of newer enrollments
+print("[INFO] Loading face database...")
+db = LoggedFaceDB(
+    DB_PATH, MAP_PATH,
+    new_index=lambda: index_tiers.new_index(VECTOR_DIM),
+    apply_meta=apply_enrollment,
+    label=lambda user_id, count: (user_id, None),
+    replace=True,  # re-enrolling replaces the user's vectors
+    retier=index_tiers.maybe_migrate  # Flat -> HNSW -> IVF as the DB grows
+)
+user_map = db.user_map
+
+# Background compaction like auth_system.py, plus a final snapshot on exit
+# so the log does not grow between CLI runs
+compactor = Compactor(db, interval=60)
+compactor.start()
+
+def close_db():
+    compactor.stop()
+    if db.log.records:
+        db.snapshot()
+    db.close()
+
+atexit.register(close_db)
 
 
 # =============================
 # FACE → 512D VECTOR
 # =============================
-def get_embedding(image_path):
+def read_face(image_path):
     img = cv2.imread(image_path)
     if img is None:
         raise ValueError("Image not found")
 
-    faces = app.get(img)
-    if len(faces) == 0:
+    # Largest face: bbox, keypoints and aligned crop from one detector pass
+    face = app.detect_face(img)
+    if face is None:
         raise ValueError("No face detected")
 
-    emb = faces[0].embedding
-    emb = emb / np.linalg.norm(emb)
-    return emb.astype("float32")
+    return img, face
+
+def face_embedding(face):
+    # Only this face's crop goes through recognition (already L2-normalised)
+    return app.embed([face.crop])[0]
+
+def get_embedding(image_path):
+    return face_embedding(read_face(image_path)[1])
 
 
 # =============================
@@ -67,27 +88,12 @@ def enroll_user(user_id, image_paths):
         vectors.append(emb)
 
     vectors = np.vstack(vectors)
-    start_id = index.ntotal
-    index.add(vectors)
-
-    user_map[user_id] = list(range(start_id, start_id + len(vectors)))
-
-    faiss.write_index(index, DB_PATH)
-    with open(MAP_PATH, "wb") as f:
-        pickle.dump(user_map, f)
+    db.add(vectors, user_id)
+    db.log.sync()
 
     print(f"[SUCCESS] {user_id} enrolled with {len(vectors)} images")
 
 
-# =============================
-# IMAGE QUALITY SCORE
-# =============================
-def image_quality(image_path):
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-    blur_score = filters.laplace(img).var()
-    return min(blur_score / 500, 1.0)
-
-
 # =============================
 # LIVENESS SCORE (Placeholder)
 # =============================
@@ -99,22 +105,19 @@ def liveness_score():
 # AUTHENTICATION
 # =============================
 def authenticate(image_path):
-    query = get_embedding(image_path).reshape(1, -1)
-    scores, ids = index.search(query, 5)
+    img, face = read_face(image_path)
+    query = face_embedding(face).reshape(1, -1)
+    scores, ids = db.index.search(query, 5)
 
     best_score = float(scores[0][0])
-    best_id = ids[0][0]
+    best_id = int(ids[0][0])
 
-    matched_user = None
-    for user, id_list in user_map.items():
-        if best_id in id_list:
-            matched_user = user
-            break
+    matched_user, _ = db.reverse.lookup(best_id)
 
     if matched_user is None:
         return None, best_score
 
-    quality = image_quality(image_path)
+    quality = image_quality(img, face.bbox)  # face ROI of the already decoded image
     live = liveness_score()
 
     session_confidence = (
@@ -1,10 +1,12 @@
+import atexit
 import os
 import cv2
-import faiss
-import pickle
 import numpy as np
-from insightface.app import FaceAnalysis
-from skimage import filters
+
+import index_tiers
+from enroll_log import LoggedFaceDB, Compactor
+from quality import image_quality
+from face_engine import FaceEngine
 
 # =========================
 # CONFIG
@@ -18,43 +20,67 @@ THRESHOLD = 0.6
 # LOAD ARCFACE MODEL
 # =========================
 print("[INFO] Loading ArcFace model...")
-app = FaceAnalysis(name="buffalo_l", providers=["CPUExecutionProvider"])
-app.prepare(ctx_id=0, det_size=(640, 640))
+app = FaceEngine(name="buffalo_l", det_size=(640, 640))  # detection + recognition only
 
 # =========================
 # LOAD / CREATE DATABASE
 # =========================
-if os.path.exists(DB_PATH) and os.path.exists(MAP_PATH):
-    index = faiss.read_index(DB_PATH)
-    with open(MAP_PATH, "rb") as f:
-        user_map = pickle.load(f)
-else:
-    index = faiss.IndexFlatIP(VECTOR_DIM)
-    user_map = {}
+def apply_enrollment(user_map, start_id, count, meta):
+    person_name, angles = meta
+    records = user_map.setdefault(person_name, [])
+    known = {r.get("id") for r in records if isinstance(r, dict)}
+
+    for i, angle in enumerate(angles):
+        if start_id + i not in known:
+            records.append({
+                "id": start_id + i,
+                "angle": f"{person_name}_{angle}"
+            })
+
+# Snapshot (DB_PATH + MAP_PATH) plus an append-only log of newer enrollments
+db = LoggedFaceDB(
+    DB_PATH, MAP_PATH,
+    new_index=lambda: index_tiers.new_index(VECTOR_DIM),
+    apply_meta=apply_enrollment,
+    label=lambda meta, count: (meta[0], [f"{meta[0]}_{a}" for a in meta[1]]),
+    retier=index_tiers.maybe_migrate  # Flat -> HNSW -> IVF as the DB grows
+)
+user_map = db.user_map
+
+# Background compaction like auth_system.py, plus a final snapshot on exit
+# so the log does not grow between CLI runs
+compactor = Compactor(db, interval=60)
+compactor.start()
+
+def close_db():
+    compactor.stop()
+    if db.log.records:
+        db.snapshot()
+    db.close()
+
+atexit.register(close_db)
 
 # =========================
 # FACE → EMBEDDING
 # =========================
-def get_embedding(img_path):
+def read_face(img_path):
     img = cv2.imread(img_path)
     if img is None:
         raise ValueError("Image not readable")
 
-    faces = app.get(img)
-    if len(faces) == 0:
+    # Largest face: bbox, keypoints and aligned crop from one detector pass
+    face = app.detect_face(img)
+    if face is None:
         raise ValueError("No face detected")
 
-    emb = faces[0].embedding
-    emb = emb / np.linalg.norm(emb)
-    return emb.astype("float32")
+    return img, face
 
-# =========================
-# IMAGE QUALITY
-# =========================
-def image_quality(img_path):
-    img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-    blur = filters.laplace(img).var()
-    return min(blur / 500, 1.0)
+def face_embedding(face):
+    # Only this face's crop goes through recognition (already L2-normalised)
+    return app.embed([face.crop])[0]
+
+def get_embedding(img_path):
+    return face_embedding(read_face(img_path)[1])
 
 # =========================
 # ENROLL PERSON (MULTI-ANGLE)
@@ -81,19 +107,8 @@ def enroll_person(person_name, image_paths):
         return
 
     vectors = np.vstack(vectors)
-    start_id = index.ntotal
-    index.add(vectors)
-
-    user_map.setdefault(person_name, [])
-    for i, angle in enumerate(records):
-        user_map[person_name].append({
-            "id": start_id + i,
-            "angle": f"{person_name}_{angle}"
-        })
-
-    faiss.write_index(index, DB_PATH)
-    with open(MAP_PATH, "wb") as f:
-        pickle.dump(user_map, f)
+    db.add(vectors, (person_name, records))
+    db.log.sync()
 
     print(f"Enrolled {person_name} with {len(vectors)} angles")
 
@@ -101,27 +116,21 @@ def enroll_person(person_name, image_paths):
 # AUTHENTICATE
 # =========================
 def authenticate(img_path):
-    query = get_embedding(img_path).reshape(1, -1)
-    scores, ids = index.search(query, 3)
+    img, face = read_face(img_path)
+    query = face_embedding(face).reshape(1, -1)
+    scores, ids = db.index.search(query, 3)
 
     best_score = float(scores[0][0])
     best_id = int(ids[0][0])
 
-    for person, records in user_map.items():
-        for r in records:
-
-            # ONLY accept dict format
-            if isinstance(r, dict):
-                if r.get("id") == best_id:
-                    quality = image_quality(img_path)
-                    confidence = 0.7 * best_score + 0.3 * quality
-                    return person, r.get("angle"), confidence
-
-            # ignore everything else safely
-            else:
-                continue
+    # O(1) id -> (person, angle); records without an angle are legacy, ignore
+    person, angle = db.reverse.lookup(best_id)
+    if person is None or angle is None:
+        return None, None, 0
 
-    return None, None, 0
+    quality = image_quality(img, face.bbox)  # face ROI of the already decoded image
+    confidence = 0.7 * best_score + 0.3 * quality
+    return person, angle, confidence
 
 # =========================
 # MAIN
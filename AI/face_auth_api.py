@@ -7,22 +7,36 @@ warnings.filterwarnings("ignore", category=FutureWarning)
 # =========================
 # IMPORTS
 # =========================
-import os, shutil, pickle
+import os, io, time, pickle, zipfile, asyncio, tempfile, threading
+from typing import List
 import cv2
 import faiss
 import numpy as np
-from fastapi import FastAPI, UploadFile, File
-from insightface.app import FaceAnalysis
-from skimage import filters
+from fastapi import FastAPI, UploadFile, File, Request, HTTPException, WebSocket, WebSocketDisconnect, Depends
+from fastapi.concurrency import run_in_threadpool
+
+from inference_pool import InferencePool
+from embedding_batcher import EmbeddingBatcher
+from embedding_cache import EmbeddingCache
+from shared_index import SharedFaceIndex
+from shard_manager import ShardManager
+from liveness import LivenessSessions
+from quality import image_quality
+import preprocess
+from face_engine import FaceEngine
 
 # =========================================================
 # CONFIGURATION  ✅ ALL UPDATES APPLIED HERE
 # =========================================================
 
-# Temporary folder to store images (auto-deleted after use)
-UPLOAD_DIR = "runtime_images"
+# Shared vector store (prod_face_db.vec / .labels), mapped by every worker
+STORE_PATH = "prod_face_db"
+
+# Per-project shards (shards/<project_id>/face.vec) and how many stay in RAM
+SHARD_ROOT = "shards"
+MAX_LOADED_SHARDS = int(os.environ.get("FACE_AUTH_MAX_SHARDS", 32))
 
-# Vector database files
+# Legacy single-process files, imported once into the shared store
 DB_PATH = "prod_face_db.index"
 MAP_PATH = "prod_user_map.pkl"
 
@@ -32,50 +46,310 @@ VECTOR_DIM = 512
 # Authentication decision threshold (stricter security)
 THRESHOLD = 0.70
 
-# Face detection resolution (balanced accuracy & speed)
+# Face detection resolution (balanced accuracy & speed); the first pass
+# runs smaller, sized from the image, and this is the fallback
 DET_SIZE = (512, 512)
 
+# Candidates fetched per search, resolved to distinct users
+TOP_K = 5
+
 # Session confidence weights
 SIMILARITY_WEIGHT = 0.8
 QUALITY_WEIGHT = 0.2
 
-# =========================================================
-# SETUP
-# =========================================================
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Inference pool: "thread" or "process", workers + bounded wait queue
+INFERENCE_EXECUTOR = os.environ.get("FACE_AUTH_EXECUTOR", "thread")
+INFERENCE_WORKERS = int(os.environ.get("FACE_AUTH_WORKERS", 2))
+INFERENCE_QUEUE = int(os.environ.get("FACE_AUTH_QUEUE", 8))
+
+# Seconds a client is told to wait when the queue is full (503)
+RETRY_AFTER_SECONDS = 2
+
+# Recognition micro-batching: close a batch at N crops or after M ms
+BATCH_MAX_SIZE = int(os.environ.get("FACE_AUTH_BATCH_SIZE", 16))
+BATCH_MAX_WAIT_MS = float(os.environ.get("FACE_AUTH_BATCH_WAIT_MS", 5))
+
+# Upload-hash -> embedding cache; set FACE_AUTH_CACHE_DB to share it on disk
+CACHE_SIZE = int(os.environ.get("FACE_AUTH_CACHE_SIZE", 2048))
+CACHE_TTL = float(os.environ.get("FACE_AUTH_CACHE_TTL", 600))
+CACHE_DB_PATH = os.environ.get("FACE_AUTH_CACHE_DB")
+
+# /enroll/batch limits (images per call, bytes per image, bytes per zip)
+BATCH_ENROLL_MAX_IMAGES = 500
+BATCH_ENROLL_MAX_BYTES = 20 * 1024 * 1024
+BATCH_ENROLL_MAX_ARCHIVE_BYTES = 200 * 1024 * 1024
+
+# Images per inference-pool job in /enroll/batch; small, so a big batch
+# queues behind /authenticate calls instead of holding every worker
+BATCH_ENROLL_CHUNK = 8
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+# Search index: "auto" picks flat / hnsw / ivf_flat / ivf_pq by DB size
+INDEX_TIER = os.environ.get("FACE_AUTH_INDEX_TIER", "auto")
+NPROBE = int(os.environ.get("FACE_AUTH_NPROBE", 16))
+EF_SEARCH = int(os.environ.get("FACE_AUTH_EF_SEARCH", 64))
+
+# Compressed embedding storage: "fp16" or "pq" codes in RAM, top RERANK*k
+# candidates re-scored against the float32 rows on disk; empty = float32
+STORAGE_CODES = os.environ.get("FACE_AUTH_CODES") or None
+RERANK = int(os.environ.get("FACE_AUTH_RERANK", 4))
+
+# Server-side liveness sessions (each holds its own FaceMesh)
+LIVENESS_MAX_SESSIONS = int(os.environ.get("FACE_AUTH_LIVENESS_SESSIONS", 256))
+LIVENESS_WORKERS = int(os.environ.get("FACE_AUTH_LIVENESS_WORKERS", 2))
+LIVENESS_QUEUE = 16
+LIVENESS_TTL = 120            # idle seconds before a session is dropped
+LIVENESS_TIMEOUT = 60         # seconds to finish the challenge
+LIVENESS_MAX_FRAMES = 600
+LIVENESS_CLIP_FPS = 15        # clip frames are subsampled to this rate
+LIVENESS_MAX_CLIP_BYTES = 50 * 1024 * 1024
+
+# =========================
+# LOAD ARCFACE MODEL + FACE DB (STARTUP HOOK)
+# =========================
+# Importing this module is cheap. The startup hook loads models and the
+# store in a background thread, runs a warm-up inference and only then
+# marks the worker ready, so /healthz answers immediately and /readyz
+# stays 503 until the first real request would be fast.
+engine = det_model = rec_model = None
+store = shards = batcher = None
+
+ready = threading.Event()
+lifecycle = {"status": "starting", "error": None, "load_s": None, "warmup_ms": None, "precision": None}
+
+def load_engine():
+    # Detection + recognition only; the other buffalo_l heads are never read
+    global engine, det_model, rec_model
+    if engine is None:
+        engine = FaceEngine(name="buffalo_l", det_size=DET_SIZE)
+        det_model = engine.det_model
+        rec_model = engine.rec_model
+    return engine
+
+def warm_worker():
+    # Process-pool workers: load (initializer) and run every graph once,
+    # recognition at full batch size since batches run on these workers
+    load_engine().warm_up(batch=BATCH_MAX_SIZE)
+
+def open_store(store_path=STORE_PATH, shard_root=SHARD_ROOT, import_legacy=True):
+    # Safe to run with `uvicorn --workers N`: every worker maps the same file,
+    # the first one to start owns enrollment and the others forward to it.
+    global store, shards
+    store = SharedFaceIndex(store_path, VECTOR_DIM, tier=INDEX_TIER,
+                            nprobe=NPROBE, ef_search=EF_SEARCH,
+                            codes=STORAGE_CODES, rerank=RERANK)
+    store.start_writer_election()
+
+    if import_legacy and store.count == 0 and os.path.exists(DB_PATH) and os.path.exists(MAP_PATH):
+        store.import_legacy(faiss.read_index(DB_PATH), pickle.load(open(MAP_PATH, "rb")))
+
+    # Each SaaS project searches only its own shard; requests without a
+    # project_id keep using the store above
+    shards = ShardManager(
+        shard_root, VECTOR_DIM, default=store,
+        max_loaded=MAX_LOADED_SHARDS,
+        tier=INDEX_TIER, nprobe=NPROBE, ef_search=EF_SEARCH,
+        codes=STORAGE_CODES, rerank=RERANK
+    )
+
+def load_runtime(store_path=STORE_PATH, shard_root=SHARD_ROOT, import_legacy=True,
+                 cache_db=CACHE_DB_PATH):
+    """Load models, open the store and warm up. The defaults are the
+    production paths; benchmark.py passes throw-away ones."""
+    global batcher
+    started = time.perf_counter()
+    try:
+        lifecycle["status"] = "loading"
+        load_engine()
+        # Embeddings from another pack / precision must not be served from cache
+        cache.namespace = f"{engine.name}:{engine.precision}"
+        if cache_db:
+            cache.open_disk(cache_db)
+        open_store(store_path, shard_root, import_legacy)
+
+        # Recognition micro-batcher; each batch runs as one inference-pool
+        # job, so recognition shares the pool's bounded workers
+        batcher = EmbeddingBatcher(
+            rec_model,
+            max_batch=BATCH_MAX_SIZE,
+            max_wait_ms=BATCH_MAX_WAIT_MS,
+            infer=lambda crops: inference.executor.submit(recognize, crops).result()
+        )
+
+        lifecycle["status"] = "warming"
+        warm_started = time.perf_counter()
+        engine.warm_up(batch=BATCH_MAX_SIZE)
+        if INFERENCE_EXECUTOR == "process":
+            for job in [inference.executor.submit(warm_worker) for _ in range(INFERENCE_WORKERS)]:
+                job.result()
+        lifecycle["warmup_ms"] = round(1000 * (time.perf_counter() - warm_started), 1)
+
+        lifecycle.update(status="ready", precision=engine.precision,
+                         load_s=round(time.perf_counter() - started, 2))
+        ready.set()
+        print(f"[INFO] Ready in {lifecycle['load_s']}s (warm-up {lifecycle['warmup_ms']} ms)")
+    except Exception as e:
+        lifecycle.update(status="failed", error=repr(e))
+        print(f"❌ Startup failed: {e!r}")
 
 # =========================
-# LOAD ARCFACE MODEL (ONE TIME)
+# INFERENCE POOL
 # =========================
-face_app = FaceAnalysis(name="buffalo_l", providers=["CPUExecutionProvider"])
-face_app.prepare(ctx_id=0, det_size=DET_SIZE)
+inference = InferencePool(
+    workers=INFERENCE_WORKERS,
+    max_queue=INFERENCE_QUEUE,
+    kind=INFERENCE_EXECUTOR,
+    retry_after=RETRY_AFTER_SECONDS,
+    initializer=load_engine if INFERENCE_EXECUTOR == "process" else None
+)
 
 # =========================
-# LOAD / CREATE FAISS DB
+# EMBEDDING CACHE
 # =========================
-if os.path.exists(DB_PATH) and os.path.exists(MAP_PATH):
-    index = faiss.read_index(DB_PATH)
-    user_map = pickle.load(open(MAP_PATH, "rb"))
-else:
-    index = faiss.IndexFlatIP(VECTOR_DIM)
-    user_map = {}
+# In memory until load_runtime attaches the shared disk tier (if any)
+cache = EmbeddingCache(max_items=CACHE_SIZE, ttl=CACHE_TTL)
+
+# =========================
+# LIVENESS SESSIONS
+# =========================
+# Always a thread pool: session state (FaceMesh tracking) lives in this process
+liveness_sessions = LivenessSessions(
+    max_sessions=LIVENESS_MAX_SESSIONS, ttl=LIVENESS_TTL,
+    timeout=LIVENESS_TIMEOUT, max_frames=LIVENESS_MAX_FRAMES
+)
+liveness_pool = InferencePool(
+    workers=LIVENESS_WORKERS,
+    max_queue=LIVENESS_QUEUE,
+    kind="thread",
+    retry_after=RETRY_AFTER_SECONDS
+)
 
 # =========================
 # UTILITY FUNCTIONS
 # =========================
-def get_embedding(img_path):
-    img = cv2.imread(img_path)
-    faces = face_app.get(img)
-    if len(faces) == 0:
+def detect_face(img):
+    # Detection only; returns the 112x112 ArcFace crop, score and bbox of the largest face
+    face = engine.detect_face(img)
+    if face is None:
         raise ValueError("No face detected")
+    return face.crop, face.det_score, face.bbox
+
+def get_embedding(img):
+    # Unbatched path (detection + recognition in one call)
+    return engine.embed([detect_face(img)[0]])[0]
+
+# =========================
+# POOL JOBS (run off the event loop)
+# =========================
+def analyze_frame(img):
+    # Quality is scored on the face the detector already found, not the whole frame
+    crop, det_score, bbox = detect_face(img)
+    return crop, det_score, image_quality(img, bbox), bbox
+
+def analyze_upload(data):
+    # Big JPEGs are decoded at 1/2..1/8 scale; only a face too small for a
+    # sharp crop at that scale costs a full-resolution decode. Quality is
+    # scored once, on the image the crop came from
+    img, face = engine.detect_encoded(data)
+    if face is None:
+        raise ValueError("No face detected")
+    return face.crop, face.det_score, image_quality(img, face.bbox)
+
+def recognize(crops):
+    # One batcher batch; raw features, the batcher normalises them
+    return load_engine().rec_model.get_feat(crops)
+
+def embed_crops(crops):
+    return load_engine().embed(crops)
+
+def analyze_many(blobs):
+    # One pool job per chunk; failures are reported per image, not raised
+    results = []
+    for data in blobs:
+        try:
+            results.append(("ok", analyze_upload(data)))
+        except Exception as e:
+            results.append(("error", str(e)))
+    return results
+
+def liveness_frames(session, blobs):
+    # Frames in order, stopping as soon as the challenge is decided
+    for data in blobs:
+        if session.challenge.done:
+            break
+        session.feed(preprocess.decode(data)[0])
+    return session.status()
+
+def liveness_clip(session, path, fps=LIVENESS_CLIP_FPS):
+    # Clip time drives the challenge clock, so a 5 s clip is judged as 5 s,
+    # but it never runs behind the server's clock: client-supplied
+    # timestamps cannot stretch the challenge timeout
+    cap = cv2.VideoCapture(path)
+    base = time.time()
+    next_t = 0.0
+    try:
+        while not session.challenge.done:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            t = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            if t < next_t:
+                continue
+            next_t = t + 1.0 / fps
+            session.feed(frame, now=max(base + t, time.time()))
+    finally:
+        cap.release()
+    return session.status()
+
+def read_archive(data):
+    # Zip layout: <user_id>/<image>.jpg, like the enroll/<person>/ folders.
+    # Entries are counted before any of them is decompressed
+    items = []
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        entries = []
+        for info in zf.infolist():
+            parts = info.filename.strip("/").split("/")
+            if info.is_dir() or len(parts) < 2 or not info.filename.lower().endswith(IMAGE_EXTS):
+                continue
+            entries.append((info, parts))
+        if len(entries) > BATCH_ENROLL_MAX_IMAGES:
+            raise ValueError(f"At most {BATCH_ENROLL_MAX_IMAGES} images per batch")
+
+        for info, parts in entries:
+            if info.file_size > BATCH_ENROLL_MAX_BYTES:
+                items.append((parts[-2], info.filename, None))
+                continue
+            items.append((parts[-2], info.filename, zf.read(info)))
+    return items
+
+def add_vector(db, user_id, emb):
+    return db.append(emb.reshape(1, -1), [user_id])
 
-    emb = faces[0].embedding
-    return emb / np.linalg.norm(emb)
+def search_vector(db, emb, k=TOP_K):
+    scores, ids = db.search(emb.reshape(1, -1), k)
+    return db.resolve(scores[0], ids[0])  # [(user_id, score, vector_id)], best first
 
-def image_quality(img_path):
-    img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-    blur_score = filters.laplace(img).var()
-    return min(blur_score / 500, 1.0)
+def verify_vector(db, user_id, emb):
+    # 1:1 — only the claimed user's vectors, one small matrix product
+    vectors = db.user_vectors(user_id)
+    if len(vectors) == 0:
+        return None
+    return float((vectors @ emb).max())
+
+def session_scores(similarity, quality):
+    similarity = float(similarity)          # 🔥 convert to Python float
+    quality = float(quality)
+    session_confidence = float(
+        SIMILARITY_WEIGHT * similarity +
+        QUALITY_WEIGHT * quality
+    )
+    passed = bool(session_confidence >= THRESHOLD)  # 🔥 convert to Python bool
+    return passed, {
+        "similarity_score": round(similarity, 3),
+        "image_quality": round(quality, 3),
+        "session_confidence": round(session_confidence, 3),
+        "threshold": float(THRESHOLD)
+    }
 
 # =========================
 # FASTAPI APP
@@ -86,65 +360,331 @@ app = FastAPI(
     version="1.0"
 )
 
+@app.on_event("startup")
+def start_loading():
+    threading.Thread(target=load_runtime, name="model-loader", daemon=True).start()
+
+async def embed_upload(request, data):
+    # Identical bytes (client / webhook retries) skip inference entirely
+    key, hit = await run_in_threadpool(cache.lookup, data)
+    if hit is not None:
+        return hit
+
+    crop, det_score, quality = await inference.run(request, analyze_upload, data)
+    # The crop waits in the batcher holding a pool slot: 503 when full
+    emb = await inference.submit(request, batcher.submit, crop)
+    await run_in_threadpool(cache.put, key, (emb, det_score, quality))
+    return emb, det_score, quality
+
+async def liveness_reply(request, session):
+    # Once passed, embed the sharpest near-frontal frame (done once per session)
+    if session.challenge.state == "passed" and session.result is None:
+        try:
+            crop, det_score, quality, _ = await inference.run(
+                request, analyze_frame, session.challenge.result_frame())
+            emb = await inference.submit(request, batcher.submit, crop)
+            session.result = {
+                "embedding": emb.tolist(),
+                "det_score": round(det_score, 3),
+                "image_quality": round(float(quality), 3)
+            }
+        except ValueError as e:
+            session.result = {"error": str(e)}
+    return {**session.status(), "result": session.result}
+
+def get_liveness_session(session_id):
+    session = liveness_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired liveness session")
+    return session
+
+def require_ready():
+    # Model endpoints answer 503 until the startup hook has warmed up
+    if not ready.is_set():
+        raise HTTPException(status_code=503, detail=f"Service {lifecycle['status']}, retry later",
+                            headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+async def get_shard(project_id, read=False):
+    # Reads of a project with no shard get None: nothing is created on disk
+    # and the global store (every tenant's faces) is never searched instead
+    try:
+        return await run_in_threadpool(shards.get_for_read if read else shards.get, project_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # =========================
 # ENROLL API
 # =========================
-@app.post("/enroll")
-async def enroll(user_id: str, image: UploadFile = File(...)):
-    temp_path = f"{UPLOAD_DIR}/{image.filename}"
-    with open(temp_path, "wb") as f:
-        shutil.copyfileobj(image.file, f)
+@app.post("/enroll", dependencies=[Depends(require_ready)])
+async def enroll(request: Request, user_id: str, project_id: str = None,
+                 image: UploadFile = File(...)):
+    db = await get_shard(project_id)
+    data = await image.read()  # 🔒 image never touches disk
 
-    try:
-        emb = get_embedding(temp_path)
-        vector_id = index.ntotal
-        index.add(emb.reshape(1, -1))
+    emb, _, _ = await embed_upload(request, data)
+    vector_id = await run_in_threadpool(add_vector, db, user_id, emb)
 
-        user_map.setdefault(user_id, []).append(vector_id)
+    return {
+        "status": "enrolled",
+        "user_id": user_id,
+        "vector_id": vector_id
+    }
 
-        faiss.write_index(index, DB_PATH)
-        pickle.dump(user_map, open(MAP_PATH, "wb"))
+# =========================
+# BATCH ENROLL API
+# =========================
+@app.post("/enroll/batch", dependencies=[Depends(require_ready)])
+async def enroll_batch(request: Request, user_id: str = None, project_id: str = None,
+                       images: List[UploadFile] = File(None),
+                       archive: UploadFile = File(None)):
+    """Many images in one call: `images` for a single `user_id`, or a zip
+    `archive` laid out as <user_id>/<image>. Vectors are appended and
+    persisted once; the response reports every image."""
+    db = await get_shard(project_id)
 
-        return {
-            "status": "enrolled",
-            "user_id": user_id,
-            "vector_id": vector_id
-        }
+    if archive is not None:
+        data = await archive.read(BATCH_ENROLL_MAX_ARCHIVE_BYTES + 1)
+        if len(data) > BATCH_ENROLL_MAX_ARCHIVE_BYTES:
+            raise HTTPException(status_code=413, detail="archive too large")
+        try:
+            items = await run_in_threadpool(read_archive, data)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="archive is not a zip file")
+        except ValueError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+    elif images and user_id:
+        if len(images) > BATCH_ENROLL_MAX_IMAGES:
+            raise HTTPException(status_code=413, detail=f"At most {BATCH_ENROLL_MAX_IMAGES} images per batch")
+        items = []
+        for image in images:
+            # Read one byte past the cap: oversized files are reported, not held
+            data = await image.read(BATCH_ENROLL_MAX_BYTES + 1)
+            items.append((user_id, image.filename, None if len(data) > BATCH_ENROLL_MAX_BYTES else data))
+    else:
+        raise HTTPException(status_code=400, detail="Send 'images' with a user_id, or a zip 'archive'")
 
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)  # 🔒 image deleted immediately
+    if not items:
+        raise HTTPException(status_code=400, detail="No images found")
+
+    report = [{"user_id": uid, "file": name, "status": "error", "error": "file too large"}
+              if data is None else {"user_id": uid, "file": name}
+              for uid, name, data in items]
+    todo = [i for i, (_, _, data) in enumerate(items) if data is not None]
+
+    # Decode + detection in small pool jobs. Each of `workers` lanes has at
+    # most one job queued, so other requests get a worker between chunks
+    chunks = [todo[i:i + BATCH_ENROLL_CHUNK] for i in range(0, len(todo), BATCH_ENROLL_CHUNK)]
+
+    async def lane(lane_chunks):
+        return [(chunk, await inference.run(request, analyze_many, [items[i][2] for i in chunk]))
+                for chunk in lane_chunks]
+
+    lanes = await asyncio.gather(*[lane(chunks[w::inference.workers]) for w in range(inference.workers)])
+
+    crops = {}
+    for chunk, chunk_results in [done for lane_results in lanes for done in lane_results]:
+        for i, (status, value) in zip(chunk, chunk_results):
+            if status == "ok":
+                crops[i] = value[0]
+            else:
+                report[i].update(status="error", error=value)
+
+    # Recognition in full-size batches, one pool job each, in the same lanes
+    order = sorted(crops)
+    batches = [order[i:i + BATCH_MAX_SIZE] for i in range(0, len(order), BATCH_MAX_SIZE)]
+
+    async def embed_lane(lane_batches):
+        return [await inference.run(request, embed_crops, [crops[i] for i in batch])
+                for batch in lane_batches]
+
+    embed_lanes = await asyncio.gather(*[embed_lane(batches[w::inference.workers])
+                                         for w in range(inference.workers)])
+    # Lane w holds batches w, w + workers, ...: interleave back into `order`
+    embeddings = [None] * len(batches)
+    for w, lane_results in enumerate(embed_lanes):
+        embeddings[w::inference.workers] = lane_results
+
+    if order:
+        vectors = np.vstack(embeddings)
+        user_ids = [items[i][0] for i in order]
+        start_id = await run_in_threadpool(db.append, vectors, user_ids)  # one append, one fsync
+        for offset, i in enumerate(order):
+            report[i].update(status="enrolled", vector_id=start_id + offset)
+
+    return {
+        "enrolled": len(order),
+        "failed": len(items) - len(order),
+        "results": report
+    }
 
 # =========================
 # AUTHENTICATE API
 # =========================
-@app.post("/authenticate")
-async def authenticate(image: UploadFile = File(...)):
-    temp_path = f"{UPLOAD_DIR}/{image.filename}"
-    with open(temp_path, "wb") as f:
-        shutil.copyfileobj(image.file, f)
+@app.post("/authenticate", dependencies=[Depends(require_ready)])
+async def authenticate(request: Request, project_id: str = None,
+                       image: UploadFile = File(...)):
+    db = await get_shard(project_id, read=True)
+    data = await image.read()  # 🔒 image never touches disk
+
+    emb, _, quality = await embed_upload(request, data)
+    matches = await run_in_threadpool(search_vector, db, emb) if db is not None else []
+
+    matched_user, similarity, _ = matches[0] if matches else (None, 0.0, -1)
+    authenticated, scores = session_scores(similarity, quality)
 
+    return {
+        "authenticated": authenticated,
+        "user_id": matched_user if authenticated else None,
+        **scores
+    }
+
+# =========================
+# VERIFY API (1:1)
+# =========================
+@app.post("/verify", dependencies=[Depends(require_ready)])
+async def verify(request: Request, user_id: str, project_id: str = None,
+                 image: UploadFile = File(...)):
+    db = await get_shard(project_id, read=True)
+    if db is None:
+        raise HTTPException(status_code=404, detail="Unknown user_id")
+    data = await image.read()  # 🔒 image never touches disk
+
+    emb, _, quality = await embed_upload(request, data)
+    similarity = await run_in_threadpool(verify_vector, db, user_id, emb)
+    if similarity is None:
+        raise HTTPException(status_code=404, detail="Unknown user_id")
+
+    verified, scores = session_scores(similarity, quality)
+
+    return {
+        "verified": verified,
+        "user_id": user_id,
+        **scores
+    }
+
+# =========================
+# LIVENESS API
+# =========================
+@app.post("/liveness/session", dependencies=[Depends(require_ready)])
+async def liveness_start():
+    session = await run_in_threadpool(liveness_sessions.create)
+    if session is None:
+        raise HTTPException(status_code=503, detail="Too many liveness sessions, retry later",
+                            headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    return {**session.status(), "expires_in": LIVENESS_TTL, "timeout": LIVENESS_TIMEOUT}
+
+@app.post("/liveness/{session_id}/frame", dependencies=[Depends(require_ready)])
+async def liveness_upload(request: Request, session_id: str,
+                         frames: List[UploadFile] = File(...)):
+    """One or more frames, in capture order. Processing stops early once
+    the challenge is passed or failed."""
+    session = get_liveness_session(session_id)
+    blobs = [await frame.read() for frame in frames]
     try:
-        emb = get_embedding(temp_path)
-        scores, _ = index.search(emb.reshape(1, -1), 1)
-
-        similarity = float(scores[0][0])        # 🔥 convert to Python float
-        quality = float(image_quality(temp_path))
-        session_confidence = float(
-            SIMILARITY_WEIGHT * similarity +
-            QUALITY_WEIGHT * quality
-        )
+        await liveness_pool.run(request, liveness_frames, session, blobs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await liveness_reply(request, session)
 
-        authenticated = bool(session_confidence >= THRESHOLD)  # 🔥 convert to Python bool
+@app.post("/liveness/{session_id}/clip", dependencies=[Depends(require_ready)])
+async def liveness_video(request: Request, session_id: str,
+                         video: UploadFile = File(...)):
+    session = get_liveness_session(session_id)
+    data = await video.read()
+    if len(data) > LIVENESS_MAX_CLIP_BYTES:
+        raise HTTPException(status_code=413, detail="Clip too large")
 
-        return {
-            "authenticated": authenticated,
-            "similarity_score": round(similarity, 3),
-            "image_quality": round(quality, 3),
-            "session_confidence": round(session_confidence, 3),
-            "threshold": float(THRESHOLD)
-        }
+    # OpenCV only decodes video from a path; the file is removed right after
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(video.filename or "")[1] or ".mp4") as tmp:
+        tmp.write(data)
+        tmp.flush()
+        await liveness_pool.run(request, liveness_clip, session, tmp.name)
+    return await liveness_reply(request, session)
 
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+@app.websocket("/liveness/{session_id}/ws")
+async def liveness_stream(websocket: WebSocket, session_id: str):
+    """Binary messages are encoded frames; every frame gets a JSON status
+    back. The socket closes once the challenge is decided."""
+    await websocket.accept()
+    if not ready.is_set():
+        await websocket.close(code=1013, reason="Service not ready, retry later")
+        return
+    session = liveness_sessions.get(session_id)
+    if session is None:
+        await websocket.close(code=4404, reason="Unknown or expired liveness session")
+        return
+
+    try:
+        while True:
+            data = await websocket.receive_bytes()
+            # Keeps the session alive; stop if it expired or was dropped
+            if liveness_sessions.get(session_id) is None:
+                await websocket.close(code=4410, reason="Liveness session expired")
+                break
+            try:
+                await liveness_pool.run(None, liveness_frames, session, [data])
+            except (ValueError, HTTPException) as e:
+                await websocket.send_json({"error": getattr(e, "detail", str(e))})
+                continue
+
+            await websocket.send_json(await liveness_reply(None, session))
+            if session.challenge.done:
+                await websocket.close()
+                break
+    except WebSocketDisconnect:
+        pass
+
+@app.delete("/liveness/{session_id}")
+async def liveness_end(session_id: str):
+    session = await run_in_threadpool(liveness_sessions.drop, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired liveness session")
+    return {"session_id": session_id, "state": session.challenge.state}
+
+# =========================
+# HEALTH / READINESS
+# =========================
+@app.get("/healthz")
+def healthz():
+    # Process is up and serving; says nothing about models
+    return {"status": "ok", "lifecycle": lifecycle["status"]}
+
+@app.get("/readyz")
+def readyz():
+    # Only warm workers should get traffic
+    if not ready.is_set():
+        raise HTTPException(status_code=503, detail=lifecycle)
+    return lifecycle
+
+# =========================
+# METRICS
+# =========================
+@app.get("/metrics")
+def metrics():
+    return {
+        "lifecycle": lifecycle,
+        "inference_pool": inference.stats(),
+        "embedding_batcher": batcher.stats() if batcher is not None else None,
+        "embedding_cache": cache.stats(),
+        "store": {
+            "vectors": store.count,
+            "is_writer": store.is_writer,
+            "index": store.tiered.describe()
+        } if store is not None else None,
+        "shards": shards.stats() if shards is not None else None,
+        "liveness": {**liveness_sessions.stats(), "pool": liveness_pool.stats()}
+    }
+
+@app.on_event("shutdown")
+def shutdown_pool():
+    inference.shutdown()
+    liveness_pool.shutdown()
+    liveness_sessions.close()
+    cache.close()
+    # Loaded by the startup hook; absent if shut down before it finished
+    if batcher is not None:
+        batcher.close()
+    if shards is not None:
+        shards.close()
+    if store is not None:
+        store.close()
@@ -0,0 +1,254 @@
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import onnxruntime as ort
+from insightface import model_zoo
+from insightface.model_zoo.model_zoo import ModelRouter
+from insightface.app.common import Face
+from insightface.utils import face_align
+from insightface.utils.storage import ensure_available
+
+import preprocess
+
+
+# =========================
+# CONFIG
+# =========================
+# The only two heads this codebase reads (.bbox / .det_score / .embedding)
+CORE_MODULES = ["detection", "recognition"]
+
+# Other heads in the buffalo packs, loaded only when asked for
+EXTRA_MODULES = ["landmark_2d_106", "landmark_3d_68", "genderage"]
+
+CROP_SIZE = 112
+
+# INT8 recognition models written by quantize_rec.py; set FACE_AUTH_INT8=0
+# to force the FP32 model even when one is active
+QUANT_DIR = os.environ.get("FACE_AUTH_QUANT_DIR", "quantized")
+USE_INT8 = os.environ.get("FACE_AUTH_INT8", "1") != "0"
+
+# ONNX Runtime graph optimisation is done once and the optimised graphs
+# are kept here, so later starts skip it; empty disables the cache
+ORT_CACHE_DIR = os.environ.get("FACE_AUTH_ORT_CACHE", "ort_cache")
+
+
+def int8_marker_path(name):
+    return os.path.join(QUANT_DIR, f"{name}_rec_int8.json")
+
+def sha256_of(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def active_int8_model(name):
+    """The activation marker for pack `name`, if quantize_rec.py passed its
+    accuracy checks (or was forced), the model file is still there and the
+    FP32 model it was quantised from is unchanged."""
+    path = int8_marker_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        marker = json.load(f)
+    if not marker.get("active") or not os.path.exists(marker.get("model", "")):
+        return None
+
+    # A replaced pack must not be paired with a model quantised from the old one
+    source = marker.get("source", "")
+    if not os.path.exists(source) or sha256_of(source) != marker.get("source_sha256"):
+        print(f"❌ INT8 model {marker['model']} was built from a different {name} "
+              f"recognition model; using FP32 (re-run quantize_rec.py)")
+        return None
+    return marker
+
+
+def largest(bboxes):
+    """Row of the largest box (by area) in an (N, 4+) bbox array."""
+    return int(np.argmax((bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])))
+
+
+# =========================
+# MODEL LOADING
+# =========================
+def _cache_key(path):
+    st = os.stat(path)
+    raw = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}|{ort.__version__}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+def load_model(path, providers, cache_dir=ORT_CACHE_DIR, tasks=None):
+    """model_zoo.get_model, through an on-disk cache of the optimised graph.
+
+    The first load optimises the source model and saves the result next
+    to a small JSON sidecar with what insightface inferred from the source
+    graph (task, input mean / std). Later loads read the optimised file,
+    and models whose task is not in `tasks` are skipped without opening
+    a session at all.
+    """
+    if not cache_dir:
+        return model_zoo.get_model(path, providers=providers)
+
+    stem = os.path.join(cache_dir, f"{os.path.splitext(os.path.basename(path))[0]}.{_cache_key(path)}")
+    cached, meta_path = stem + ".onnx", stem + ".json"
+
+    if os.path.exists(cached) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if tasks is not None and meta["taskname"] not in tasks:
+            return None
+        # Already optimised: ORT must not redo it (get_model has no way to
+        # pass session options, so route the file directly)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        model = ModelRouter(cached).get_model(providers=providers, sess_options=options)
+        if model is not None and "input_mean" in meta:
+            model.input_mean, model.input_std = meta["input_mean"], meta["input_std"]
+        return model
+
+    model = model_zoo.get_model(path, providers=providers)
+    if model is None:
+        return None
+
+    # Workers can cold-start together: each writes its own temp files and
+    # renames them into place, so nobody reads a half-written graph or sidecar
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_graph = f"{cached}.{os.getpid()}.tmp"
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    options.optimized_model_filepath = tmp_graph
+    ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+    os.replace(tmp_graph, cached)
+
+    meta = {"taskname": model.taskname, "source": os.path.abspath(path)}
+    if model.taskname == "recognition":
+        meta.update(input_mean=float(model.input_mean), input_std=float(model.input_std))
+    tmp_meta = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_meta, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta, meta_path)
+    return model
+
+
+# =========================
+# DETECTION + RECOGNITION ENGINE
+# =========================
+class FaceEngine:
+    """Drop-in for `FaceAnalysis.get` that loads and runs only detection and
+    recognition.
+
+    Crops are aligned from the detector's 5-point keypoints and every face
+    in a frame is embedded in one recognition call. Pass `extra=("genderage",)`
+    etc. to load and run other heads of the pack as well.
+
+    When quantize_rec.py has activated an INT8 recognition model for the
+    pack it is used instead of the FP32 one (`int8=False` opts out).
+    """
+
+    def __init__(self, name="buffalo_l", det_size=(640, 640), extra=(),
+                 providers=("CPUExecutionProvider",), ctx_id=0, int8=USE_INT8,
+                 root="~/.insightface", cache_dir=ORT_CACHE_DIR):
+        unknown = set(extra) - set(EXTRA_MODULES)
+        if unknown:
+            raise ValueError(f"Unknown model heads: {sorted(unknown)}")
+        providers = list(providers)
+
+        # The FP32 recognition model is not even loaded when INT8 is active
+        marker = active_int8_model(name) if int8 else None
+        wanted = {"detection", *extra} | (set() if marker else {"recognition"})
+
+        # Same discovery as FaceAnalysis, minus the heads nobody asked for
+        self.models = {}
+        self.model_files = {}
+        for onnx_file in sorted(glob.glob(os.path.join(ensure_available("models", name, root=root), "*.onnx"))):
+            model = load_model(onnx_file, providers, cache_dir, tasks=wanted)
+            if model is None or model.taskname not in wanted or model.taskname in self.models:
+                continue
+            self.models[model.taskname] = model
+            self.model_files[model.taskname] = onnx_file
+        if "detection" not in self.models:
+            raise RuntimeError(f"No detection model in pack {name}")
+
+        if marker:
+            rec = load_model(marker["model"], providers, cache_dir)
+            rec.input_mean, rec.input_std = marker["input_mean"], marker["input_std"]
+            self.models["recognition"] = rec
+            self.model_files["recognition"] = marker["model"]
+            print(f"[INFO] Using INT8 recognition model {marker['model']}")
+        self.name = name
+        self.precision = "int8" if marker else "fp32"
+
+        self.det_size = tuple(det_size)
+        for taskname, model in self.models.items():
+            if taskname == "detection":
+                model.prepare(ctx_id, input_size=self.det_size, det_thresh=0.5)
+            else:
+                model.prepare(ctx_id)
+
+        self.det_model = self.models["detection"]
+        self.rec_model = self.models["recognition"]
+        self.extra_models = [m for key, m in self.models.items() if key not in CORE_MODULES]
+
+    def detect(self, img, max_num=0):
+        """(bboxes, kpss); small adaptive input first, det_size as fallback."""
+        return preprocess.detect(self.det_model, img, self.det_size, max_num=max_num)
+
+    @staticmethod
+    def align(img, kps):
+        return face_align.norm_crop(img, landmark=kps, image_size=CROP_SIZE)
+
+    def detect_face(self, img):
+        """The largest face in `img` from one detector pass, as a Face with
+        bbox, kps, det_score and its aligned 112x112 `crop`; None if there
+        is no face. Cropping, quality scoring and embedding all work from
+        this result instead of detecting again."""
+        bboxes, kpss = self.detect(img)
+        if len(bboxes) == 0:
+            return None
+        best = largest(bboxes)
+        return Face(bbox=bboxes[best, :4], kps=kpss[best], det_score=float(bboxes[best, 4]),
+                    crop=self.align(img, kpss[best]))
+
+    def detect_encoded(self, data):
+        """(img, face) for encoded image bytes: detect_face on a reduced-size
+        JPEG decode, redone at full size only when the face is too small
+        for a sharp crop at that scale."""
+        img, factor = preprocess.decode(data)
+        face = self.detect_face(img)
+        if face is not None and preprocess.needs_full_decode(factor, face.bbox):
+            img = preprocess.decode(data, target_side=None)[0]
+            face = self.detect_face(img)
+        return img, face
+
+    def embed(self, crops):
+        """L2-normalised (N, 512) embeddings of aligned 112x112 crops."""
+        feats = self.rec_model.get_feat(list(crops))
+        return (feats / np.linalg.norm(feats, axis=1, keepdims=True)).astype("float32")
+
+    def warm_up(self, batch=1):
+        """Run every graph once on dummy input so the first request does
+        not pay ONNX Runtime's first-run cost."""
+        blank = np.zeros((self.det_size[1], self.det_size[0], 3), dtype=np.uint8)
+        self.detect(blank)  # no face: runs the adaptive size and the det_size fallback
+        crop = np.zeros((CROP_SIZE, CROP_SIZE, 3), dtype=np.uint8)
+        self.rec_model.get_feat([crop])
+        if batch > 1:
+            self.rec_model.get_feat([crop] * batch)
+
+    def get(self, img, max_num=0):
+        bboxes, kpss = self.detect(img, max_num=max_num)
+        if len(bboxes) == 0:
+            return []
+
+        faces = [Face(bbox=bboxes[i, :4], kps=kpss[i], det_score=bboxes[i, 4])
+                 for i in range(len(bboxes))]
+
+        # One recognition call for every face in the frame
+        feats = self.rec_model.get_feat([self.align(img, face.kps) for face in faces])
+        for face, feat in zip(faces, feats):
+            face.embedding = feat.flatten()
+            for model in self.extra_models:
+                model.get(img, face)
+        return faces
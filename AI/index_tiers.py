@@ -0,0 +1,506 @@
+import argparse
+import glob
+import json
+import math
+import os
+import threading
+import time
+
+import faiss
+import numpy as np
+
+
+# =========================
+# TIER CONFIG
+# =========================
+# Index type by number of enrolled vectors (upper bound is exclusive)
+TIERS = [
+    ("flat", 50_000),
+    ("hnsw", 500_000),
+    ("ivf_flat", 2_000_000),
+    ("ivf_pq", None)
+]
+
+# Defaults for the search-time knobs; override per deployment
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+
+# Rows appended since the last (re)build are scanned exactly; past this
+# many the ANN index is extended in the background
+TAIL_MAX = 4096
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+PQ_M = 64            # 512 dims -> 64 sub-vectors of 8 dims, 64 bytes per face
+PQ_BITS = 8
+
+# Compressed storage ("fp16" / "pq"): every tier searches codes held in RAM,
+# then re-scores the best `rerank * k` candidates exactly against the raw
+# float32 rows, which stay on disk (memmap) and are read only for those rows
+CODE_TYPES = (None, "fp16", "pq")
+RERANK_FACTOR = 4
+PQ_MIN_TRAIN = 10_000     # below this PQ codebooks are poor; fp16 is used
+TRAIN_SAMPLE = 100_000    # rows sampled from the memmap to train on
+ADD_CHUNK = 65_536        # rows copied out of the memmap per add()
+
+# Published ANN indexes are memory-mapped (codes, IVF lists, HNSW storage),
+# so every process that loads one shares the same page-cache copy instead
+# of holding its own; FAISS builds without it load a private copy
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+
+def choose_tier(n):
+    for kind, limit in TIERS:
+        if limit is None or n < limit:
+            return kind
+    return TIERS[-1][0]
+
+def tier_of(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+def codes_for(codes, kind, n):
+    """Code type actually used for `n` vectors at tier `kind`."""
+    if kind == "ivf_pq":
+        return "pq"
+    if codes == "pq" and n < PQ_MIN_TRAIN:
+        return "fp16"  # too little data for good PQ codebooks
+    return codes
+
+def code_bytes(codes, dim):
+    """RAM per vector for the codes of the first-pass search."""
+    if codes == "fp16":
+        return 2 * dim
+    if codes == "pq":
+        return PQ_M * PQ_BITS // 8
+    return 4 * dim
+
+def _nlist_for(n):
+    # Rule of thumb: ~4*sqrt(n) lists, at least 39 training points per list
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+# =========================
+# BUILD / TUNE
+# =========================
+def new_index(dim, kind="flat", n_hint=0):
+    if kind == "flat":
+        return faiss.IndexFlatIP(dim)
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return index
+
+    nlist = _nlist_for(max(n_hint, 1))
+    quantizer = faiss.IndexFlatIP(dim)
+    if kind == "ivf_flat":
+        return faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+    if kind == "ivf_pq":
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, PQ_M, PQ_BITS, faiss.METRIC_INNER_PRODUCT)
+    raise ValueError(f"Unknown index tier: {kind}")
+
+def new_code_index(dim, kind="flat", codes="fp16", n_hint=0):
+    """Index of the given tier over fp16 or PQ codes instead of float32.
+    PQ needs a trained codebook, so small DBs get fp16 codes."""
+    if codes not in ("fp16", "pq"):
+        raise ValueError(f"Unknown code type: {codes}")
+    encoding = "SQfp16" if codes_for(codes, kind, n_hint) == "fp16" else f"PQ{PQ_M}x{PQ_BITS}"
+
+    if kind == "flat":
+        spec = encoding
+    elif kind == "hnsw":
+        spec = f"HNSW{HNSW_M}_{encoding}"
+    elif kind in ("ivf_flat", "ivf_pq"):
+        spec = f"IVF{_nlist_for(max(n_hint, 1))},{encoding}"
+    else:
+        raise ValueError(f"Unknown index tier: {kind}")
+
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+    if kind == "hnsw":
+        faiss.downcast_index(index).hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    return index
+
+def build_code_index(vectors, kind, codes, nprobe=DEFAULT_NPROBE, ef_search=DEFAULT_EF_SEARCH, seed=0):
+    """Like build_index, but over compressed codes and without ever holding
+    all of `vectors` (usually a memmap) as one float32 copy: training uses
+    a sample and rows are added in chunks."""
+    n = len(vectors)
+    index = new_code_index(vectors.shape[1], kind, codes, n_hint=n)
+
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        pick = np.sort(rng.choice(n, size=min(n, TRAIN_SAMPLE), replace=False))
+        index.train(np.ascontiguousarray(vectors[pick], dtype="float32"))
+    for start in range(0, n, ADD_CHUNK):
+        index.add(np.ascontiguousarray(vectors[start:start + ADD_CHUNK], dtype="float32"))
+
+    set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+    return index
+
+def build_index(vectors, kind=None, nprobe=DEFAULT_NPROBE, ef_search=DEFAULT_EF_SEARCH):
+    """Build (and train if needed) an index of the given tier over `vectors`."""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    kind = kind or choose_tier(len(vectors))
+    index = new_index(vectors.shape[1], kind, n_hint=len(vectors))
+
+    if not index.is_trained:
+        index.train(vectors)
+    if kind in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).make_direct_map()  # keeps reconstruct() working
+
+    index.add(vectors)
+    set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+    return index
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    kind = tier_of(index)
+    params = faiss.ParameterSpace()
+    if kind in ("ivf_flat", "ivf_pq") and nprobe is not None:
+        params.set_index_parameter(index, "nprobe", nprobe)
+    if kind == "hnsw" and ef_search is not None:
+        params.set_index_parameter(index, "efSearch", ef_search)
+
+def all_vectors(index):
+    if tier_of(index) in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+def maybe_migrate(index, nprobe=DEFAULT_NPROBE, ef_search=DEFAULT_EF_SEARCH):
+    """Return `index` rebuilt at the tier its size calls for (or unchanged).
+
+    Vectors are recovered with reconstruct(), so migrating out of ivf_pq
+    is lossy; stores that keep raw vectors should pass those to
+    build_index instead.
+    """
+    target = choose_tier(index.ntotal)
+    if target == tier_of(index):
+        return index
+    print(f"[INFO] Migrating face index {tier_of(index)} -> {target} ({index.ntotal} vectors)")
+    return build_index(all_vectors(index), target, nprobe=nprobe, ef_search=ef_search)
+
+
+# =========================
+# TIERED SEARCH OVER RAW VECTORS
+# =========================
+class TieredIndex:
+    """Search layer over an append-only float32 matrix (e.g. a memmap).
+
+    The flat tier searches the matrix directly without copying it. Larger
+    tiers are built (and later extended) on a copy in a background thread
+    and swapped in when ready, so searches never wait on a build and never
+    see an index that is being modified.
+
+    With `codes="fp16"` or `"pq"` every tier, flat included, is an index of
+    compressed codes; its top `rerank * k` candidates are re-scored against
+    the float32 rows, so scores and match decisions are exact while RAM
+    holds 1 KB (fp16) or 64 bytes (PQ) per 512-d face instead of 2 KB.
+
+    With a `path`, only processes for which `is_builder()` is true build.
+    Each build is written to `<path>.<generation>.faiss` and announced in
+    `<path>.json`; every process, the builder included, searches the
+    published file memory-mapped. Other processes never build: they scan
+    exactly until an index is published.
+    """
+
+    def __init__(self, dim, kind="auto", nprobe=None, ef_search=None, codes=None, rerank=None,
+                 path=None, is_builder=None):
+        if codes not in CODE_TYPES:
+            raise ValueError(f"Unknown code type: {codes}")
+        self.dim = dim
+        self.kind = kind
+        self.nprobe = nprobe or DEFAULT_NPROBE
+        self.ef_search = ef_search or DEFAULT_EF_SEARCH
+        self.codes = codes
+        self.rerank = max(1, rerank or RERANK_FACTOR)
+
+        self.index = None       # ANN index over rows [0, index.ntotal)
+        self.tier = "flat"      # tier and code type self.index was built with
+        self.built_codes = None
+        self._building = None
+        self._lock = threading.Lock()
+
+        self.path = path
+        self.is_builder = is_builder or (lambda: True)
+        self._published = None  # (mtime_ns, file) of the last loaded announcement
+
+    def target_tier(self, n):
+        return choose_tier(n) if self.kind == "auto" else self.kind
+
+    def sync(self, vectors):
+        n = len(vectors)
+        target = self.target_tier(n)
+
+        with self._lock:
+            if target == "flat" and self.codes is None:
+                self.index = None
+                return
+            if self._building is not None:
+                return
+        if self.path is not None:
+            builder = self.is_builder()
+            # A builder restarting picks up its last published index too
+            if not builder or self.index is None:
+                self._load_published(n, target if builder else None)
+            if not builder:
+                return
+
+        with self._lock:
+            if self._building is not None:
+                return
+
+            base = None
+            if (self.index is not None and self.tier == target
+                    and self.built_codes == codes_for(self.codes, target, n)):
+                if n - self.index.ntotal <= TAIL_MAX:
+                    return
+                base = self.index
+            elif self.codes is not None and n <= TAIL_MAX and self.index is None:
+                return  # a few thousand rows: the exact scan is as cheap
+
+            self._building = threading.Thread(
+                target=self._build, args=(vectors[:n], target, base), daemon=True)
+            self._building.start()
+
+    def _build(self, vectors, kind, base):
+        started = time.time()
+        try:
+            if base is not None:
+                # A mapped index is read-only: extend a private copy of it
+                published = self._published_file()
+                index = faiss.read_index(published) if published else faiss.clone_index(base)
+                for start in range(base.ntotal, len(vectors), ADD_CHUNK):
+                    index.add(np.ascontiguousarray(vectors[start:start + ADD_CHUNK]))
+                set_search_params(index, nprobe=self.nprobe, ef_search=self.ef_search)
+            elif self.codes is not None:
+                index = build_code_index(vectors, kind, self.codes, nprobe=self.nprobe, ef_search=self.ef_search)
+            else:
+                index = build_index(vectors, kind, nprobe=self.nprobe, ef_search=self.ef_search)
+            built_codes = codes_for(self.codes, kind, len(vectors)) if base is None else self.built_codes
+            if self.path is not None:
+                index = self._publish(index, kind, built_codes)
+            with self._lock:
+                self.index = index
+                self.tier = kind
+                self.built_codes = built_codes
+        finally:
+            with self._lock:
+                self._building = None
+        print(f"[INFO] {kind} index now covers {len(vectors)} vectors ({time.time() - started:.1f}s)")
+
+    # ---------- published index files ----------
+    def _publish(self, index, kind, codes):
+        """Write `index` as a new generation, announce it, drop older
+        generations and return the memory-mapped copy."""
+        name = f"{self.path}.{time.time_ns()}.faiss"
+        faiss.write_index(index, name + ".tmp")
+        os.replace(name + ".tmp", name)
+
+        meta = {"file": os.path.basename(name), "tier": kind, "codes": codes, "ntotal": index.ntotal}
+        with open(self.path + ".json.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(self.path + ".json.tmp", self.path + ".json")
+
+        # Processes still mapping an old generation keep it until they swap
+        for old in glob.glob(glob.escape(self.path) + ".*.faiss"):
+            if old != name:
+                os.remove(old)
+        self._published = (os.stat(self.path + ".json").st_mtime_ns, meta["file"])
+        return self._open_published(name)
+
+    def _published_file(self):
+        if self.path is None or self._published is None:
+            return None
+        return os.path.join(os.path.dirname(self.path), self._published[1])
+
+    def _open_published(self, name):
+        index = faiss.read_index(name, MMAP_FLAGS)
+        set_search_params(index, nprobe=self.nprobe, ef_search=self.ef_search)
+        return index
+
+    def _load_published(self, n, tier=None):
+        """Swap in the latest published index if it is new, covers no more
+        than the `n` rows this process has mapped, and (for a builder) was
+        built for `tier` with the current code type."""
+        meta_path = self.path + ".json"
+        try:
+            stamp = os.stat(meta_path).st_mtime_ns
+            if self._published is not None and self._published[0] == stamp:
+                return
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta["ntotal"] > n:
+                return  # written after rows this process has not mapped yet
+            if tier is not None and (meta["tier"] != tier or meta["codes"] != codes_for(self.codes, tier, n)):
+                return
+            index = self._open_published(os.path.join(os.path.dirname(meta_path), meta["file"]))
+        except (OSError, ValueError, RuntimeError):
+            return  # not published yet, or replaced mid-read; retried next search
+        with self._lock:
+            self.index = index
+            self.tier = meta["tier"]
+            self.built_codes = meta["codes"]
+        self._published = (stamp, meta["file"])
+
+    def _exact(self, vectors, query, cand):
+        # Re-score candidate ids against the raw rows; each row is read once
+        # (in file order) however many queries it was a candidate for
+        valid = cand >= 0
+        rows, pos = np.unique(cand[valid], return_inverse=True)
+        raw = np.asarray(vectors[rows], dtype="float32")
+        scores = np.full(cand.shape, np.finfo("float32").min, dtype="float32")
+        scores[valid] = np.einsum("ij,ij->i", raw[pos], np.repeat(query, valid.sum(axis=1), axis=0))
+        return scores
+
+    def search(self, vectors, query, k):
+        with self._lock:
+            index, codes = self.index, self.built_codes
+
+        # Rows appended after the last sync are scanned exactly
+        if index is None or index.ntotal == 0:
+            return faiss.knn(query, vectors, k, faiss.METRIC_INNER_PRODUCT)
+
+        if codes is not None:
+            # Approximate scores only pick the candidates
+            _, ids = index.search(query, min(k * self.rerank, index.ntotal))
+            scores = self._exact(vectors, query, ids)
+        else:
+            scores, ids = index.search(query, k)
+
+        if index.ntotal < len(vectors):
+            tail_scores, tail_ids = faiss.knn(
+                query, np.ascontiguousarray(vectors[index.ntotal:]), min(k, len(vectors) - index.ntotal),
+                faiss.METRIC_INNER_PRODUCT)
+            scores = np.hstack([scores, tail_scores])
+            ids = np.hstack([ids, tail_ids + index.ntotal])
+        # Exact re-ranked scores come back in ANN order, so they are always
+        # re-sorted; resolve() relies on best-first rows
+        if codes is not None or scores.shape[1] > k:
+            order = np.argsort(-scores, axis=1)[:, :k]
+            scores = np.take_along_axis(scores, order, axis=1)
+            ids = np.take_along_axis(ids, order, axis=1)
+        return scores, ids
+
+    def describe(self):
+        with self._lock:
+            indexed = self.index.ntotal if self.index is not None else 0
+            return {
+                "mode": self.kind,
+                "tier": self.tier if self.index is not None else "flat",
+                "indexed": indexed,
+                "building": self._building is not None,
+                "nprobe": self.nprobe,
+                "ef_search": self.ef_search,
+                "codes": self.built_codes if self.index is not None else None,
+                "rerank": self.rerank if self.index is not None and self.built_codes else None,
+                "bytes_per_vector": code_bytes(self.built_codes if self.index is not None else None, self.dim)
+            }
+
+
+# =========================
+# RECALL VS LATENCY REPORT
+# =========================
+def recall_report(vectors, k=10, n_queries=200, noise=0.05,
+                  kinds=("flat", "hnsw", "ivf_flat", "ivf_pq"),
+                  nprobes=(1, 4, 16, 64), ef_searches=(16, 32, 64, 128), seed=0,
+                  codes=(None,), rerank=RERANK_FACTOR):
+    """Measure recall@1 / recall@k and latency of each tier against exact
+    search. Queries are live vectors with Gaussian noise, re-normalised,
+    which is close to a fresh capture of an enrolled face.
+
+    `codes` adds the compressed storage modes ("fp16", "pq"), searched the
+    way TieredIndex does: codes first, then exact re-ranking."""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    rng = np.random.default_rng(seed)
+    pick = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[pick] + rng.normal(0, noise, size=(len(pick), vectors.shape[1])).astype("float32")
+    faiss.normalize_L2(queries)
+
+    k = min(k, len(vectors))
+    _, truth = faiss.knn(queries, vectors, k, faiss.METRIC_INNER_PRODUCT)
+
+    def measure(index, kind, code, setting):
+        started = time.perf_counter()
+        if codes_for(code, kind, len(vectors)) is None:
+            _, ids = index.search(queries, k)
+        else:
+            _, cand = index.search(queries, min(k * rerank, index.ntotal))
+            exact = np.where(cand >= 0, np.einsum("qcd,qd->qc", vectors[cand], queries), -np.inf)
+            ids = np.take_along_axis(cand, np.argsort(-exact, axis=1)[:, :k], axis=1)
+        elapsed = time.perf_counter() - started
+        hits_k = [len(set(a) & set(b)) / k for a, b in zip(ids, truth)]
+        return {
+            "index": kind,
+            "codes": code,
+            "bytes_per_vector": code_bytes(codes_for(code, kind, len(vectors)), vectors.shape[1]),
+            **setting,
+            "recall@1": float(np.mean(ids[:, 0] == truth[:, 0])),
+            f"recall@{k}": float(np.mean(hits_k)),
+            "latency_ms_per_query": 1000 * elapsed / len(queries)
+        }
+
+    results = []
+    for code, kind in [(c, kind) for c in codes for kind in kinds]:
+        if kind in ("ivf_flat", "ivf_pq") and len(vectors) < 39 * 2:
+            continue  # not enough data to train
+        if (kind == "ivf_pq" or codes_for(code, kind, len(vectors)) == "pq") and len(vectors) < 2 ** PQ_BITS:
+            continue
+        if code is not None and kind == "ivf_pq":
+            continue  # already PQ codes; same as codes=None
+
+        started = time.perf_counter()
+        index = build_index(vectors, kind) if code is None else build_code_index(vectors, kind, code)
+        build_s = time.perf_counter() - started
+
+        if kind in ("ivf_flat", "ivf_pq"):
+            sweep = [{"nprobe": p} for p in nprobes]
+        elif kind == "hnsw":
+            sweep = [{"efSearch": e} for e in ef_searches]
+        else:
+            sweep = [{}]
+
+        for setting in sweep:
+            set_search_params(index, nprobe=setting.get("nprobe"), ef_search=setting.get("efSearch"))
+            row = measure(index, kind, code, setting)
+            row["build_s"] = build_s
+            results.append(row)
+
+    return {
+        "vectors": len(vectors),
+        "queries": len(queries),
+        "k": k,
+        "recommended_tier": choose_tier(len(vectors)),
+        "results": results
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall vs latency of FAISS index tiers on live face data")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--store", help="Shared API store base path, e.g. prod_face_db")
+    source.add_argument("--index", help="FAISS index file, e.g. face_db.index")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--codes", action="store_true", help="Also measure fp16 / PQ storage with re-ranking")
+    parser.add_argument("--out", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    if args.store:
+        from shared_index import SharedFaceIndex
+        data = np.array(SharedFaceIndex(args.store, args.dim).vectors)
+    else:
+        data = all_vectors(faiss.read_index(args.index))
+
+    report = recall_report(data, k=args.k, n_queries=args.queries,
+                           codes=(None, "fp16", "pq") if args.codes else (None,))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    print(text)
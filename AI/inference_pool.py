@@ -0,0 +1,101 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from fastapi import HTTPException
+
+
+# =========================
+# BOUNDED INFERENCE POOL
+# =========================
+class InferencePool:
+    """Runs blocking model calls off the event loop with a hard admission limit.
+
+    At most `workers` jobs run at once and at most `max_queue` more wait
+    behind them. Anything beyond that is rejected with 503 + Retry-After
+    instead of queueing forever.
+    """
+
+    def __init__(self, workers=2, max_queue=8, kind="thread",
+                 retry_after=2, disconnect_poll=0.1, initializer=None):
+        if kind == "process":
+            # Job functions and their arguments must be picklable;
+            # `initializer` runs once in each worker (e.g. to load models)
+            self.executor = ProcessPoolExecutor(max_workers=workers, initializer=initializer)
+        elif kind == "thread":
+            self.executor = ThreadPoolExecutor(max_workers=workers,
+                                               thread_name_prefix="inference")
+        else:
+            raise ValueError(f"Unknown pool kind: {kind}")
+
+        self.kind = kind
+        self.workers = workers
+        self.capacity = workers + max_queue
+        self.retry_after = retry_after
+        self.disconnect_poll = disconnect_poll
+
+        self.in_flight = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self._lock = threading.Lock()
+
+    def _release(self, _future):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _admit(self):
+        with self._lock:
+            if self.in_flight >= self.capacity:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail="Server busy, retry later",
+                    headers={"Retry-After": str(self.retry_after)}
+                )
+            self.in_flight += 1
+
+    async def run(self, request, fn, *args):
+        return await self.submit(request, self.executor.submit, fn, *args)
+
+    async def submit(self, request, submit, *args):
+        """Admit a job that `submit(*args)` hands to another queue feeding
+        this pool (e.g. the recognition batcher) and await its Future. It
+        holds an admission slot like `run` does."""
+        self._admit()
+        try:
+            job = submit(*args)
+        except BaseException:
+            self._release(None)
+            raise
+        job.add_done_callback(self._release)
+
+        # Cancelling the wrapper also cancels `job` if it has not started yet
+        fut = asyncio.wrap_future(job)
+        try:
+            while True:
+                done, _ = await asyncio.wait({fut}, timeout=self.disconnect_poll)
+                if done:
+                    return fut.result()
+                if request is not None and await request.is_disconnected():
+                    fut.cancel()
+                    with self._lock:
+                        self.cancelled += 1
+                    raise HTTPException(status_code=499, detail="Client closed request")
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+
+    def stats(self):
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "workers": self.workers,
+                "capacity": self.capacity,
+                "in_flight": self.in_flight,
+                "queued": max(0, self.in_flight - self.workers),
+                "rejected": self.rejected,
+                "cancelled": self.cancelled
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,331 @@
+import random
+import secrets
+import threading
+import time
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+
+# Mesh landmarks used by the liveness metrics (eye, mouth, cheeks, nose)
+KEY_LANDMARKS = [159, 145, 133, 33, 61, 291, 234, 454, 1, 263]
+
+# Distances as (from, to) positions in KEY_LANDMARKS:
+# eye vertical, eye horizontal, mouth width, face width
+_DIST_FROM = np.array([0, 2, 4, 6])
+_DIST_TO = np.array([1, 3, 5, 7])
+_NOSE, _CHEEK_L, _CHEEK_R = 8, 3, 9
+
+CHALLENGES = ["BLINK", "SMILE", "TURN"]
+
+
+# =========================
+# FACE MESH METRICS
+# =========================
+class FaceMeshDetector:
+    def __init__(self, static_image_mode=False):
+        self.mp_face_mesh = mp.solutions.face_mesh
+        self.face_mesh = self.mp_face_mesh.FaceMesh(
+            static_image_mode=static_image_mode,
+            min_detection_confidence=0.5, min_tracking_confidence=0.5)
+
+    def get_landmarks(self, image):
+        """Returns the KEY_LANDMARKS as a (10, 2) array of normalised x, y."""
+        results = self.face_mesh.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        if not results.multi_face_landmarks: return None
+
+        # Only the points the metrics read, not all 468 mesh landmarks
+        lm = results.multi_face_landmarks[0].landmark
+        return np.array([(lm[i].x, lm[i].y) for i in KEY_LANDMARKS], dtype=np.float32)
+
+    def landmarks_batch(self, images):
+        """(N, 10, 2) key landmarks for a sequence of frames; NaN where no face."""
+        out = np.full((len(images), len(KEY_LANDMARKS), 2), np.nan, dtype=np.float32)
+        for i, image in enumerate(images):
+            points = self.get_landmarks(image)
+            if points is not None: out[i] = points
+        return out
+
+    def get_metrics(self, image):
+        """Returns (ear, mar, yaw) efficiently."""
+        points = self.get_landmarks(image)
+        if points is None: return None, None, None
+        return self.metrics_from_points(points)
+
+    @staticmethod
+    def metrics_from_points(points):
+        ear, mar, yaw = metrics_batch(points)[0]
+        return float(ear), float(mar), float(yaw)
+
+    def close(self):
+        self.face_mesh.close()
+
+
+def metrics_batch(points):
+    """(ear, mar, yaw) for many faces at once.
+
+    `points` is (N, 468, 2) full meshes or (N, 10, 2) KEY_LANDMARKS, or a
+    single (468, 2) / (10, 2) face. Returns an (N, 3) array; NaN rows stay
+    NaN.
+    """
+    p = np.asarray(points, dtype=np.float32)
+    if p.ndim == 2: p = p[None]
+    if p.shape[1] != len(KEY_LANDMARKS): p = p[:, KEY_LANDMARKS]
+
+    # EAR (Left Eye), MAR (Smile): ratios of landmark distances
+    diff = p[:, _DIST_FROM] - p[:, _DIST_TO]
+    dist = np.sqrt((diff ** 2).sum(axis=2))
+    ear = np.divide(dist[:, 0], dist[:, 1], out=np.zeros(len(p), np.float32), where=dist[:, 1] > 0)
+    mar = np.divide(dist[:, 2], dist[:, 3], out=np.zeros(len(p), np.float32), where=dist[:, 3] > 0)
+
+    # Yaw (Head Turn): nose position between the eye corners
+    x = p[:, :, 0]
+    face_width = x[:, _CHEEK_R] - x[:, _CHEEK_L]
+    ratio = np.divide(x[:, _NOSE] - x[:, _CHEEK_L], face_width,
+                      out=np.full(len(p), 0.5, np.float32), where=face_width != 0)
+    yaw = (ratio - 0.5) * 180
+
+    # Keep missing faces missing instead of reading them as metric 0
+    missing = np.isnan(p).any(axis=(1, 2))
+    out = np.stack([ear, mar, yaw], axis=1)
+    out[missing] = np.nan
+    return out
+
+def replay_session(landmarks, timestamps, challenges, timeout=60):
+    """Run the challenge over recorded landmarks (N, 468 or 10, 2) with
+    their capture times. Returns the finished LivenessChallenge."""
+    challenge = LivenessChallenge(challenges=challenges, timeout=timeout)
+    for (ear, mar, yaw), now in zip(metrics_batch(landmarks), timestamps):
+        metrics = (None, None, None) if np.isnan(ear) else (float(ear), float(mar), float(yaw))
+        challenge.update(metrics, now=float(now))
+        if challenge.done: break
+    return challenge
+
+
+# =========================
+# CHALLENGE STATE MACHINE
+# =========================
+class LivenessChallenge:
+    """Randomised BLINK / SMILE / TURN -> CENTER challenge, fed one frame's
+    (ear, mar, yaw) at a time. It has no camera or window of its own, so
+    the desktop loop and the HTTP/WebSocket sessions share it.
+    """
+
+    BLINK_THRESH = 0.30
+    SMILE_THRESH = 0.45
+    TURN_YAW = 12
+    CENTER_YAW = 8
+    BEST_FRAME_YAW = 10
+
+    def __init__(self, challenges=None, timeout=60, smile_hold=0.5):
+        self.challenges = list(challenges) if challenges else random.sample(CHALLENGES, len(CHALLENGES))
+        self.timeout = timeout
+        self.smile_hold = smile_hold
+
+        self.step_idx = 0
+        self.blink_closed = False
+        self.started = None
+        self.hold_until = 0.0
+        self.state = "running"      # running / passed / failed
+        self.reason = None
+
+        self.best_frame = None
+        self.best_quality_score = 0.0
+        self.final_frame = None
+
+    @property
+    def done(self):
+        return self.state != "running"
+
+    @property
+    def current(self):
+        return self.challenges[self.step_idx] if self.step_idx < len(self.challenges) else "CENTER"
+
+    def instruction(self):
+        if self.step_idx < len(self.challenges):
+            return f"Step {self.step_idx + 1}: {self.current} NOW!"
+        return "Final Step: Look at Camera"
+
+    def fail(self, reason):
+        self.state = "failed"
+        self.reason = reason
+
+    def update(self, metrics, frame=None, gray=None, now=None):
+        """Advance on one frame. Returns the challenge verified by this
+        frame ("BLINK", ..., "CENTER") or None."""
+        if self.done:
+            return None
+        now = time.time() if now is None else now
+        if self.started is None:
+            self.started = now
+
+        ear, mar, yaw = metrics
+        if ear is None:
+            return None
+
+        # Blur only matters for frames that could become the best frame
+        if frame is not None and abs(yaw) < self.BEST_FRAME_YAW and self.step_idx < len(self.challenges):
+            if gray is None:
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            blur_score = cv2.Laplacian(gray, cv2.CV_64F).var()
+            if blur_score > self.best_quality_score:
+                self.best_quality_score = blur_score
+                self.best_frame = frame.copy()
+
+        if now - self.started > self.timeout:
+            self.fail("timeout")
+            return None
+        if now < self.hold_until:
+            return None
+
+        verified = None
+        current = self.current
+        if current == "BLINK":
+            if not self.blink_closed:
+                if ear < self.BLINK_THRESH: self.blink_closed = True
+            elif ear > self.BLINK_THRESH + 0.05:
+                verified = current; self.blink_closed = False
+        elif current == "SMILE":
+            if mar > self.SMILE_THRESH:
+                verified = current
+                self.hold_until = now + self.smile_hold  # let the smile drop before the next step
+        elif current == "TURN":
+            if abs(yaw) > self.TURN_YAW:
+                verified = current
+        elif abs(yaw) < self.CENTER_YAW:
+            verified = current
+            self.state = "passed"
+            self.final_frame = frame
+
+        if verified is not None and verified != "CENTER":
+            self.step_idx += 1
+        return verified
+
+    def result_frame(self):
+        return self.best_frame if self.best_frame is not None else self.final_frame
+
+    def status(self):
+        return {
+            "state": self.state,
+            "reason": self.reason,
+            "challenges": self.challenges,
+            "step": self.step_idx,
+            "current": None if self.done else self.current,
+            "instruction": None if self.done else self.instruction()
+        }
+
+
+# =========================
+# SERVER-SIDE SESSIONS
+# =========================
+class LivenessSession:
+    """One remote liveness attempt: its own FaceMesh (video mode, so it
+    tracks across frames) and challenge. Frames are processed in order."""
+
+    def __init__(self, timeout=60, max_frames=600):
+        self.id = secrets.token_urlsafe(16)
+        self.detector = FaceMeshDetector()
+        self.challenge = LivenessChallenge(timeout=timeout)
+        self.max_frames = max_frames
+        self.frames = 0
+        self.faces = 0
+        self.last_seen = time.time()
+        self.result = None          # filled in by the API once passed
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def feed(self, img, now=None):
+        with self.lock:
+            if self.closed or self.challenge.done:
+                return None
+            self.frames += 1
+            metrics = self.detector.get_metrics(img)
+            if metrics[0] is not None:
+                self.faces += 1
+            verified = self.challenge.update(metrics, img, now=now)
+            if not self.challenge.done and self.frames >= self.max_frames:
+                self.challenge.fail("too many frames")
+            return verified
+
+    def status(self):
+        return {
+            "session_id": self.id,
+            **self.challenge.status(),
+            "frames": self.frames,
+            "frames_with_face": self.faces
+        }
+
+    def close(self):
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.detector.close()
+
+
+class LivenessSessions:
+    """Live sessions by id. Idle ones expire after `ttl` seconds and at
+    most `max_sessions` exist at once (each holds a FaceMesh graph)."""
+
+    def __init__(self, max_sessions=256, ttl=120, **session_kwargs):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.session_kwargs = session_kwargs
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+
+    def _purge(self, now):
+        stale = [sid for sid, s in self._sessions.items() if now - s.last_seen > self.ttl]
+        expired = [self._sessions.pop(sid) for sid in stale]
+        self.expired += len(expired)
+        return expired
+
+    def create(self):
+        """New session, or None when the limit is reached."""
+        with self._lock:
+            expired = self._purge(time.time())
+            full = len(self._sessions) >= self.max_sessions
+        for session in expired:
+            session.close()
+        if full:
+            return None
+
+        session = LivenessSession(**self.session_kwargs)
+        with self._lock:
+            self._sessions[session.id] = session
+            self.created += 1
+        return session
+
+    def get(self, session_id):
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or now - session.last_seen > self.ttl:
+                return None
+            session.last_seen = now
+            return session
+
+    def drop(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+        return session
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "created": self.created,
+                "expired": self.expired
+            }
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
@@ -1,51 +1,210 @@
+import argparse
+import glob
+import json
 import os
-from tkinter import Tk, filedialog
-from rembg import remove
-from PIL import Image
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from rembg import new_session, remove
+from PIL import Image
+
+# ---------------- CONFIG ----------------
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+REMBG_MODEL = "u2net"
+CHUNK_SIZE = 8          # images per task sent to a worker
+
+# Output formats: extension + PIL save options (all lossless)
+FORMATS = {
+    "png": (".png", {}),
+    "webp": (".webp", {"lossless": True, "quality": 80, "method": 4})
+}
 
 # ---------------- USER IMAGE INPUT ----------------
 def select_image():
+    # Imported here so batch mode also runs on machines without Tk
+    from tkinter import Tk, filedialog
     Tk().withdraw()
     return filedialog.askopenfilename(
         title="Select an image",
         filetypes=[("Image Files", "*.jpg *.jpeg *.png")]
     )
 
-image_path = select_image()
+def find_images(inputs):
+    """Image paths from folders (searched recursively), glob patterns and
+    plain files, each with its path relative to the common input root."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths += [os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTS)]
+        else:
+            paths += [p for p in glob.glob(item, recursive=True)
+                      if os.path.isfile(p) and p.lower().endswith(IMAGE_EXTS)]
+
+    paths = sorted(set(os.path.abspath(p) for p in paths))
+    if not paths:
+        return []
+    base = os.path.commonpath([os.path.dirname(p) for p in paths])
+    return [(p, os.path.relpath(p, base)) for p in paths]
+
+def new_run_folder(root="output"):
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    run_folder = os.path.join(root, f"run_{timestamp}")
+    os.makedirs(run_folder, exist_ok=True)
+    return run_folder
+
+def output_path(run_folder, stage, rel, ext):
+    # Single image: <run>/<stage>.png; batch: <run>/<stage>/<rel path>.<ext>,
+    # so the final stage keeps the enroll/<person>/ layout of the input
+    if rel is None:
+        return os.path.join(run_folder, stage + ext)
+    path = os.path.join(run_folder, stage, os.path.splitext(rel)[0] + ext)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+# ---------------- STAGE 1 FOR ONE IMAGE ----------------
+def process_image(image_path, session, run_folder, rel=None, fmt="png", skip_intermediates=False):
+    """Background removal + white background for one image. Returns
+    per-step milliseconds and the bytes written."""
+    ext, save_opts = FORMATS[fmt]
+    timings, written = {}, 0
+
+    def save(image, stage):
+        nonlocal written
+        path = output_path(run_folder, stage, rel, ext)
+        image.save(path, **save_opts)
+        written += os.path.getsize(path)
+
+    # ---------------- LOAD IMAGE ----------------
+    started = time.perf_counter()
+    input_image = Image.open(image_path).convert("RGBA")
+    timings["load"] = 1000 * (time.perf_counter() - started)
+
+    # ---------------- BACKGROUND REMOVAL ----------------
+    started = time.perf_counter()
+    removed_bg = remove(input_image, session=session)
+    timings["remove"] = 1000 * (time.perf_counter() - started)
+
+    # ---------------- PLACE ON WHITE BACKGROUND ----------------
+    started = time.perf_counter()
+    white_bg = Image.new("RGBA", removed_bg.size, (255, 255, 255, 255))
+    final_image = Image.alpha_composite(white_bg, removed_bg).convert("RGB")
+
+    if not skip_intermediates:
+        save(input_image.convert("RGB"), "original")
+        save(removed_bg, "bg_removed")
+    save(final_image, "bg_removed_white")
+    timings["save"] = 1000 * (time.perf_counter() - started)
+    return timings, written
+
+# ---------------- BATCH WORKERS ----------------
+_session = None
+
+def _init_worker(model, threads):
+    # One rembg session per worker process, reused for every image it gets
+    global _session
+    if threads:
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+    _session = new_session(model)
+
+def _process_chunk(chunk, run_folder, fmt, skip_intermediates):
+    results = []
+    for path, rel in chunk:
+        try:
+            timings, written = process_image(path, _session, run_folder, rel, fmt, skip_intermediates)
+            results.append((rel, timings, written, None))
+        except Exception as e:
+            results.append((rel, None, 0, str(e)))
+    return results
+
+def run_batch(inputs, out_root="output", fmt="png", skip_intermediates=False,
+              workers=None, model=REMBG_MODEL):
+    items = find_images(inputs)
+    if not items:
+        print(f"❌ No images found in {' '.join(inputs)}")
+        return None
+
+    workers = workers or max(1, min(len(items), (os.cpu_count() or 1) // 2))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    run_folder = new_run_folder(out_root)
+    print(f"[INFO] Removing backgrounds from {len(items)} images with {workers} workers "
+          f"x {threads} threads -> {run_folder}")
+
+    chunks = [items[i:i + CHUNK_SIZE] for i in range(0, len(items), CHUNK_SIZE)]
+    done, failed, written = 0, [], 0
+    totals = {"load": 0.0, "remove": 0.0, "save": 0.0}
+    started = time.time()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(model, threads)) as pool:
+        futures = [pool.submit(_process_chunk, chunk, run_folder, fmt, skip_intermediates)
+                   for chunk in chunks]
+        for future in futures:
+            for rel, timings, size, error in future.result():
+                if error is not None:
+                    failed.append({"file": rel, "error": error})
+                    print(f"❌ Skipped {rel} | {error}")
+                    continue
+                done += 1
+                written += size
+                for step, ms in timings.items():
+                    totals[step] += ms
+            print(f"[INFO] {done + len(failed)}/{len(items)} images")
 
-if not image_path:
-    print(" No image selected. Exiting.")
-    exit()
+    elapsed = time.time() - started
+    summary = {
+        "images": len(items),
+        "processed": done,
+        "failed": failed,
+        "workers": workers,
+        "threads_per_worker": threads,
+        "format": fmt,
+        "skip_intermediates": skip_intermediates,
+        "elapsed_s": elapsed,
+        "images_per_s": done / max(elapsed, 1e-9),
+        "ms_per_image": {step: ms / max(done, 1) for step, ms in totals.items()},
+        "output_mb": written / 1e6
+    }
+    with open(os.path.join(run_folder, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
 
-print(f"Image selected: {image_path}")
+    per_image = " | ".join(f"{step} {ms:.0f} ms" for step, ms in summary["ms_per_image"].items())
+    print(f"Processed {done}/{len(items)} images in {elapsed:.1f}s "
+          f"| {summary['images_per_s']:.2f} img/s | {per_image} | {summary['output_mb']:.1f} MB written")
+    print("Output folder:", run_folder)
+    return summary
 
-# ---------------- CREATE UNIQUE OUTPUT FOLDER ----------------
-timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-run_folder = os.path.join("output", f"run_{timestamp}")
-os.makedirs(run_folder, exist_ok=True)
+# ---------------- SINGLE IMAGE (FILE DIALOG) ----------------
+def run_single():
+    image_path = select_image()
 
-# ---------------- LOAD IMAGE ----------------
-input_image = Image.open(image_path).convert("RGBA")
+    if not image_path:
+        print(" No image selected. Exiting.")
+        return
 
-# Save original
-original_path = os.path.join(run_folder, "original.png")
-input_image.convert("RGB").save(original_path)
+    print(f"Image selected: {image_path}")
 
-# ---------------- BACKGROUND REMOVAL ----------------
-removed_bg = remove(input_image)
+    run_folder = new_run_folder()
+    process_image(image_path, new_session(REMBG_MODEL), run_folder)
 
-bg_removed_path = os.path.join(run_folder, "bg_removed.png")
-removed_bg.save(bg_removed_path)
+    # ---------------- FINAL STATUS ----------------
+    print("All outputs saved successfully")
+    print("Output folder:", run_folder)
+    print("STAGE 1 COMPLETED SUCCESSFULLY")
 
-# ---------------- PLACE ON WHITE BACKGROUND ----------------
-white_bg = Image.new("RGBA", removed_bg.size, (255, 255, 255, 255))
-final_image = Image.alpha_composite(white_bg, removed_bg).convert("RGB")
 
-final_path = os.path.join(run_folder, "bg_removed_white.png")
-final_image.save(final_path)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stage 1: remove image backgrounds. With no inputs, pick one image in a file dialog.")
+    parser.add_argument("inputs", nargs="*", help="Folders (searched recursively), glob patterns or image files")
+    parser.add_argument("--out", default="output", help="Root folder for the run_<timestamp> output")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="png", help="Output format (lossless)")
+    parser.add_argument("--skip-intermediates", action="store_true",
+                        help="Write only the white-background result, not original / bg_removed")
+    parser.add_argument("--workers", type=int, help="Worker processes, one rembg session each (default: half the cores)")
+    parser.add_argument("--model", default=REMBG_MODEL, help="rembg model name")
+    args = parser.parse_args()
 
-# ---------------- FINAL STATUS ----------------
-print("All outputs saved successfully")
-print("Output folder:", run_folder)
-print("STAGE 1 COMPLETED SUCCESSFULLY")
+    if args.inputs:
+        run_batch(args.inputs, args.out, args.format, args.skip_intermediates, args.workers, args.model)
+    else:
+        run_single()
@@ -0,0 +1,412 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import preprocess
+import quality
+from bulk_enroll import find_images
+
+# =========================
+# CONFIG
+# =========================
+VECTOR_DIM = 512
+DET_SIZE = (640, 640)
+
+# Threads per stage; every stage hands items on through a bounded queue,
+# so a slow stage stalls the ones before it instead of piling up frames
+DEFAULT_WORKERS = {"decode": 2, "rembg": 1, "detect": 2, "quality": 1, "embed": 1}
+QUEUE_SIZE = 16
+EMBED_BATCH = 16
+INDEX_FLUSH = 256     # vectors per append to the store
+
+# Quality gate on quality.face_quality of the face ROI. Blur is the raw
+# Laplacian variance (the capped "quality" score is near 0 for any photo);
+# face_size 0.5 = a 56 px face
+MIN_BLUR = 1e-4
+MIN_EXPOSURE = 0.2
+MIN_FACE_SIZE = 0.5
+MIN_DET_SCORE = 0.6
+
+_DONE = object()
+
+
+# =========================
+# ITEM FLOWING THROUGH THE STAGES
+# =========================
+class Item:
+    """One input image and everything the stages learn about it. Large
+    buffers are dropped as soon as no later stage needs them."""
+
+    def __init__(self, key, user_id, load):
+        self.key = key
+        self.user_id = user_id
+        self.load = load
+        self.data = None
+        self.img = None
+        self.factor = 1
+        self.bbox = None
+        self.kps = None
+        self.det_score = None
+        self.crop = None
+        self.quality = None
+        self.embedding = None
+        self.vector_id = None
+        self.error = None
+
+    def report(self):
+        row = {"user_id": self.user_id, "file": self.key}
+        if self.error:
+            row.update(status="error", error=self.error)
+        else:
+            row.update(status="enrolled" if self.vector_id is not None else "embedded",
+                       vector_id=self.vector_id, det_score=float(self.det_score), **self.quality)
+        return row
+
+
+# =========================
+# GENERATOR PLUMBING
+# =========================
+class StageStats:
+    def __init__(self):
+        self.busy = {}
+        self.items = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, n=1):
+        with self._lock:
+            self.busy[stage] = self.busy.get(stage, 0.0) + seconds
+            self.items[stage] = self.items.get(stage, 0) + n
+
+    def summary(self):
+        with self._lock:
+            return {stage: {"items": self.items[stage],
+                            "ms_per_item": 1000 * self.busy[stage] / max(self.items[stage], 1)}
+                    for stage in self.busy}
+
+def parallel_map(fn, items, workers=1, maxsize=QUEUE_SIZE, name=None, stats=None):
+    """Generator: fn(item) for every item of the upstream generator, on
+    `workers` threads. Output order follows completion. Both queues are
+    bounded, so at most ~2 * maxsize items are in flight per stage."""
+    def timed(item):
+        started = time.perf_counter()
+        result = fn(item)
+        if stats is not None:
+            stats.add(name or fn.__name__, time.perf_counter() - started,
+                      len(item) if isinstance(item, list) else 1)
+        return result
+
+    if workers <= 1:
+        for item in items:
+            yield timed(item)
+        return
+
+    inbox = queue.Queue(maxsize)
+    outbox = queue.Queue(maxsize)
+
+    def feed():
+        try:
+            for item in items:
+                inbox.put(item)
+        except BaseException as e:      # upstream failure ends the run
+            outbox.put(e)
+        finally:
+            for _ in range(workers):
+                inbox.put(_DONE)
+
+    def work():
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                outbox.put(_DONE)
+                return
+            try:
+                outbox.put(timed(item))
+            except BaseException as e:
+                outbox.put(e)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    threads += [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+    for t in threads:
+        t.start()
+
+    finished = 0
+    while finished < workers:
+        result = outbox.get()
+        if result is _DONE:
+            finished += 1
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            yield result
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def flatten(batches):
+    for batch in batches:
+        yield from batch
+
+def guarded(fn):
+    # Per-item failures are recorded on the item, which then skips the
+    # remaining stages but still reaches the report
+    def stage(item):
+        if item.error is None:
+            try:
+                fn(item)
+            except Exception as e:
+                item.error = str(e)
+                item.img = item.data = item.crop = None
+        return item
+    stage.__name__ = fn.__name__
+    return stage
+
+
+# =========================
+# STAGES
+# =========================
+class EnrollmentPipeline:
+    """decode -> optional rembg -> detect/align -> quality gate -> embed
+    -> index, as a chain of generators over in-memory frames.
+
+    Nothing is written between stages. `run()` yields finished items;
+    `sink(vectors, items)` (e.g. store_sink) receives embeddings in
+    chunks of INDEX_FLUSH and returns the first vector id.
+    """
+
+    def __init__(self, engine, rembg=False, rembg_model="u2net", workers=None,
+                 queue_size=QUEUE_SIZE, embed_batch=EMBED_BATCH, debug_dir=None,
+                 min_blur=MIN_BLUR, min_exposure=MIN_EXPOSURE, min_face_size=MIN_FACE_SIZE,
+                 min_det_score=MIN_DET_SCORE):
+        self.engine = engine
+        self.workers = {**DEFAULT_WORKERS, **(workers or {})}
+        self.queue_size = queue_size
+        self.embed_batch = embed_batch
+        self.debug_dir = debug_dir
+        self.min_blur = min_blur
+        self.min_exposure = min_exposure
+        self.min_face_size = min_face_size
+        self.min_det_score = min_det_score
+        self.stats = StageStats()
+
+        self.rembg_session = None
+        if rembg:
+            # Optional dependency, only needed with background removal;
+            # one ONNX session shared by the rembg threads
+            from rembg import new_session
+            self.rembg_session = new_session(rembg_model)
+
+    # ---------- stages ----------
+    def decode(self, item):
+        # Reduced-size JPEG decode; detect() goes back to item.data if needed
+        item.data = item.load()
+        item.img, item.factor = preprocess.decode(item.data)
+
+    def remove_background(self, img):
+        # Same result as main.py: rembg cut-out composited on white
+        from rembg import remove
+        rgba = remove(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), session=self.rembg_session)
+        alpha = rgba[:, :, 3:4].astype(np.float32) / 255.0
+        white = rgba[:, :, :3] * alpha + 255.0 * (1.0 - alpha)
+        return cv2.cvtColor(white.astype(np.uint8), cv2.COLOR_RGB2BGR)
+
+    def rembg(self, item):
+        item.img = self.remove_background(item.img)
+
+    def detect(self, item):
+        # Largest face, with its aligned crop, from one detector pass
+        face = self.engine.detect_face(item.img)
+        if face is not None and preprocess.needs_full_decode(item.factor, face.bbox):
+            item.img = preprocess.decode(item.data, target_side=None)[0]
+            item.factor = 1
+            if self.rembg_session is not None:
+                item.img = self.remove_background(item.img)
+            face = self.engine.detect_face(item.img)
+        item.data = None
+        if face is None:
+            raise ValueError("No face detected")
+        item.bbox, item.kps, item.det_score, item.crop = face.bbox, face.kps, face.det_score, face.crop
+
+    def quality_gate(self, item):
+        item.quality = quality.face_quality(item.img, item.bbox)
+        if self.debug_dir:
+            self.write_debug(item)
+        item.img = None
+
+        if item.det_score < self.min_det_score:
+            raise ValueError(f"Low detector score {item.det_score:.2f}")
+        if item.quality["face_size"] < self.min_face_size:
+            raise ValueError(f"Face too small ({item.quality['face_size']:.2f})")
+        if item.quality["blur"] < self.min_blur:
+            raise ValueError(f"Too blurry ({item.quality['blur']:.2e})")
+        if item.quality["exposure"] < self.min_exposure:
+            raise ValueError(f"Bad exposure ({item.quality['exposure']:.2f})")
+
+    def embed(self, batch):
+        ok = [item for item in batch if item.error is None]
+        if not ok:
+            return batch
+        try:
+            feats = self.engine.embed([item.crop for item in ok])  # one call per batch
+        except Exception as e:
+            feats = [None] * len(ok)
+            for item in ok:
+                item.error = str(e)
+        for item, feat in zip(ok, feats):
+            item.embedding = feat
+            item.crop = None
+        return batch
+
+    def write_debug(self, item):
+        stem = os.path.join(self.debug_dir, os.path.splitext(item.key.replace(os.sep, "__").replace("/", "__"))[0])
+        os.makedirs(self.debug_dir, exist_ok=True)
+        cv2.imwrite(stem + "_aligned.png", item.crop)
+        if self.rembg_session is not None:
+            cv2.imwrite(stem + "_rembg.png", item.img)
+
+    # ---------- chain ----------
+    def run(self, items, sink=None, flush_every=INDEX_FLUSH):
+        def stage(fn, upstream, name):
+            return parallel_map(guarded(fn), upstream, self.workers.get(name, 1),
+                                self.queue_size, name, self.stats)
+
+        chain = stage(self.decode, items, "decode")
+        if self.rembg_session is not None:
+            chain = stage(self.rembg, chain, "rembg")
+        chain = stage(self.detect, chain, "detect")
+        chain = stage(self.quality_gate, chain, "quality")
+        chain = flatten(parallel_map(self.embed, batched(chain, self.embed_batch),
+                                     self.workers["embed"], self.queue_size, "embed", self.stats))
+        yield from self.index(chain, sink, flush_every)
+
+    def index(self, items, sink, flush_every):
+        pending = []
+
+        def flush():
+            started = time.perf_counter()
+            start_id = sink(np.vstack([i.embedding for i in pending]), pending)
+            for offset, item in enumerate(pending):
+                item.vector_id = start_id + offset
+            self.stats.add("index", time.perf_counter() - started, len(pending))
+            done = list(pending)
+            pending.clear()
+            return done
+
+        for item in items:
+            if sink is None or item.error is not None:
+                yield item
+                continue
+            pending.append(item)
+            if len(pending) >= flush_every:
+                yield from flush()
+        if pending:
+            yield from flush()
+
+
+def store_sink(store):
+    """Sink appending to a SharedFaceIndex (the API store or a shard)."""
+    def sink(vectors, items):
+        return store.append(vectors, [item.user_id for item in items])
+    return sink
+
+
+# =========================
+# MAIN
+# =========================
+def run(source, out_dir, store_path=None, project=None, shard_root="shards",
+        rembg=False, workers=None, debug=False):
+    from face_engine import FaceEngine
+
+    items = [Item(key, user_id, load) for user_id, key, load in find_images(source)]
+    if not items:
+        print(f"❌ No images found in {source}")
+        return None
+    os.makedirs(out_dir, exist_ok=True)
+
+    print("[INFO] Loading models...")
+    engine = FaceEngine(name="buffalo_l", det_size=DET_SIZE)
+    pipe = EnrollmentPipeline(engine, rembg=rembg, workers=workers,
+                              debug_dir=os.path.join(out_dir, "debug") if debug else None)
+
+    store = sink = None
+    if project:
+        store_path = os.path.join(shard_root, project, "face")
+        os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    if store_path:
+        from shared_index import SharedFaceIndex
+        store = SharedFaceIndex(store_path, VECTOR_DIM)
+        sink = store_sink(store)
+
+    print(f"[INFO] Enrolling {len(items)} images | workers {pipe.workers}")
+    started = time.time()
+    vectors, report = [], []
+    try:
+        for item in pipe.run(iter(items), sink=sink):
+            report.append(item.report())
+            if item.error:
+                print(f"❌ Skipped {item.key} | {item.error}")
+            else:
+                vectors.append((item.key, item.user_id, item.embedding))
+    finally:
+        if store is not None:
+            store.close()
+    elapsed = time.time() - started
+
+    # The only outputs: embeddings + labels, a per-image report, timings
+    if vectors:
+        np.save(os.path.join(out_dir, "embeddings.npy"), np.vstack([v for _, _, v in vectors]))
+    with open(os.path.join(out_dir, "labels.json"), "w") as f:
+        json.dump([{"file": key, "user_id": uid} for key, uid, _ in vectors], f, indent=2)
+    summary = {
+        "images": len(items),
+        "embedded": len(vectors),
+        "elapsed_s": elapsed,
+        "images_per_s": len(items) / max(elapsed, 1e-9),
+        "workers": pipe.workers,
+        "stages": pipe.stats.summary(),
+        "report": report
+    }
+    with open(os.path.join(out_dir, "pipeline_report.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+
+    stages = " | ".join(f"{name} {s['ms_per_item']:.1f} ms" for name, s in summary["stages"].items())
+    print(f"Embedded {len(vectors)}/{len(items)} images in {elapsed:.1f}s "
+          f"| {summary['images_per_s']:.1f} img/s | {stages}")
+    print("Output folder:", out_dir)
+    return summary
+
+
+def parse_worker_spec(spec):
+    """argparse type for --workers: "<stage>=<n>" -> (stage, n)."""
+    stage, _, n = spec.partition("=")
+    if stage not in DEFAULT_WORKERS or not n.isdigit():
+        raise argparse.ArgumentTypeError(f"Expected <stage>=<n> with stage in {sorted(DEFAULT_WORKERS)}: {spec}")
+    return stage, int(n)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode, clean, align, check and embed enrollment photos in one in-memory pass")
+    parser.add_argument("source", help="Folder of <person>/ sub-folders, or a zip with the same layout")
+    parser.add_argument("--out", default="pipeline_out", help="Embeddings, labels and report go here")
+    parser.add_argument("--store", help="Also append to this shared store (e.g. prod_face_db)")
+    parser.add_argument("--project", help="Append to shards/<project>/ instead")
+    parser.add_argument("--rembg", action="store_true", help="Remove backgrounds (as main.py) before detection")
+    parser.add_argument("--workers", action="append", type=parse_worker_spec, metavar="STAGE=N",
+                        help=f"Threads per stage, repeatable (defaults {DEFAULT_WORKERS})")
+    parser.add_argument("--debug", action="store_true", help="Write aligned crops (and rembg output) to <out>/debug")
+    args = parser.parse_args()
+
+    run(args.source, args.out, args.store, args.project, rembg=args.rembg,
+        workers=dict(args.workers or []), debug=args.debug)
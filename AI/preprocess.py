@@ -0,0 +1,120 @@
+import struct
+
+import cv2
+import numpy as np
+
+
+# =========================
+# CONFIG
+# =========================
+# Uploads are decoded at the smallest JPEG scale (1/2, 1/4, 1/8) whose long
+# side is still at least this; the detector never looks at more than 640
+DECODE_TARGET_SIDE = 960
+
+# First detector pass assumes one big face (a selfie): face width as a
+# fraction of the shorter image side, and the face size in detector pixels
+# SCRFD still finds reliably
+EXPECTED_FACE_FRAC = 0.2
+MIN_DET_FACE_PX = 48
+
+# Detector input bounds; sides are multiples of the largest SCRFD stride
+DET_MIN_SIDE = 160
+DET_MAX_SIDE = 640
+DET_STRIDE = 32
+
+# Below this many pixels in the decoded image the face is re-decoded at
+# full resolution before the 112x112 crop is cut
+MIN_CROP_FACE_PX = 112
+
+_REDUCED = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+            4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# JPEG start-of-frame markers (all except DHT / JPG / DAC)
+_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+# =========================
+# HEADER PARSING
+# =========================
+def image_size(data):
+    """(width, height) from a JPEG or PNG header without decoding, or None."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:              # fill byte
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            i += 2                      # standalone markers have no length
+            continue
+        if marker in (0xD9, 0xDA):      # end of image / start of scan
+            return None
+        length = struct.unpack(">H", data[i + 2:i + 4])[0]
+        if marker in _SOF and i + 9 <= len(data):
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        i += 2 + length
+    return None
+
+
+# =========================
+# DECODE
+# =========================
+def reduction_for(size, target_side=DECODE_TARGET_SIDE):
+    if size is None:
+        return 1
+    long_side = max(size)
+    for factor in (8, 4, 2):
+        if long_side // factor >= target_side:
+            return factor
+    return 1
+
+def decode(data, target_side=DECODE_TARGET_SIDE):
+    """Upload bytes -> (BGR image, factor). JPEGs are scaled down inside
+    libjpeg (IMREAD_REDUCED_*), so a 12 MP selfie never exists at full
+    size in memory. `factor` is original pixels per decoded pixel;
+    target_side=None decodes at full size."""
+    factor = reduction_for(image_size(data), target_side) if target_side else 1
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), _REDUCED[factor])
+    if img is None:
+        raise ValueError("Image not readable")
+    return img, factor
+
+def face_side(bbox):
+    return min(bbox[2] - bbox[0], bbox[3] - bbox[1])
+
+def needs_full_decode(factor, bbox):
+    # Face too small for a sharp 112x112 crop at the reduced scale
+    return factor > 1 and face_side(bbox) < MIN_CROP_FACE_PX
+
+
+# =========================
+# ADAPTIVE DETECTOR INPUT
+# =========================
+def _round_up(v):
+    return int(-(-v // DET_STRIDE) * DET_STRIDE)
+
+def det_input_size(shape, face_frac=EXPECTED_FACE_FRAC):
+    """Smallest (w, h) detector input, matching the image aspect, at which a
+    face of `face_frac` of the shorter side still spans MIN_DET_FACE_PX."""
+    h, w = shape[:2]
+    scale = MIN_DET_FACE_PX / (face_frac * min(h, w))
+    scale = min(scale, DET_MAX_SIDE / max(h, w), 1.0)
+    scale = max(scale, DET_MIN_SIDE / max(h, w))
+    return (min(_round_up(w * scale), DET_MAX_SIDE), min(_round_up(h * scale), DET_MAX_SIDE))
+
+def detect(det_model, img, full_size, face_frac=EXPECTED_FACE_FRAC, max_num=0):
+    """Detect at the small input size first and retry at `full_size` only
+    when nothing is found. Returns (bboxes, kpss)."""
+    first = det_input_size(img.shape, face_frac)
+    bboxes, kpss = det_model.detect(img, input_size=first, max_num=max_num, metric="default")
+    if len(bboxes) == 0 and first[0] * first[1] < full_size[0] * full_size[1]:
+        bboxes, kpss = det_model.detect(img, input_size=tuple(full_size), max_num=max_num, metric="default")
+    return bboxes, kpss
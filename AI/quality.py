@@ -0,0 +1,89 @@
+import cv2
+import numpy as np
+
+
+# =========================
+# CONFIG
+# =========================
+# Blur is the variance of the 4-neighbour Laplacian on a [0, 1] gray
+# image, the same number skimage.filters.laplace gave, so existing
+# confidence weights and thresholds keep their meaning
+BLUR_NORM = 500
+
+# Context kept around the detector bbox (fraction of its size)
+ROI_MARGIN = 0.1
+
+# The ROI is scored at this fixed size, so the same face gets the same blur
+# score whether the upload was decoded at full or reduced resolution
+SCORE_SIDE = 112
+
+# Face size score reaches 1.0 at this many pixels (ArcFace crop size)
+FULL_FACE_PX = 112
+
+# Pixels this dark / bright count as clipped for exposure
+DARK_LEVEL = 16
+BRIGHT_LEVEL = 240
+
+
+# =========================
+# FACE ROI
+# =========================
+def face_roi(img, bbox=None, margin=ROI_MARGIN):
+    """Crop of `img` around the detector bbox (x1, y1, x2, y2); the whole
+    image when no bbox is given. No copy is made."""
+    if bbox is None:
+        return img
+    h, w = img.shape[:2]
+    x1, y1, x2, y2 = [float(v) for v in bbox[:4]]
+    mx, my = (x2 - x1) * margin, (y2 - y1) * margin
+    x1, y1 = max(0, int(x1 - mx)), max(0, int(y1 - my))
+    x2, y2 = min(w, int(x2 + mx)), min(h, int(y2 + my))
+    if x2 <= x1 or y2 <= y1:
+        return img
+    return img[y1:y2, x1:x2]
+
+def to_gray(img):
+    return img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+def roi_gray(img, bbox=None, side=SCORE_SIDE):
+    """Gray face ROI resampled to side x side."""
+    return cv2.resize(to_gray(face_roi(img, bbox)), (side, side), interpolation=cv2.INTER_AREA)
+
+
+# =========================
+# SCORES
+# =========================
+def blur_score(gray):
+    # Laplacian on uint8 straight into float32, rescaled to the [0, 1] range
+    lap = cv2.Laplacian(gray, cv2.CV_32F, ksize=1, borderType=cv2.BORDER_REFLECT)
+    return float(lap.var()) / (255.0 ** 2)
+
+def exposure_score(gray):
+    # 1.0 for mid-grey faces with nothing clipped, 0.0 for black/white frames
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    total = max(hist.sum(), 1.0)
+    mean = float(np.dot(hist, np.arange(256))) / total / 255.0
+    clipped = (hist[:DARK_LEVEL].sum() + hist[BRIGHT_LEVEL:].sum()) / total
+    return float(max(0.0, 1.0 - 2 * abs(mean - 0.5)) * (1.0 - clipped))
+
+def face_size_score(bbox):
+    if bbox is None:
+        return 1.0
+    side = min(bbox[2] - bbox[0], bbox[3] - bbox[1])
+    return float(min(max(side, 0) / FULL_FACE_PX, 1.0))
+
+def image_quality(img, bbox=None):
+    """Blur score of the face ROI, capped to [0, 1]. Drop-in for the old
+    full-image skimage score."""
+    return min(blur_score(roi_gray(img, bbox)) / BLUR_NORM, 1.0)
+
+def face_quality(img, bbox=None):
+    """All quality scores from one gray conversion of the face ROI."""
+    gray = roi_gray(img, bbox)
+    blur = blur_score(gray)
+    return {
+        "quality": min(blur / BLUR_NORM, 1.0),
+        "blur": blur,
+        "exposure": exposure_score(gray),
+        "face_size": face_size_score(bbox)
+    }
@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import onnxruntime as ort
+from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod,
+                                      QuantFormat, QuantType, quantize_static)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+from bulk_enroll import find_images
+from face_engine import FaceEngine, QUANT_DIR, int8_marker_path, sha256_of
+
+# =========================
+# CONFIG
+# =========================
+# Decision threshold the checks are run at (face_auth_api.THRESHOLD)
+THRESHOLD = 0.70
+
+# Calibration: aligned crops fed to the MinMax calibrator, per batch
+CALIB_MAX = 200
+CALIB_BATCH = 16
+
+# Minimum evaluation set before a model may be activated
+MIN_PEOPLE = 2
+MIN_EVAL_FACES = 20
+
+# Guardrails, INT8 vs the FP32 model on the same crops
+MIN_MEAN_COSINE = 0.98       # FP32 vs INT8 embedding of one crop, on average
+MIN_COSINE = 0.95            # ... and for the worst crop
+MAX_FAR_INCREASE = 0.001     # absolute, at THRESHOLD
+MAX_FRR_INCREASE = 0.01
+MAX_SCORE_SHIFT = 0.02       # mean genuine / impostor similarity
+
+# =========================
+# CROPS FROM ENROLLED FACES
+# =========================
+def collect_crops(engine, source):
+    """Aligned 112x112 crops + person labels from enroll/<person>/ folders
+    (or a zip with that layout), the same input bulk_enroll.py takes."""
+    crops, labels = [], []
+    for person, name, load in find_images(source):
+        try:
+            _, face = engine.detect_encoded(load())
+            if face is None:
+                raise ValueError("No face detected")
+        except Exception as e:
+            print(f"❌ Skipped {name} | {e}")
+            continue
+        crops.append(face.crop)
+        labels.append(person)
+    return crops, np.array(labels)
+
+def to_blob(crops, mean, std):
+    # Same preprocessing as insightface's ArcFaceONNX.get_feat
+    return cv2.dnn.blobFromImages(crops, 1.0 / std, (112, 112), (mean, mean, mean), swapRB=True)
+
+class CropReader(CalibrationDataReader):
+    def __init__(self, blob, input_name, batch=CALIB_BATCH):
+        self.blob = blob
+        self.input_name = input_name
+        self.batch = batch
+        self.pos = 0
+
+    def get_next(self):
+        if self.pos >= len(self.blob):
+            return None
+        chunk = self.blob[self.pos:self.pos + self.batch]
+        self.pos += self.batch
+        return {self.input_name: chunk}
+
+    def rewind(self):
+        self.pos = 0
+
+# =========================
+# QUANTISE
+# =========================
+def quantize(model_file, out_path, calib_blob):
+    session = ort.InferenceSession(model_file, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prepared = os.path.join(tmp, "prepared.onnx")
+        # ONNX shape inference + graph cleanup (static CNN, no symbolic shapes needed)
+        quant_pre_process(model_file, prepared, skip_symbolic_shape=True)
+        quantize_static(
+            prepared, out_path, CropReader(calib_blob, input_name),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method=CalibrationMethod.MinMax
+        )
+
+def embed(model_file, blob, batch=CALIB_BATCH):
+    session = ort.InferenceSession(model_file, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+
+    started = time.perf_counter()
+    feats = np.vstack([session.run(None, {input_name: blob[i:i + batch]})[0]
+                       for i in range(0, len(blob), batch)])
+    ms_per_face = 1000 * (time.perf_counter() - started) / max(len(blob), 1)
+    return feats / np.linalg.norm(feats, axis=1, keepdims=True), ms_per_face
+
+# =========================
+# ACCURACY CHECK
+# =========================
+def pair_scores(probe, gallery, labels):
+    sims = probe @ gallery.T
+    same = labels[:, None] == labels[None, :]
+    np.fill_diagonal(same, False)
+    other = labels[:, None] != labels[None, :]
+    return sims[same], sims[other]
+
+def far_frr(genuine, impostor, threshold):
+    return {
+        "far": float(np.mean(impostor >= threshold)) if len(impostor) else 0.0,
+        "frr": float(np.mean(genuine < threshold)) if len(genuine) else 0.0,
+        "genuine_mean": float(genuine.mean()) if len(genuine) else None,
+        "impostor_mean": float(impostor.mean()) if len(impostor) else None,
+        "genuine_p5": float(np.percentile(genuine, 5)) if len(genuine) else None,
+        "impostor_p99": float(np.percentile(impostor, 99)) if len(impostor) else None
+    }
+
+def compare(fp32, int8, labels, threshold=THRESHOLD):
+    """FP32 baseline vs INT8, both with INT8 probes against the FP32 gallery
+    already in the DB and with everything re-enrolled in INT8."""
+    cosine = np.sum(fp32 * int8, axis=1)
+    report = {
+        "faces": len(labels),
+        "people": len(set(labels.tolist())),
+        "threshold": threshold,
+        "embedding_cosine": {"mean": float(cosine.mean()), "min": float(cosine.min())},
+        "fp32": far_frr(*pair_scores(fp32, fp32, labels), threshold),
+        "int8_vs_fp32_gallery": far_frr(*pair_scores(int8, fp32, labels), threshold),
+        "int8": far_frr(*pair_scores(int8, int8, labels), threshold)
+    }
+
+    base = report["fp32"]
+    checks = {
+        "enough_data": report["people"] >= MIN_PEOPLE and report["faces"] >= MIN_EVAL_FACES,
+        "mean_cosine": report["embedding_cosine"]["mean"] >= MIN_MEAN_COSINE,
+        "min_cosine": report["embedding_cosine"]["min"] >= MIN_COSINE
+    }
+    for mode in ("int8_vs_fp32_gallery", "int8"):
+        cand = report[mode]
+        checks[f"{mode}_far"] = cand["far"] - base["far"] <= MAX_FAR_INCREASE
+        checks[f"{mode}_frr"] = cand["frr"] - base["frr"] <= MAX_FRR_INCREASE
+        checks[f"{mode}_score_shift"] = all(
+            base[key] is None or abs(cand[key] - base[key]) <= MAX_SCORE_SHIFT
+            for key in ("genuine_mean", "impostor_mean"))
+    report["checks"] = checks
+    report["passed"] = all(checks.values())
+    return report
+
+# =========================
+# ACTIVATION MARKER
+# =========================
+def write_marker(pack, marker):
+    path = int8_marker_path(pack)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(marker, f, indent=2)
+    os.replace(tmp, path)
+    return path
+
+def set_active(pack, active):
+    path = int8_marker_path(pack)
+    if not os.path.exists(path):
+        print(f"❌ No INT8 model for {pack} ({path})")
+        return
+    with open(path) as f:
+        marker = json.load(f)
+    marker["active"] = active
+    write_marker(pack, marker)
+    print(f"INT8 recognition for {pack}: {'active' if active else 'inactive'}")
+
+# =========================
+# MAIN
+# =========================
+def run(source, pack="buffalo_l", threshold=THRESHOLD, calib_max=CALIB_MAX, force=False, seed=0):
+    engine = FaceEngine(name=pack, int8=False)
+    rec = engine.rec_model
+    model_file = engine.model_files["recognition"]  # the pack's graph, not the ORT cache copy
+    os.makedirs(QUANT_DIR, exist_ok=True)
+    out_path = os.path.join(QUANT_DIR, f"{pack}_{os.path.splitext(os.path.basename(model_file))[0]}_int8.onnx")
+
+    print(f"[INFO] Collecting enrolled faces from {source}...")
+    crops, labels = collect_crops(engine, source)
+    if len(crops) < 2:
+        print("❌ Not enough usable faces found")
+        return None
+    blob = to_blob(crops, rec.input_mean, rec.input_std)
+
+    # Calibration uses a sample of the enrolled faces (at most half); the
+    # checks run only on the rest, which the quantiser has never seen
+    n_calib = min(calib_max, len(blob) // 2)
+    pick = sorted(random.Random(seed).sample(range(len(blob)), n_calib))
+    held_out = np.setdiff1d(np.arange(len(blob)), pick)
+    print(f"[INFO] Quantising {model_file} with {len(pick)} calibration faces...")
+    quantize(model_file, out_path, blob[pick])
+
+    print(f"[INFO] Comparing FP32 and INT8 on {len(held_out)} held-out faces...")
+    fp32, fp32_ms = embed(model_file, blob[held_out])
+    int8, int8_ms = embed(out_path, blob[held_out])
+    report = compare(fp32, int8, labels[held_out], threshold)
+    report["calibration_faces"] = len(pick)
+    report["latency_ms_per_face"] = {"fp32": fp32_ms, "int8": int8_ms}
+
+    for name, ok in report["checks"].items():
+        print(f"   {'✔' if ok else '❌'} {name}")
+    print(f"   FAR {report['fp32']['far']:.4f} -> {report['int8_vs_fp32_gallery']['far']:.4f} | "
+          f"FRR {report['fp32']['frr']:.4f} -> {report['int8_vs_fp32_gallery']['frr']:.4f} | "
+          f"{fp32_ms:.1f} -> {int8_ms:.1f} ms/face")
+
+    active = report["passed"] or force
+    marker_path = write_marker(pack, {
+        "active": active,
+        "forced": force and not report["passed"],
+        "model": out_path,
+        "source": model_file,
+        "source_sha256": sha256_of(model_file),
+        "calibration_source": source,
+        "input_mean": float(rec.input_mean),
+        "input_std": float(rec.input_std),
+        "created": time.time(),
+        "report": report
+    })
+    if active:
+        print(f"INT8 model activated ({marker_path}); restart the API to load it")
+    else:
+        print(f"❌ INT8 model failed the accuracy checks and was NOT activated ({marker_path})")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantise the ArcFace recognition model to INT8, calibrated and checked on enrolled faces")
+    parser.add_argument("source", nargs="?", help="enroll/<person>/ folders, or a zip with that layout")
+    parser.add_argument("--pack", default="buffalo_l", help="insightface model pack")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="Similarity threshold for FAR / FRR")
+    parser.add_argument("--calib", type=int, default=CALIB_MAX, help="Calibration faces")
+    parser.add_argument("--force", action="store_true", help="Activate even if the checks fail")
+    parser.add_argument("--deactivate", action="store_true", help="Switch back to the FP32 model")
+    parser.add_argument("--activate", action="store_true", help="Re-activate the last INT8 model")
+    args = parser.parse_args()
+
+    if args.deactivate or args.activate:
+        set_active(args.pack, args.activate)
+    elif args.source:
+        run(args.source, args.pack, args.threshold, args.calib, args.force)
+    else:
+        parser.error("source is required")
@@ -0,0 +1,146 @@
+import os
+
+import numpy as np
+
+
+# =========================
+# VECTOR ID -> USER / ANGLE
+# =========================
+class ReverseIndex:
+    """Contiguous vector_id -> (user, angle) table.
+
+    `owner[i]` / `angle[i]` are small integer codes into `users` /
+    `angles`, so resolving a search hit is one array read and resolving a
+    whole top-k row to distinct users is one vectorised step. Each user's
+    rows are also kept as a block so 1:1 verification never scans the table.
+    """
+
+    def __init__(self):
+        self.users = []
+        self.angles = []
+        self._user_code = {}
+        self._angle_code = {}
+        self._owner = np.full(0, -1, dtype="int32")
+        self._angle = np.full(0, -1, dtype="int32")
+        self._rows = {}
+        self.size = 0
+
+    @property
+    def owner(self):
+        return self._owner[:self.size]
+
+    def _code(self, table, codes, name):
+        if name is None:
+            return -1
+        code = codes.get(name)
+        if code is None:
+            code = codes[name] = len(table)
+            table.append(name)
+        return code
+
+    def _reserve(self, n):
+        if n <= len(self._owner):
+            return
+        cap = max(n, 2 * len(self._owner), 1024)
+        for attr in ("_owner", "_angle"):
+            old = getattr(self, attr)
+            new = np.full(cap, -1, dtype="int32")
+            new[:len(old)] = old
+            setattr(self, attr, new)
+
+    def set(self, start_id, user, angles=None, count=None):
+        """Label rows start_id.. with `user` (idempotent, positional)."""
+        count = len(angles) if angles is not None else (count or 1)
+        end = start_id + count
+        self._reserve(end)
+
+        code = self._code(self.users, self._user_code, user)
+        if code >= 0:
+            new = start_id + np.flatnonzero(self._owner[start_id:end] != code)
+            self._rows.setdefault(code, []).extend(new.tolist())
+        self._owner[start_id:end] = code
+        if angles is not None:
+            self._angle[start_id:end] = [self._code(self.angles, self._angle_code, a) for a in angles]
+        self.size = max(self.size, end)
+
+    def clear(self, user):
+        """Unlabel every row of `user` (superseded by a re-enrollment)."""
+        code = self._user_code.get(user)
+        if code is None:
+            return
+        rows = self.rows_of(user)
+        self._owner[rows] = -1
+        self._angle[rows] = -1
+        self._rows.pop(code, None)
+
+    def lookup(self, vector_id):
+        if not 0 <= vector_id < self.size or self._owner[vector_id] < 0:
+            return None, None
+        angle = self._angle[vector_id]
+        return self.users[self._owner[vector_id]], (self.angles[angle] if angle >= 0 else None)
+
+    def rows_of(self, user):
+        code = self._user_code.get(user)
+        if code is None:
+            return np.empty(0, dtype="int64")
+        rows = np.asarray(self._rows.get(code, []), dtype="int64")
+        return rows[self._owner[rows] == code]  # drop rows relabelled since
+
+    def resolve(self, scores, ids):
+        """Top-k row (scores, ids) -> [(user, score, vector_id)] with each
+        user listed once at its best score, best first."""
+        ids = np.asarray(ids).ravel()
+        scores = np.asarray(scores).ravel()
+        valid = (ids >= 0) & (ids < self.size)
+        ids, scores = ids[valid], scores[valid]
+
+        owners = self._owner[ids]
+        keep = owners >= 0
+        ids, scores, owners = ids[keep], scores[keep], owners[keep]
+
+        # Results come sorted by score, so the first hit per owner is its best
+        _, first = np.unique(owners, return_index=True)
+        first.sort()
+        return [(self.users[owners[i]], float(scores[i]), int(ids[i])) for i in first]
+
+    # ---------- persistence ----------
+    def save(self, path):
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, owner=self._owner[:self.size], angle=self._angle[:self.size],
+                 users=np.array(self.users, dtype=str), angles=np.array(self.angles, dtype=str))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        rev = cls()
+        with np.load(path, allow_pickle=False) as data:
+            rev.users = data["users"].tolist()
+            rev.angles = data["angles"].tolist()
+            rev._owner = data["owner"].astype("int32")
+            rev._angle = data["angle"].astype("int32")
+        rev._user_code = {u: i for i, u in enumerate(rev.users)}
+        rev._angle_code = {a: i for i, a in enumerate(rev.angles)}
+        rev.size = len(rev._owner)
+
+        order = np.argsort(rev._owner, kind="stable")
+        codes, starts = np.unique(rev._owner[order], return_index=True)
+        for code, block in zip(codes, np.split(order, starts[1:])):
+            if code >= 0:
+                rev._rows[int(code)] = block.tolist()
+        return rev
+
+    @classmethod
+    def from_user_map(cls, user_map):
+        """Build from any of the user_map layouts used in this repo:
+        {user: [ids]}, {user: [{"id", "angle"}]} or {id: user}."""
+        rev = cls()
+        for key, value in user_map.items():
+            if isinstance(value, list):
+                for item in value:
+                    if isinstance(item, dict):
+                        rev.set(int(item["id"]), key, angles=[item.get("angle")])
+                    else:
+                        rev.set(int(item), key)
+            else:
+                rev.set(int(key), value)
+        return rev
@@ -0,0 +1,160 @@
+import argparse
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from shared_index import SharedFaceIndex
+
+
+# Project ids come from the SaaS layer (cuid/uuid); keep them path-safe
+PROJECT_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+# =========================
+# PER-PROJECT INDEX SHARDS
+# =========================
+class ShardManager:
+    """One SharedFaceIndex per project under `root/<project_id>/`.
+
+    Shards are opened on first use and the least recently used ones are
+    dropped from RAM once more than `max_loaded` are open. Their files
+    stay on disk and are mapped again on the next request for that
+    project. Requests without a project id use `default`.
+
+    Only enrollment creates a shard: reads of a project that has none get
+    None and never touch disk or fall back to `default`, which holds
+    every tenant's faces. Faces enrolled before sharding reach a project
+    only through an explicit `migrate(project_id, users)`.
+    """
+
+    def __init__(self, root, dim, default, max_loaded=32, **store_kwargs):
+        self.root = root
+        self.dim = dim
+        self.default = default
+        self.max_loaded = max_loaded
+        self.store_kwargs = store_kwargs
+
+        self._shards = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+        os.makedirs(root, exist_ok=True)
+
+    def get(self, project_id, create=True):
+        """The project's shard, opened if needed. With `create=False` a
+        project that has no shard on disk yet gives None."""
+        if project_id is None:
+            return self.default
+        if not PROJECT_ID_RE.match(project_id):
+            raise ValueError("Invalid project_id")
+
+        with self._lock:
+            shard = self._shards.get(project_id)
+            if shard is not None:
+                self._shards.move_to_end(project_id)
+                return shard
+
+        # Open outside the lock; reading a big labels file must not block
+        # requests for other (already loaded) projects
+        folder = os.path.join(self.root, project_id)
+        if not create and not os.path.exists(os.path.join(folder, "face.vec")):
+            return None
+        os.makedirs(folder, exist_ok=True)
+        shard = SharedFaceIndex(os.path.join(folder, "face"), self.dim, **self.store_kwargs)
+        shard.start_writer_election()
+
+        evicted = []
+        with self._lock:
+            existing = self._shards.get(project_id)
+            if existing is not None:
+                evicted.append(shard)  # lost a race with another request
+                shard = existing
+            else:
+                self._shards[project_id] = shard
+                self.loads += 1
+            self._shards.move_to_end(project_id)
+
+            while len(self._shards) > self.max_loaded:
+                _, cold = self._shards.popitem(last=False)
+                evicted.append(cold)
+                self.evictions += 1
+
+        for cold in evicted:
+            cold.close()  # releases writer ownership; the memmap goes with the last reference
+        return shard
+
+    def get_for_read(self, project_id):
+        """Shard to search for a project, or None if nothing was ever
+        enrolled in it (creates nothing on disk)."""
+        return self.get(project_id, create=False)
+
+    def migrate(self, project_id, users):
+        """Copy the given users' rows from `default` into the project's
+        shard. `default` holds every tenant, so the users must be named.
+        Users already in the shard are skipped, so this can be re-run.
+        Returns the number of rows copied."""
+        if project_id is None or not users:
+            raise ValueError("migrate needs a project_id and the users of that project")
+        shard = self.get(project_id)
+        shard.refresh()
+        self.default.refresh()
+
+        vectors, labels = [], []
+        for user in users:
+            if len(shard.user_vectors(user)):
+                continue
+            rows = self.default.user_vectors(user)
+            vectors.append(rows)
+            labels += [user] * len(rows)
+        if labels:
+            shard.append(np.vstack(vectors), labels)
+        return len(labels)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": len(self._shards),
+                "max_loaded": self.max_loaded,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "shards": {pid: shard.count for pid, shard in self._shards.items()}
+            }
+
+    def close(self):
+        with self._lock:
+            shards = list(self._shards.values())
+            self._shards.clear()
+        for shard in shards:
+            shard.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy faces enrolled in the global store into a project shard")
+    parser.add_argument("project_id")
+    users = parser.add_mutually_exclusive_group(required=True)
+    users.add_argument("--users", nargs="+", help="User ids that belong to this project")
+    users.add_argument("--users-file", help="File with one user id per line")
+    parser.add_argument("--store", default="prod_face_db", help="Global store base path")
+    parser.add_argument("--root", default="shards", help="Shard root folder")
+    parser.add_argument("--dim", type=int, default=512)
+    args = parser.parse_args()
+
+    selected = args.users
+    if args.users_file:
+        with open(args.users_file) as f:
+            selected = [line.strip() for line in f if line.strip()]
+    if not selected:
+        parser.error("no user ids given")
+
+    # Appends are forwarded to the running API's writer if it owns the shard
+    manager = ShardManager(args.root, args.dim, default=SharedFaceIndex(args.store, args.dim))
+    try:
+        copied = manager.migrate(args.project_id, selected)
+    finally:
+        manager.close()
+        manager.default.close()
+    print(f"Copied {copied} vectors into {os.path.join(args.root, args.project_id)}")
@@ -0,0 +1,329 @@
+import fcntl
+import json
+import os
+import struct
+import threading
+import time
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+
+from index_tiers import TieredIndex
+from reverse_index import ReverseIndex
+
+
+# =========================
+# FILE LAYOUT
+# =========================
+# <base>.vec     64-byte header + float32 rows, memory-mapped read-only by readers
+# <base>.labels  one JSON line per row ({"user_id": ...}), loaded into a ReverseIndex
+# <base>.lock    flock held while a row batch is being appended
+# <base>.writer  flock held for life by the process that owns enrollment
+# <base>.sock    unix socket other processes use to forward enrollments
+# <base>.ann.json + <base>.ann.<generation>.faiss
+#                ANN index built by the writer, memory-mapped by every process
+MAGIC = b"FVEC"
+VERSION = 1
+HEADER_SIZE = 64
+HEADER_FMT = "<4sIIQQ"  # magic, version, dim, count, labels_size
+
+# Forwarding to a writer that has just exited (or been evicted) re-runs the
+# election; a new owner needs a moment to start listening
+FORWARD_RETRIES = 5
+FORWARD_RETRY_WAIT = 0.05
+
+
+class SharedFaceIndex:
+    """Append-only embedding store shared by every worker process.
+
+    Vectors live in one memory-mapped file, so N workers cost one copy of
+    the database in the page cache. Readers pick up new rows by re-reading
+    the header. Enrollment is funnelled to a single writer process.
+    """
+
+    def __init__(self, base_path, dim, tier="auto", nprobe=None, ef_search=None, codes=None, rerank=None):
+        self.dim = dim
+        # codes="fp16" / "pq": compressed codes in RAM, this file only read
+        # for the rows being re-ranked (see TieredIndex)
+        # Only the writer builds ANN indexes; it publishes them next to the
+        # store and every worker maps the same file
+        self.tiered = TieredIndex(dim, kind=tier, nprobe=nprobe, ef_search=ef_search,
+                                  codes=codes, rerank=rerank,
+                                  path=base_path + ".ann", is_builder=lambda: self.is_writer)
+        self.vec_path = base_path + ".vec"
+        self.labels_path = base_path + ".labels"
+        self.lock_path = base_path + ".lock"
+        self.writer_path = base_path + ".writer"
+        self.sock_path = base_path + ".sock"
+
+        self.count = 0
+        self.labels_size = 0
+        self.vectors = np.zeros((0, dim), dtype="float32")
+        self.reverse = ReverseIndex()
+
+        self.is_writer = False
+        self._closed = False
+        self._writer_fd = None
+        self._listener = None
+        self._lock = threading.Lock()
+        self._append_lock = threading.Lock()
+        self._pending = []
+
+        self._init_files()
+        self.refresh()
+
+    # ---------- files ----------
+    def _init_files(self):
+        with self._data_lock():
+            if not os.path.exists(self.vec_path) or os.path.getsize(self.vec_path) < HEADER_SIZE:
+                with open(self.vec_path, "wb") as f:
+                    f.write(self._pack_header(0, 0))
+                    f.flush()
+                    os.fsync(f.fileno())
+            open(self.labels_path, "ab").close()
+
+        with open(self.vec_path, "rb") as f:
+            magic, version, dim = struct.unpack_from("<4sII", f.read(12))
+        if magic != MAGIC or dim != self.dim:
+            raise ValueError(f"{self.vec_path} is not a {self.dim}-d face index")
+
+    def _pack_header(self, count, labels_size):
+        header = struct.pack(HEADER_FMT, MAGIC, VERSION, self.dim, count, labels_size)
+        return header.ljust(HEADER_SIZE, b"\0")
+
+    def _read_header(self):
+        with open(self.vec_path, "rb") as f:
+            _, _, _, count, labels_size = struct.unpack(HEADER_FMT, f.read(struct.calcsize(HEADER_FMT)))
+        return count, labels_size
+
+    def _data_lock(self):
+        return _FileLock(self.lock_path)
+
+    # ---------- readers ----------
+    def refresh(self):
+        """Map rows appended by any process since the last call."""
+        with self._lock:
+            # Header read under the lock: a thread holding an older header
+            # must never map (or label) rows another thread already has
+            count, labels_size = self._read_header()
+            if count <= self.count:
+                return False
+
+            with open(self.labels_path, "rb") as f:
+                f.seek(self.labels_size)
+                chunk = f.read(labels_size - self.labels_size)
+            row = self.count
+            for line in chunk.splitlines():
+                self.reverse.set(row, json.loads(line)["user_id"])
+                row += 1
+
+            self.vectors = np.memmap(self.vec_path, dtype="float32", mode="r",
+                                     offset=HEADER_SIZE, shape=(count, self.dim))
+            self.count = count
+            self.labels_size = labels_size
+            return True
+
+    def search(self, query, k=1):
+        self.refresh()
+        with self._lock:
+            vectors = self.vectors
+
+        query = np.ascontiguousarray(query.reshape(-1, self.dim), dtype="float32")
+        if len(vectors) == 0:
+            return (np.zeros((len(query), k), dtype="float32"),
+                    np.full((len(query), k), -1, dtype="int64"))
+
+        k = min(k, len(vectors))
+        self.tiered.sync(vectors)
+        return self.tiered.search(vectors, query, k)
+
+    def user_of(self, vector_id):
+        with self._lock:
+            return self.reverse.lookup(vector_id)[0]
+
+    def user_vectors(self, user):
+        """Copy of one user's stored embeddings (a few rows of the memmap)."""
+        with self._lock:
+            rows = self.reverse.rows_of(user)
+            vectors = self.vectors
+        return np.asarray(vectors[rows])
+
+    def users(self):
+        """Every user with at least one stored row."""
+        with self._lock:
+            return [u for u in self.reverse.users if len(self.reverse.rows_of(u))]
+
+    def resolve(self, scores, ids):
+        with self._lock:
+            return self.reverse.resolve(scores, ids)
+
+    # ---------- writer ----------
+    def start_writer_election(self):
+        """Try to become the enrollment owner; the loser forwards instead."""
+        if self.is_writer:
+            return True
+
+        fd = os.open(self.writer_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+
+        self._writer_fd = fd
+        self.is_writer = True
+
+        if os.path.exists(self.sock_path):
+            os.remove(self.sock_path)
+        self._listener = Listener(self.sock_path, family="AF_UNIX")
+        os.chmod(self.sock_path, 0o600)
+        threading.Thread(target=self._serve, name="index-writer", daemon=True).start()
+        return True
+
+    def _serve(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            try:
+                vectors, user_ids = conn.recv()
+                conn.send(("ok", self._append_local(vectors, user_ids)))
+            except Exception as e:
+                conn.send(("error", str(e)))
+
+    def append(self, vectors, user_ids):
+        """Append rows and return the first new vector id."""
+        vectors = np.ascontiguousarray(vectors.reshape(-1, self.dim), dtype="float32")
+        if len(vectors) != len(user_ids):
+            raise ValueError("One user_id is required per vector")
+
+        # The owner may have exited; whoever gets the lock next takes over.
+        # A closed (e.g. evicted) handle writes directly under the file lock.
+        for attempt in range(FORWARD_RETRIES):
+            if self.is_writer or self._closed or self.start_writer_election():
+                return self._append_local(vectors, user_ids)
+
+            try:
+                with Client(self.sock_path, family="AF_UNIX") as conn:
+                    conn.send((vectors, list(user_ids)))
+                    status, result = conn.recv()
+            except (OSError, EOFError):
+                # Writer closed its socket (exit, shard eviction) before
+                # answering; elect again. Its appends commit atomically, so
+                # at worst a retry stores the same rows twice.
+                time.sleep(FORWARD_RETRY_WAIT * (attempt + 1))
+                continue
+            if status != "ok":
+                raise RuntimeError(f"Enrollment writer failed: {result}")
+            return result
+        raise RuntimeError("No enrollment writer is accepting appends")
+
+    def _append_local(self, vectors, user_ids):
+        # Group commit: concurrent enrollments queue up here and whichever
+        # thread holds the append lock writes and fsyncs all of them at once
+        entry = {"vectors": vectors, "user_ids": list(user_ids), "start": None, "error": None}
+        with self._lock:
+            self._pending.append(entry)
+
+        with self._append_lock:
+            if entry["start"] is None and entry["error"] is None:
+                with self._lock:
+                    batch, self._pending = self._pending, []
+                try:
+                    self._commit(batch)
+                except Exception as e:
+                    for item in batch:
+                        item["error"] = e
+
+        if entry["error"] is not None:
+            raise entry["error"]
+        self.refresh()
+        return entry["start"]
+
+    def _commit(self, batch, only_if_empty=False):
+        user_ids = [u for item in batch for u in item["user_ids"]]
+        vectors = np.concatenate([item["vectors"] for item in batch])
+        lines = b"".join(
+            json.dumps({"user_id": u}).encode() + b"\n" for u in user_ids
+        )
+
+        with self._data_lock():
+            count, labels_size = self._read_header()
+            if only_if_empty and count > 0:
+                return False
+
+            # Drop anything a crashed writer left past the committed header
+            with open(self.labels_path, "r+b") as f:
+                f.truncate(labels_size)
+                f.seek(labels_size)
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+            with open(self.vec_path, "r+b") as f:
+                f.seek(HEADER_SIZE + count * self.dim * 4)
+                f.write(vectors.tobytes())
+                f.truncate(HEADER_SIZE + (count + len(vectors)) * self.dim * 4)
+                f.flush()
+                os.fsync(f.fileno())
+
+                # Commit point: readers only trust rows covered by the header
+                f.seek(0)
+                f.write(self._pack_header(count + len(vectors), labels_size + len(lines)))
+                f.flush()
+                os.fsync(f.fileno())
+
+        for item in batch:
+            item["start"] = count
+            count += len(item["vectors"])
+        return True
+
+    def import_legacy(self, index, user_map):
+        """One-time copy of an old IndexFlatIP + {user: [ids]} pickle."""
+        if index.ntotal == 0:
+            return 0
+
+        owner = {}
+        for user, ids in user_map.items():
+            for vid in ids:
+                owner[int(vid)] = user
+
+        vectors = index.reconstruct_n(0, index.ntotal)
+        user_ids = [owner.get(i) for i in range(index.ntotal)]
+        entry = {"vectors": vectors, "user_ids": user_ids}
+        with self._append_lock:
+            if not self._commit([entry], only_if_empty=True):
+                return 0  # another worker already imported it
+        self.refresh()
+        return index.ntotal
+
+    def close(self):
+        self._closed = True
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+        if self._writer_fd is not None:
+            os.close(self._writer_fd)
+            self._writer_fd = None
+            self.is_writer = False
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
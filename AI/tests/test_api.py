@@ -0,0 +1,118 @@
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import face_auth_api as api
+import liveness
+
+
+class NoFaceMesh:
+    """Stands in for the MediaPipe FaceMesh: every frame has no face."""
+
+    def get_metrics(self, image):
+        return None, None, None
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def client(monkeypatch):
+    # No startup hook (that loads the models): mark the worker ready by hand
+    monkeypatch.setattr(liveness, "FaceMeshDetector", NoFaceMesh)
+    api.ready.set()
+    yield TestClient(api.app)
+    api.ready.clear()
+
+def jpeg():
+    return cv2.imencode(".jpg", np.full((64, 64, 3), 128, np.uint8))[1].tobytes()
+
+
+# =========================
+# LIVENESS
+# =========================
+def test_websocket_closes_when_session_expires(client):
+    session_id = client.post("/liveness/session").json()["session_id"]
+
+    with client.websocket_connect(f"/liveness/{session_id}/ws") as ws:
+        ws.send_bytes(jpeg())
+        assert ws.receive_json()["state"] == "running"
+
+        api.liveness_sessions.drop(session_id)
+        ws.send_bytes(jpeg())
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+    assert closed.value.code == 4410
+
+
+def test_websocket_rejects_unknown_session(client):
+    with client.websocket_connect("/liveness/nope/ws") as ws:
+        with pytest.raises(WebSocketDisconnect) as closed:
+            ws.receive_json()
+    assert closed.value.code == 4404
+
+
+def test_clip_clock_never_runs_behind_wall_clock(tmp_path, monkeypatch):
+    # 20 frames stamped 1 ms apart, while the server takes 1 s per frame
+    path = str(tmp_path / "clip.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 1000, (64, 64))
+    for _ in range(20):
+        writer.write(np.full((64, 64, 3), 128, np.uint8))
+    writer.release()
+
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(api.time, "time", lambda: float(next(clock)))
+
+    session = liveness.LivenessSession.__new__(liveness.LivenessSession)
+    session.challenge = liveness.LivenessChallenge(challenges=["TURN"], timeout=5)
+    seen = []
+    session.feed = lambda frame, now: (seen.append(now), session.challenge.update((0.4, 0.2, 0.0), now=now))
+    session.status = lambda: session.challenge.status()
+
+    status = api.liveness_clip(session, path, fps=1000)
+    assert status["state"] == "failed" and session.challenge.reason == "timeout"
+    assert seen[-1] - seen[0] > 5
+
+
+# =========================
+# VERIFY API (1:1)
+# =========================
+@pytest.fixture
+def stores(tmp_path, monkeypatch):
+    # Throw-away store and shards; every upload embeds to the same vector
+    emb = np.zeros(api.VECTOR_DIM, np.float32)
+    emb[0] = 1.0
+
+    async def fake_embed(request, data):
+        return emb, 0.9, 1.0
+
+    monkeypatch.setattr(api, "embed_upload", fake_embed)
+    api.open_store(str(tmp_path / "global"), str(tmp_path / "shards"), import_legacy=False)
+    yield emb
+    api.shards.close()
+    api.store.close()
+    api.store = api.shards = None
+
+def post_verify(client, user_id, project_id=None):
+    params = {"user_id": user_id}
+    if project_id is not None:
+        params["project_id"] = project_id
+    return client.post("/verify", params=params, files={"image": ("face.jpg", jpeg(), "image/jpeg")})
+
+def test_verify_enrolled_user(client, stores):
+    api.add_vector(api.shards.get("acme"), "alice", stores)
+    reply = post_verify(client, "alice", "acme")
+    assert reply.status_code == 200
+    assert reply.json()["verified"] and reply.json()["similarity_score"] == 1.0
+
+def test_verify_unknown_user_in_project(client, stores):
+    api.add_vector(api.shards.get("acme"), "alice", stores)
+    assert post_verify(client, "bob", "acme").status_code == 404
+
+def test_verify_never_reads_another_tenant(client, stores, tmp_path):
+    # alice is enrolled globally and in another project, not in "acme"
+    api.add_vector(api.store, "alice", stores)
+    api.add_vector(api.shards.get("other"), "alice", stores)
+    assert post_verify(client, "alice", "acme").status_code == 404
+    assert not (tmp_path / "shards" / "acme").exists()
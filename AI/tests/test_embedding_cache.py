@@ -0,0 +1,58 @@
+import numpy as np
+
+import embedding_cache
+from embedding_cache import EmbeddingCache
+
+
+def value(seed):
+    return np.random.default_rng(seed).random(512).astype("float32"), 0.9, 0.5
+
+
+def test_hit_after_put():
+    cache = EmbeddingCache()
+    key, hit = cache.lookup(b"jpeg bytes")
+    assert hit is None
+    cache.put(key, value(0))
+    _, hit = cache.lookup(b"jpeg bytes")
+    assert np.array_equal(hit[0], value(0)[0])
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_namespace_separates_models():
+    a = EmbeddingCache(namespace="buffalo_l:fp32")
+    b = EmbeddingCache(namespace="buffalo_l:int8")
+    assert a.key(b"same upload") != b.key(b"same upload")
+
+
+def test_lru_eviction():
+    cache = EmbeddingCache(max_items=2)
+    for i in range(3):
+        cache.put(cache.key(bytes([i])), value(i))
+    assert cache.get(cache.key(b"\x00")) is None
+    assert cache.get(cache.key(b"\x02")) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: clock[0])
+    cache = EmbeddingCache(ttl=10)
+    key = cache.key(b"upload")
+    cache.put(key, value(0))
+    clock[0] += 11
+    assert cache.get(key) is None
+
+
+def test_disk_tier_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    writer = EmbeddingCache(disk_path=path, namespace="m")
+    reader = EmbeddingCache(namespace="m")
+    reader.open_disk(path)
+    key = writer.key(b"upload")
+    writer.put(key, value(1))
+
+    hit = reader.get(key)
+    assert hit is not None and np.array_equal(hit[0], value(1)[0])
+    assert reader.stats()["disk_hits"] == 1
+    writer.close()
+    reader.close()
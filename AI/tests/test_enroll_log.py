@@ -0,0 +1,156 @@
+import os
+import pickle
+
+import faiss
+import numpy as np
+
+from enroll_log import LoggedFaceDB, RECORD_HEADER, atomic_pickle, atomic_write_index
+from reverse_index import ReverseIndex
+
+DIM = 8
+
+
+def vectors(n, seed):
+    return np.random.default_rng(seed).random((n, DIM), dtype=np.float32)
+
+def apply_by_id(user_map, start_id, count, user):
+    # {vector_id: user}, as auth_system.py keeps it
+    for i in range(start_id, start_id + count):
+        user_map[i] = user
+
+def apply_replace(user_map, start_id, count, user):
+    # {user: [ids]}, re-enrollment replaces (face_auth.py)
+    user_map[user] = list(range(start_id, start_id + count))
+
+def open_db(tmp_path, apply_meta=apply_by_id, **kwargs):
+    return LoggedFaceDB(str(tmp_path / "db.index"), str(tmp_path / "map.pkl"),
+                        new_index=lambda: faiss.IndexFlatIP(DIM), apply_meta=apply_meta,
+                        label=lambda user, n: (user, None), **kwargs)
+
+def record_size(n, user):
+    return RECORD_HEADER + n * DIM * 4 + len(pickle.dumps(user))
+
+def crash(db):
+    # Drop the handle without sync / snapshot
+    db.log._f.close()
+
+
+def test_replay_restores_unsnapshotted_enrollments(tmp_path):
+    db = open_db(tmp_path)
+    db.add(vectors(2, 0), "alice")
+    db.add(vectors(3, 1), "bob")
+    crash(db)
+
+    db = open_db(tmp_path)
+    assert db.index.ntotal == 5
+    assert db.user_map == {0: "alice", 1: "alice", 2: "bob", 3: "bob", 4: "bob"}
+    assert db.reverse.lookup(4) == ("bob", None)
+    np.testing.assert_array_equal(db.index.reconstruct(2), vectors(3, 1)[0])
+
+
+def test_torn_tail_record_is_cut_off(tmp_path):
+    db = open_db(tmp_path)
+    db.add(vectors(2, 0), "alice")
+    db.add(vectors(2, 1), "bob")
+    crash(db)
+
+    log_path = db.log.path
+    with open(log_path, "r+b") as f:
+        f.truncate(os.path.getsize(log_path) - 5)
+
+    db = open_db(tmp_path)
+    assert db.index.ntotal == 2
+    assert set(db.user_map.values()) == {"alice"}
+    assert os.path.getsize(log_path) == record_size(2, "alice")
+
+    # The log keeps working after the cut
+    db.add(vectors(1, 2), "carol")
+    crash(db)
+    db = open_db(tmp_path)
+    assert db.index.ntotal == 3
+    assert db.user_map[2] == "carol"
+
+
+def test_partial_header_is_cut_off(tmp_path):
+    db = open_db(tmp_path)
+    db.add(vectors(1, 0), "alice")
+    crash(db)
+    with open(db.log.path, "ab") as f:
+        f.write(b"ENRL\x00\x01")
+
+    db = open_db(tmp_path)
+    assert db.index.ntotal == 1
+    assert db.log.records == 1
+
+
+def test_corrupt_record_stops_replay(tmp_path):
+    db = open_db(tmp_path)
+    db.add(vectors(1, 0), "alice")
+    db.add(vectors(1, 1), "bob")
+    db.add(vectors(1, 2), "carol")
+    crash(db)
+
+    # Flip a byte inside the second record's vectors: its CRC no longer matches
+    with open(db.log.path, "r+b") as f:
+        f.seek(record_size(1, "alice") + RECORD_HEADER + 3)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    db = open_db(tmp_path)
+    assert db.index.ntotal == 1
+    assert db.user_map == {0: "alice"}
+
+
+def test_snapshot_then_crash_before_log_reset(tmp_path):
+    db = open_db(tmp_path)
+    db.add(vectors(2, 0), "alice")
+    db.add(vectors(2, 1), "bob")
+    # Snapshot files written, crash before the log is emptied
+    atomic_write_index(db.index, db.db_path)
+    atomic_pickle(db.user_map, db.map_path)
+    crash(db)
+
+    db = open_db(tmp_path)
+    assert db.index.ntotal == 4  # covered records are not added twice
+    assert db.user_map == {0: "alice", 1: "alice", 2: "bob", 3: "bob"}
+
+
+def test_index_written_but_map_stale(tmp_path):
+    db = open_db(tmp_path)
+    db.add(vectors(2, 0), "alice")
+    db.snapshot()
+    db.add(vectors(2, 1), "bob")
+    # Crash between the two snapshot writes: index is new, map is old
+    atomic_write_index(db.index, db.db_path)
+    crash(db)
+
+    db = open_db(tmp_path)
+    assert db.index.ntotal == 4
+    assert db.user_map == {0: "alice", 1: "alice", 2: "bob", 3: "bob"}
+    assert db.reverse.lookup(3) == ("bob", None)
+
+
+def test_snapshot_empties_log_and_saves_reverse(tmp_path):
+    db = open_db(tmp_path)
+    db.add(vectors(3, 0), "alice")
+    db.snapshot()
+    assert os.path.getsize(db.log.path) == 0
+    assert os.path.exists(db.rev_path)
+    db.close()
+
+    db = open_db(tmp_path)
+    assert db.index.ntotal == 3
+    np.testing.assert_array_equal(db.reverse.rows_of("alice"), [0, 1, 2])
+
+
+def test_re_enroll_matches_rebuilt_reverse_index(tmp_path):
+    db = open_db(tmp_path, apply_meta=apply_replace, replace=True)
+    db.add(vectors(2, 0), "alice")
+    db.add(vectors(2, 1), "bob")
+    db.add(vectors(3, 2), "alice")
+
+    rebuilt = ReverseIndex.from_user_map(db.user_map)
+    np.testing.assert_array_equal(db.reverse.rows_of("alice"), [4, 5, 6])
+    assert [db.reverse.lookup(i)[0] for i in range(7)] == [rebuilt.lookup(i)[0] for i in range(7)]
+    assert db.reverse.lookup(0) == (None, None)
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+import face_engine
+
+
+@pytest.fixture
+def pack(tmp_path, monkeypatch):
+    monkeypatch.setattr(face_engine, "QUANT_DIR", str(tmp_path))
+    source = tmp_path / "w600k_r50.onnx"
+    model = tmp_path / "buffalo_l_w600k_r50_int8.onnx"
+    source.write_bytes(b"fp32 graph")
+    model.write_bytes(b"int8 graph")
+    marker = {"active": True, "model": str(model), "source": str(source),
+              "source_sha256": face_engine.sha256_of(str(source))}
+    with open(face_engine.int8_marker_path("buffalo_l"), "w") as f:
+        json.dump(marker, f)
+    return source, model
+
+
+def test_active_marker_is_used(pack):
+    marker = face_engine.active_int8_model("buffalo_l")
+    assert marker is not None and marker["model"] == str(pack[1])
+
+
+def test_replaced_source_model_falls_back_to_fp32(pack):
+    pack[0].write_bytes(b"a newer fp32 graph")
+    assert face_engine.active_int8_model("buffalo_l") is None
+
+
+def test_missing_int8_model_falls_back_to_fp32(pack):
+    pack[1].unlink()
+    assert face_engine.active_int8_model("buffalo_l") is None
+
+
+def test_no_marker(tmp_path, monkeypatch):
+    monkeypatch.setattr(face_engine, "QUANT_DIR", str(tmp_path))
+    assert face_engine.active_int8_model("buffalo_l") is None
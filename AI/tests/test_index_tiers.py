@@ -0,0 +1,113 @@
+import numpy as np
+
+from index_tiers import TAIL_MAX, TieredIndex
+
+DIM = 16
+
+
+def unit_rows(n, seed):
+    rows = np.random.default_rng(seed).standard_normal((n, DIM)).astype("float32")
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+def build(tiered, vectors):
+    tiered.sync(vectors)
+    thread = tiered._building
+    if thread is not None:
+        thread.join()
+    assert tiered.index is not None and tiered.index.ntotal == len(vectors)
+
+def exact_top(vectors, query, k):
+    scores = query @ vectors.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def test_flat_without_codes_is_an_exact_scan():
+    vectors = unit_rows(200, 0)
+    tiered = TieredIndex(DIM, kind="flat")
+    tiered.sync(vectors)
+    assert tiered.index is None
+
+    _, ids = tiered.search(vectors, vectors[:5], 3)
+    np.testing.assert_array_equal(ids, exact_top(vectors, vectors[:5], 3))
+
+
+def test_tail_rows_are_merged_into_results():
+    indexed = unit_rows(300, 1)
+    tiered = TieredIndex(DIM, kind="hnsw")
+    build(tiered, indexed)
+
+    # Rows appended after the build are only in the exact tail scan
+    vectors = np.vstack([indexed, unit_rows(20, 2)])
+    query = vectors[300:310]
+    scores, ids = tiered.search(vectors, query, 5)
+
+    np.testing.assert_array_equal(ids[:, 0], np.arange(300, 310))
+    np.testing.assert_allclose(scores[:, 0], 1.0, rtol=1e-5)
+    assert ids.shape == (10, 5)
+    assert (np.diff(scores, axis=1) <= 0).all()
+    np.testing.assert_array_equal(ids, exact_top(vectors, query, 5))
+
+
+def test_small_coded_store_is_scanned_exactly():
+    vectors = unit_rows(400, 3)
+    tiered = TieredIndex(DIM, kind="hnsw", codes="fp16")
+    tiered.sync(vectors)
+    assert tiered._building is None and tiered.index is None
+
+
+def test_reranked_scores_are_exact_and_sorted():
+    # Coded tiers are only built past TAIL_MAX rows
+    vectors = unit_rows(TAIL_MAX + 500, 3)
+    tiered = TieredIndex(DIM, kind="hnsw", codes="fp16", rerank=1)
+    build(tiered, vectors)
+    assert tiered.built_codes == "fp16"
+
+    query = unit_rows(20, 4)
+    scores, ids = tiered.search(vectors, query, 8)
+
+    # Even with no extra candidates the rows come back best-first
+    assert (np.diff(scores, axis=1) <= 0).all()
+    exact = np.einsum("qkd,qd->qk", vectors[ids], query)
+    np.testing.assert_allclose(scores, exact, rtol=1e-5, atol=1e-6)
+
+
+def test_reranked_results_with_tail():
+    indexed = unit_rows(TAIL_MAX + 500, 5)
+    tiered = TieredIndex(DIM, kind="hnsw", codes="fp16")
+    build(tiered, indexed)
+
+    n = len(indexed)
+    vectors = np.vstack([indexed, unit_rows(10, 6)])
+    query = np.vstack([vectors[n + 5], vectors[10]])
+    scores, ids = tiered.search(vectors, query, 4)
+
+    assert ids[0, 0] == n + 5 and ids[1, 0] == 10
+    assert (np.diff(scores, axis=1) <= 0).all()
+
+
+def test_reader_maps_the_published_index(tmp_path):
+    vectors = unit_rows(300, 7)
+    path = str(tmp_path / "store.ann")
+    writer = TieredIndex(DIM, kind="hnsw", path=path, is_builder=lambda: True)
+    build(writer, vectors)
+
+    reader = TieredIndex(DIM, kind="hnsw", path=path, is_builder=lambda: False)
+    reader.sync(vectors)
+    assert reader._building is None
+    assert reader.index is not None and reader.index.ntotal == 300
+
+    query = vectors[:10]
+    np.testing.assert_array_equal(reader.search(vectors, query, 3)[1],
+                                  writer.search(vectors, query, 3)[1])
+
+
+def test_reader_ignores_index_ahead_of_its_rows(tmp_path):
+    vectors = unit_rows(300, 8)
+    path = str(tmp_path / "store.ann")
+    build(TieredIndex(DIM, kind="hnsw", path=path), vectors)
+
+    reader = TieredIndex(DIM, kind="hnsw", path=path, is_builder=lambda: False)
+    reader.sync(vectors[:200])
+    assert reader.index is None
+    _, ids = reader.search(vectors[:200], vectors[:3], 1)
+    np.testing.assert_array_equal(ids[:, 0], [0, 1, 2])
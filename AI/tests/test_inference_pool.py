@@ -0,0 +1,38 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from embedding_batcher import EmbeddingBatcher
+from inference_pool import InferencePool
+
+
+def test_batched_recognition_is_admitted_by_the_pool():
+    pool = InferencePool(workers=1, max_queue=1, retry_after=3)
+    release = threading.Event()
+
+    def get_feat(crops):
+        release.wait(5)
+        return np.ones((len(crops), 4), np.float32)
+
+    batcher = EmbeddingBatcher(None, max_batch=4, max_wait_ms=1,
+                               infer=lambda crops: pool.executor.submit(get_feat, crops).result())
+    crop = np.zeros((112, 112, 3), np.uint8)
+
+    async def scenario():
+        waiting = [asyncio.ensure_future(pool.submit(None, batcher.submit, crop)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(HTTPException) as busy:
+            await pool.submit(None, batcher.submit, crop)
+        assert busy.value.status_code == 503 and busy.value.headers["Retry-After"] == "3"
+
+        release.set()
+        feats = await asyncio.gather(*waiting)
+        assert all(np.isclose(np.linalg.norm(f), 1.0) for f in feats)
+
+    asyncio.run(scenario())
+    assert pool.stats()["in_flight"] == 0 and pool.stats()["rejected"] == 1
+    batcher.close()
+    pool.shutdown()
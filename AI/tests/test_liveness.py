@@ -0,0 +1,104 @@
+import numpy as np
+
+from liveness import KEY_LANDMARKS, LivenessChallenge, metrics_batch, replay_session
+
+OPEN = (0.4, 0.2, 0.0)     # (ear, mar, yaw): eyes open, neutral, centred
+NO_FACE = (None, None, None)
+
+
+def feed(challenge, frames):
+    """Feed (metrics, time) pairs; returns what each frame verified."""
+    return [challenge.update(metrics, now=now) for metrics, now in frames]
+
+
+def test_passes_all_steps_in_order():
+    challenge = LivenessChallenge(challenges=["BLINK", "SMILE", "TURN"])
+    verified = feed(challenge, [
+        (OPEN, 0.0),
+        ((0.2, 0.2, 0.0), 0.1),     # eyes closed
+        (OPEN, 0.2),                # ... and open again
+        ((0.35, 0.5, 0.0), 0.3),    # smile
+        ((0.35, 0.2, 20.0), 1.0),   # turn
+        ((0.35, 0.2, 2.0), 1.1),    # back to centre
+    ])
+    assert verified == [None, None, "BLINK", "SMILE", "TURN", "CENTER"]
+    assert challenge.state == "passed"
+    assert challenge.done
+
+
+def test_steps_only_count_in_their_turn():
+    challenge = LivenessChallenge(challenges=["TURN", "SMILE", "BLINK"])
+    assert feed(challenge, [((0.35, 0.5, 0.0), 0.0)]) == [None]    # smile while TURN is asked
+    assert challenge.current == "TURN"
+    assert feed(challenge, [((0.35, 0.2, -15.0), 0.1)]) == ["TURN"]
+    assert challenge.current == "SMILE"
+
+
+def test_blink_needs_close_then_open():
+    challenge = LivenessChallenge(challenges=["BLINK"])
+    assert feed(challenge, [(OPEN, 0.0), (OPEN, 0.1)]) == [None, None]
+    # Re-opening must clear the threshold by a margin
+    assert feed(challenge, [((0.2, 0.2, 0.0), 0.2), ((0.32, 0.2, 0.0), 0.3)]) == [None, None]
+    assert feed(challenge, [(OPEN, 0.4)]) == ["BLINK"]
+    assert challenge.current == "CENTER"
+
+
+def test_smile_hold_blocks_the_next_step():
+    challenge = LivenessChallenge(challenges=["SMILE", "TURN"], smile_hold=0.5)
+    assert feed(challenge, [((0.35, 0.5, 0.0), 0.0)]) == ["SMILE"]
+    assert feed(challenge, [((0.35, 0.2, 20.0), 0.3)]) == [None]
+    assert feed(challenge, [((0.35, 0.2, 20.0), 0.6)]) == ["TURN"]
+
+
+def test_frames_without_face_do_not_advance():
+    challenge = LivenessChallenge(challenges=["TURN"])
+    assert feed(challenge, [(NO_FACE, 0.0), (NO_FACE, 1.0)]) == [None, None]
+    assert challenge.step_idx == 0
+    assert challenge.state == "running"
+
+
+def test_timeout_fails_and_stops():
+    challenge = LivenessChallenge(challenges=["BLINK"], timeout=5)
+    feed(challenge, [(OPEN, 0.0), ((0.2, 0.2, 0.0), 6.0)])
+    assert challenge.state == "failed"
+    assert challenge.reason == "timeout"
+
+    # A finished challenge ignores further frames
+    assert challenge.update(OPEN, now=6.1) is None
+    assert challenge.status()["current"] is None
+
+
+def test_status_reports_progress():
+    challenge = LivenessChallenge(challenges=["TURN", "SMILE"])
+    status = challenge.status()
+    assert status["state"] == "running"
+    assert status["current"] == "TURN"
+    assert status["instruction"] == "Step 1: TURN NOW!"
+
+    feed(challenge, [((0.35, 0.2, 20.0), 0.0), ((0.35, 0.5, 0.0), 0.1)])
+    assert challenge.instruction() == "Final Step: Look at Camera"
+
+
+def test_metrics_batch_keeps_missing_faces_missing():
+    points = np.random.default_rng(0).random((3, len(KEY_LANDMARKS), 2), dtype=np.float32)
+    points[1] = np.nan
+    metrics = metrics_batch(points)
+    assert metrics.shape == (3, 3)
+    assert np.isnan(metrics[1]).all()
+    assert not np.isnan(metrics[[0, 2]]).any()
+
+
+def face_with_nose_at(x):
+    face = np.full((len(KEY_LANDMARKS), 2), 0.5, dtype=np.float32)
+    face[:, 0] = np.linspace(0.3, 0.7, len(KEY_LANDMARKS))
+    face[3, 0], face[9, 0] = 0.3, 0.7   # eye corners the yaw is measured between
+    face[8, 0] = x                      # nose
+    return face
+
+def test_replay_session_over_recorded_landmarks():
+    centred, turned = face_with_nose_at(0.5), face_with_nose_at(0.65)
+    landmarks = np.stack([np.full_like(centred, np.nan), centred, turned, centred])
+
+    challenge = replay_session(landmarks, [0.0, 0.1, 0.2, 0.3], challenges=["TURN"])
+    assert challenge.state == "passed"
+    assert challenge.step_idx == 1
@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+import pytest
+
+import preprocess
+
+
+def jpeg(w, h):
+    img = np.random.default_rng(0).integers(0, 256, (h, w, 3), dtype=np.uint8)
+    return cv2.imencode(".jpg", img)[1].tobytes()
+
+
+def test_image_size_from_headers():
+    assert preprocess.image_size(jpeg(640, 480)) == (640, 480)
+    png = cv2.imencode(".png", np.zeros((30, 50, 3), np.uint8))[1].tobytes()
+    assert preprocess.image_size(png) == (50, 30)
+    assert preprocess.image_size(b"not an image") is None
+
+
+def test_reduction_for():
+    assert preprocess.reduction_for(None) == 1
+    assert preprocess.reduction_for((800, 600), 960) == 1
+    assert preprocess.reduction_for((2000, 1500), 960) == 2
+    assert preprocess.reduction_for((4000, 3000), 960) == 4
+    assert preprocess.reduction_for((8000, 6000), 960) == 8
+
+
+def test_decode_reduces_large_jpegs():
+    img, factor = preprocess.decode(jpeg(2000, 1000), target_side=960)
+    assert factor == 2 and img.shape[:2] == (500, 1000)
+    img, factor = preprocess.decode(jpeg(2000, 1000), target_side=None)
+    assert factor == 1 and img.shape[:2] == (1000, 2000)
+
+
+def test_decode_rejects_garbage():
+    with pytest.raises(ValueError):
+        preprocess.decode(b"\xff\xd8garbage")
+
+
+def test_det_input_size_is_stride_aligned():
+    w, h = preprocess.det_input_size((1000, 750, 3))
+    assert w % preprocess.DET_STRIDE == 0 and h % preprocess.DET_STRIDE == 0
+    assert preprocess.DET_MIN_SIDE <= max(w, h) <= preprocess.DET_MAX_SIDE
+
+
+def test_needs_full_decode():
+    assert preprocess.needs_full_decode(2, [0, 0, 60, 60])
+    assert not preprocess.needs_full_decode(2, [0, 0, 200, 200])
+    assert not preprocess.needs_full_decode(1, [0, 0, 60, 60])
@@ -0,0 +1,44 @@
+import cv2
+import numpy as np
+
+import quality
+
+
+def textured(side=800, seed=0):
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 256, (side, side, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(noise, (0, 0), 3)
+
+
+def test_face_roi_clamps_to_image():
+    img = np.zeros((100, 80, 3), np.uint8)
+    assert quality.face_roi(img, [-10, -10, 200, 200]).shape[:2] == (100, 80)
+    assert quality.face_roi(img, None) is img
+    assert quality.face_roi(img, [50, 50, 50, 50]) is img
+
+
+def test_blur_score_does_not_depend_on_decode_resolution():
+    img = textured()
+    bbox = np.array([200, 200, 600, 600], np.float32)
+    full = quality.face_quality(img, bbox)["blur"]
+    for factor in (2, 4):
+        side = img.shape[0] // factor
+        small = cv2.resize(img, (side, side), interpolation=cv2.INTER_AREA)
+        reduced = quality.face_quality(small, bbox / factor)["blur"]
+        assert abs(reduced - full) / full < 0.5
+
+
+def test_sharper_face_scores_higher():
+    img = textured()
+    soft = cv2.GaussianBlur(img, (0, 0), 4)
+    bbox = [200, 200, 600, 600]
+    assert quality.face_quality(img, bbox)["blur"] > quality.face_quality(soft, bbox)["blur"]
+
+
+def test_exposure_and_size_scores():
+    grey = np.full((200, 200, 3), 128, np.uint8)
+    black = np.zeros((200, 200, 3), np.uint8)
+    assert quality.exposure_score(quality.to_gray(grey)) > 0.9
+    assert quality.exposure_score(quality.to_gray(black)) == 0.0
+    assert quality.face_size_score([0, 0, 56, 200]) == 0.5
+    assert quality.face_size_score([0, 0, 300, 300]) == 1.0
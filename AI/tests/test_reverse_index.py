@@ -0,0 +1,92 @@
+import numpy as np
+
+from reverse_index import ReverseIndex
+
+
+def test_set_and_lookup():
+    rev = ReverseIndex()
+    rev.set(0, "alice", count=2)
+    rev.set(2, "bob", angles=["bob_left", "bob_right"])
+
+    assert rev.size == 4
+    assert rev.lookup(1) == ("alice", None)
+    assert rev.lookup(3) == ("bob", "bob_right")
+    assert rev.lookup(4) == (None, None)
+    assert rev.lookup(-1) == (None, None)
+
+
+def test_set_is_idempotent():
+    rev = ReverseIndex()
+    rev.set(0, "alice", count=3)
+    rev.set(0, "alice", count=3)
+    np.testing.assert_array_equal(rev.rows_of("alice"), [0, 1, 2])
+
+
+def test_rows_of_drops_relabelled_rows():
+    rev = ReverseIndex()
+    rev.set(0, "alice", count=3)
+    rev.set(1, "bob", count=1)
+    np.testing.assert_array_equal(rev.rows_of("alice"), [0, 2])
+    np.testing.assert_array_equal(rev.rows_of("bob"), [1])
+    assert len(rev.rows_of("nobody")) == 0
+
+
+def test_clear_unlabels_user():
+    rev = ReverseIndex()
+    rev.set(0, "alice", count=2)
+    rev.set(2, "bob", count=1)
+    rev.clear("alice")
+    rev.set(3, "alice", count=1)
+
+    assert rev.lookup(0) == (None, None)
+    np.testing.assert_array_equal(rev.rows_of("alice"), [3])
+    np.testing.assert_array_equal(rev.rows_of("bob"), [2])
+
+
+def test_resolve_one_hit_per_user_best_first():
+    rev = ReverseIndex()
+    rev.set(0, "alice", count=2)
+    rev.set(2, "bob", count=2)
+
+    scores = np.array([0.9, 0.8, 0.7, 0.1, 0.0], dtype="float32")
+    ids = np.array([3, 0, 2, 1, -1])
+    assert rev.resolve(scores, ids) == [
+        ("bob", scores[0].item(), 3), ("alice", scores[1].item(), 0)
+    ]
+
+
+def test_resolve_skips_unlabelled_and_unknown_rows():
+    rev = ReverseIndex()
+    rev.set(1, "alice", count=1)
+    hits = rev.resolve(np.array([0.9, 0.8, 0.7]), np.array([0, 7, 1]))
+    assert [(user, vid) for user, _, vid in hits] == [("alice", 1)]
+
+
+def test_save_load_round_trip(tmp_path):
+    rev = ReverseIndex()
+    rev.set(0, "alice", angles=["alice_front", "alice_left"])
+    rev.set(2, "bob", count=1)
+    rev.set(1, "bob", count=1)
+    path = str(tmp_path / "rev.npz")
+    rev.save(path)
+
+    loaded = ReverseIndex.load(path)
+    assert loaded.size == 3
+    assert [loaded.lookup(i) for i in range(3)] == [rev.lookup(i) for i in range(3)]
+    np.testing.assert_array_equal(loaded.rows_of("alice"), [0])
+    np.testing.assert_array_equal(loaded.rows_of("bob"), [1, 2])
+
+    # Still appendable after loading
+    loaded.set(3, "carol", count=1)
+    assert loaded.lookup(3) == ("carol", None)
+
+
+def test_from_user_map_layouts():
+    by_user = ReverseIndex.from_user_map({"alice": [0, 1], "bob": [2]})
+    assert [by_user.lookup(i)[0] for i in range(3)] == ["alice", "alice", "bob"]
+
+    with_angles = ReverseIndex.from_user_map({"alice": [{"id": 0, "angle": "alice_front"}]})
+    assert with_angles.lookup(0) == ("alice", "alice_front")
+
+    by_id = ReverseIndex.from_user_map({0: "alice", 1: "bob"})
+    assert by_id.lookup(1) == ("bob", None)
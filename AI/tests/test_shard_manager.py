@@ -0,0 +1,164 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from shard_manager import ShardManager
+from shared_index import SharedFaceIndex
+
+DIM = 8
+
+
+def unit_rows(n, seed):
+    rows = np.random.default_rng(seed).standard_normal((n, DIM)).astype("float32")
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+@pytest.fixture
+def manager(tmp_path):
+    default = SharedFaceIndex(str(tmp_path / "global"), DIM, tier="flat")
+    default.start_writer_election()
+    manager = ShardManager(str(tmp_path / "shards"), DIM, default=default, tier="flat")
+    yield manager
+    manager.close()
+    default.close()
+
+
+def test_requests_without_project_use_default(manager):
+    assert manager.get(None) is manager.default
+    assert manager.get_for_read(None) is manager.default
+
+
+def test_invalid_project_id_is_rejected(manager):
+    with pytest.raises(ValueError):
+        manager.get("../other")
+    with pytest.raises(ValueError):
+        manager.get_for_read("a" * 65)
+
+
+def test_read_of_unknown_project_touches_nothing(manager):
+    assert manager.get_for_read("new-project") is None
+    assert os.listdir(manager.root) == []
+    assert manager.stats()["loaded"] == 0
+
+
+def test_reads_never_fall_back_to_the_global_store(manager):
+    rows = unit_rows(2, 0)
+    manager.default.append(rows, ["alice", "bob"])
+
+    # Project enrolled elsewhere: its shard exists but holds none of these
+    manager.get("acme").append(unit_rows(1, 1), ["carol"])
+
+    assert manager.get_for_read("globex") is None
+    acme = manager.get_for_read("acme")
+    _, ids = acme.search(rows[0], k=1)
+    assert acme.resolve(np.ones(1), ids[0])[0][0] == "carol"
+    assert len(acme.user_vectors("alice")) == 0
+
+
+def test_projects_are_isolated(manager):
+    manager.get("acme").append(unit_rows(1, 2), ["alice"])
+    manager.get("globex").append(unit_rows(1, 3), ["alice"])
+
+    acme, globex = manager.get_for_read("acme"), manager.get_for_read("globex")
+    np.testing.assert_array_equal(acme.user_vectors("alice"), unit_rows(1, 2))
+    np.testing.assert_array_equal(globex.user_vectors("alice"), unit_rows(1, 3))
+
+
+def test_migrate_copies_only_named_users(manager):
+    rows = unit_rows(3, 4)
+    manager.default.append(rows, ["alice", "alice", "bob"])
+
+    assert manager.migrate("acme", ["alice"]) == 2
+    assert manager.migrate("acme", ["alice"]) == 0  # re-run is a no-op
+
+    acme = manager.get_for_read("acme")
+    assert acme.users() == ["alice"]
+    np.testing.assert_array_equal(acme.user_vectors("alice"), rows[:2])
+
+
+def test_migrate_requires_users(manager):
+    manager.default.append(unit_rows(1, 5), ["alice"])
+    with pytest.raises(ValueError):
+        manager.migrate("acme", None)
+    with pytest.raises(ValueError):
+        manager.migrate("acme", [])
+    assert manager.get_for_read("acme") is None
+
+
+def test_reopened_shard_is_found_after_eviction(tmp_path, manager):
+    manager.max_loaded = 1
+    manager.get("acme").append(unit_rows(1, 6), ["alice"])
+    manager.get("globex")
+    assert manager.stats()["evictions"] == 1
+
+    acme = manager.get_for_read("acme")
+    assert acme is not None and acme.users() == ["alice"]
+
+
+def test_eviction_under_concurrent_forwarding(tmp_path):
+    # Two workers on the same shard root; A owns the shard and keeps
+    # evicting it (closing its writer socket) while B forwards appends
+    default = SharedFaceIndex(str(tmp_path / "global"), DIM, tier="flat")
+    root = str(tmp_path / "shards")
+    worker_a = ShardManager(root, DIM, default=default, max_loaded=1, tier="flat")
+    worker_b = ShardManager(root, DIM, default=default, tier="flat")
+    try:
+        assert worker_a.get("acme").is_writer
+        shard_b = worker_b.get("acme")
+        assert not shard_b.is_writer
+
+        errors, appended = [], []
+        def enroll(seed):
+            try:
+                for i in range(20):
+                    appended.append(shard_b.append(unit_rows(1, 100 * seed + i), [f"user{seed}"]))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=enroll, args=(seed,)) for seed in range(4)]
+        for t in threads:
+            t.start()
+        while any(t.is_alive() for t in threads):
+            worker_a.get("globex")     # evicts acme: its writer closes
+            worker_a.get("acme")
+        for t in threads:
+            t.join()
+
+        assert errors == []
+        assert sorted(appended) == list(range(80))
+        shard_b.refresh()
+        assert shard_b.count == 80
+        for seed in range(4):
+            assert len(shard_b.user_vectors(f"user{seed}")) == 20
+    finally:
+        worker_a.close()
+        worker_b.close()
+        default.close()
+
+
+def test_forwarding_survives_writer_closing_mid_append(tmp_path):
+    default = SharedFaceIndex(str(tmp_path / "global"), DIM, tier="flat")
+    root = str(tmp_path / "shards")
+    worker_a = ShardManager(root, DIM, default=default, max_loaded=1, tier="flat")
+    worker_b = ShardManager(root, DIM, default=default, tier="flat")
+    try:
+        worker_a.get("acme")
+        shard_b = worker_b.get("acme")
+
+        # B loses the election, then A evicts the shard before B connects
+        elect = shard_b.start_writer_election
+        def lose_then_evict():
+            won = elect()
+            if not won:
+                worker_a.get("globex")
+            shard_b.start_writer_election = elect
+            return won
+        shard_b.start_writer_election = lose_then_evict
+
+        assert shard_b.append(unit_rows(1, 7), ["alice"]) == 0
+        assert shard_b.is_writer
+        assert shard_b.user_of(0) == "alice"
+    finally:
+        worker_a.close()
+        worker_b.close()
+        default.close()
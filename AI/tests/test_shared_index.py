@@ -0,0 +1,133 @@
+import threading
+
+import numpy as np
+import pytest
+
+from shared_index import SharedFaceIndex
+
+DIM = 8
+
+
+def unit_rows(n, seed):
+    rows = np.random.default_rng(seed).standard_normal((n, DIM)).astype("float32")
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+@pytest.fixture
+def base(tmp_path):
+    return str(tmp_path / "store")
+
+@pytest.fixture
+def handles():
+    opened = []
+    yield opened
+    for handle in opened:
+        handle.close()
+
+def open_store(base, handles):
+    store = SharedFaceIndex(base, DIM, tier="flat")
+    handles.append(store)
+    return store
+
+
+def test_append_then_search(base, handles):
+    store = open_store(base, handles)
+    assert store.start_writer_election()
+
+    rows = unit_rows(4, 0)
+    assert store.append(rows[:2], ["alice", "alice"]) == 0
+    assert store.append(rows[2:], ["bob", "bob"]) == 2
+
+    _, ids = store.search(rows[3], k=1)
+    assert ids[0, 0] == 3
+    assert store.user_of(3) == "bob"
+    np.testing.assert_array_equal(store.user_vectors("alice"), rows[:2])
+    assert sorted(store.users()) == ["alice", "bob"]
+
+
+def test_reader_refresh_picks_up_new_rows(base, handles):
+    writer = open_store(base, handles)
+    writer.start_writer_election()
+    reader = open_store(base, handles)
+    assert reader.count == 0
+
+    writer.append(unit_rows(3, 1), ["alice", "bob", "carol"])
+    assert reader.refresh()
+    assert not reader.refresh()  # nothing new
+    assert reader.count == 3
+    assert [reader.user_of(i) for i in range(3)] == ["alice", "bob", "carol"]
+
+
+def test_concurrent_refresh_labels_each_row_once(base, handles):
+    writer = open_store(base, handles)
+    writer.start_writer_election()
+    reader = open_store(base, handles)
+
+    # Readers refresh while rows are still being appended, so threads race
+    # with headers of different ages
+    batches = 40
+    appending = threading.Event()
+    appending.set()
+    errors = []
+    def refresh_loop():
+        try:
+            while appending.is_set():
+                reader.refresh()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=refresh_loop) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for batch in range(batches):
+        writer.append(unit_rows(2, batch), [f"user{batch}"] * 2)
+    appending.clear()
+    for t in threads:
+        t.join()
+    reader.refresh()
+
+    assert errors == []
+    assert reader.count == reader.reverse.size == 2 * batches
+    assert len(reader.vectors) == reader.count
+    for batch in range(batches):
+        np.testing.assert_array_equal(reader.reverse.rows_of(f"user{batch}"), [2 * batch, 2 * batch + 1])
+
+
+def test_non_writer_forwards_appends(base, handles):
+    writer = open_store(base, handles)
+    assert writer.start_writer_election()
+    other = open_store(base, handles)
+    assert not other.start_writer_election()
+
+    rows = unit_rows(3, 2)
+    writer.append(rows[:1], ["alice"])
+    assert other.append(rows[1:], ["bob", "carol"]) == 1
+    assert not other.is_writer
+
+    # Written by the owner, visible to both
+    assert writer.user_of(2) == "carol"
+    other.refresh()
+    assert other.user_of(1) == "bob"
+    _, ids = other.search(rows[2], k=1)
+    assert ids[0, 0] == 2
+
+
+def test_closed_writer_hands_over(base, handles):
+    writer = open_store(base, handles)
+    writer.start_writer_election()
+    writer.append(unit_rows(1, 3), ["alice"])
+    writer.close()
+
+    other = open_store(base, handles)
+    assert other.append(unit_rows(1, 4), ["bob"]) == 1
+    assert other.is_writer
+
+
+def test_append_requires_one_user_per_vector(base, handles):
+    store = open_store(base, handles)
+    with pytest.raises(ValueError):
+        store.append(unit_rows(2, 5), ["alice"])
+
+
+def test_rejects_store_of_other_dimension(base, handles):
+    open_store(base, handles)
+    with pytest.raises(ValueError):
+        SharedFaceIndex(base, DIM * 2)
@@ -77,7 +77,7 @@ export async function POST(req: NextRequest) {
     aiFormData.append("image", image);
 
     const aiEngineUrl = process.env.NEXT_FACE_AUTH_URL || "http://147.93.86.218:8000";
-    const pythonUrl = `${aiEngineUrl}/authenticate`;
+    const pythonUrl = `${aiEngineUrl}/authenticate?project_id=${project.id}`;
 
     const aiResponse = await fetch(pythonUrl, {
       method: "POST",
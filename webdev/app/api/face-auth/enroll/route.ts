@@ -77,7 +77,7 @@ export async function POST(req: NextRequest) {
     aiFormData.append("image", image);
 
     const aiEngineUrl = process.env.NEXT_FACE_AUTH_URL || "http://147.93.86.218:8000";
-    const pythonUrl = `${aiEngineUrl}/enroll?user_id=${userId}`;
+    const pythonUrl = `${aiEngineUrl}/enroll?user_id=${userId}&project_id=${project.id}`;
 
     // calling the python face auth api
     const aiResponse = await fetch(pythonUrl, {